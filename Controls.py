@@ -5,9 +5,16 @@ from PySide6.QtWidgets import QPushButton
 
 from DataSetPy.dataset import UltrDetDataSet, UltrClasDataSet
 from ModelPy.model import YoloModel, MySignals
+from utils.scheduler import JobCanceledError
 
 
 class DataSetControl(QThread):
+    RESOURCE = "data"  # 调度器中的资源类型，见 utils/scheduler.py
+    # 进度 (阶段, 已完成数量, 总数, 每秒处理数量, 预计剩余秒数)，总数未知时为 0，剩余时间未知时为 -1
+    progress_signal = Signal(str, int, int, float, float)
+    # 出错时发出错误信息，之后仍会发出 finished
+    error_signal = Signal(str)
+
     def __init__(self, label_tool_path: str, org_image_dir: str, obj_classes: tuple):
         super().__init__()
         self.label_tool_path = label_tool_path
@@ -23,34 +30,73 @@ class DataSetControl(QThread):
         self.exception = None
         return
 
+    def run(self):
+        try:
+            # 排队期间已经被取消
+            if self.isInterruptionRequested():
+                raise JobCanceledError("Job Canceled Before Start")
+            self.run_task()
+            result = self.dataset_obj.last_result if self.dataset_obj is not None else None
+            if result is not None and result.canceled:
+                raise JobCanceledError(f"Job Canceled, {result}")
+        except JobCanceledError as e:
+            self.exit_code = 1
+            self.exception = e
+        except Exception as e:
+            self.exit_code = 1
+            self.exception = e
+            self.error_signal.emit(str(e))
+        return
+
+    def run_task(self):
+        pass
+
+    def report_progress(self, stage, done, total, rate, eta):
+        # 数据集处理过程中的进度回调，同时检查任务是否被取消
+        if self.isInterruptionRequested():
+            raise JobCanceledError(f"Job Canceled at {stage}: {done}/{total}")
+        self.progress_signal.emit(stage, done, total, rate, eta)
+        return
+
+    def cancel(self):
+        # 数据处理在下一次汇报进度时中断，标注工具等外部进程直接结束
+        self.requestInterruption()
+        if self.dataset_obj is not None:
+            self.dataset_obj.shutdown()
+        return
+
 
 class ClasDataLabelControl(DataSetControl):
     def __init__(self, label_tool_path, org_image_dir, obj_classes):
         super().__init__(label_tool_path, org_image_dir, obj_classes)
         self.dataset_obj = UltrClasDataSet(self.org_image_dir, self.split_save_dir, self.label_txt_path)
+        self.dataset_obj.progress_callback = self.report_progress
         return
 
-    def run(self):
-        try:
-            self.dataset_obj.label_data()
-        except Exception as e:
-            self.exit_code = 1
-            self.exception = e
+    def run_task(self):
+        self.dataset_obj.label_data()
         return
 
 
 class ClasDataSplitControl(DataSetControl):
-    def __init__(self, label_tool_path, org_image_dir, obj_classes, train_percent: float):
+    def __init__(self, label_tool_path, org_image_dir, obj_classes, train_percent: float, num_workers: int = None,
+                 incremental: bool = False, materialize_mode: str = "copy", split_strategy=None, shard_size_mb: int = 0,
+                 resize_config=None, check_images: bool = False):
         super().__init__(label_tool_path, org_image_dir, obj_classes)
-        self.dataset_obj = UltrClasDataSet(self.org_image_dir, self.split_save_dir, self.label_txt_path)
+        self.dataset_obj = UltrClasDataSet(self.org_image_dir, self.split_save_dir, self.label_txt_path, incremental)
+        self.dataset_obj.progress_callback = self.report_progress
         self.train_data_percent = train_percent
-
-    def run(self):
-        try:
-            self.dataset_obj.convert_and_split(self.train_data_percent)
-        except Exception as e:
-            self.exit_code = 1
-            self.exception = e
+        self.num_workers = num_workers
+        self.materialize_mode = materialize_mode
+        self.split_strategy = split_strategy
+        self.shard_size_mb = shard_size_mb
+        self.resize_config = resize_config
+        self.check_images = check_images
+
+    def run_task(self):
+        self.dataset_obj.convert_and_split(self.train_data_percent, self.num_workers, self.materialize_mode,
+                                           self.split_strategy, self.shard_size_mb, self.resize_config,
+                                           self.check_images)
         return
 
 
@@ -59,118 +105,191 @@ class DetDataLabelControl(DataSetControl):
         super().__init__(label_tool_path, org_image_dir, obj_classes)
         self.dataset_obj = UltrDetDataSet(self.org_image_dir, self.split_save_dir, self.label_txt_path,
                                           self.label_tool_path)
+        self.dataset_obj.progress_callback = self.report_progress
         return
 
-    def run(self):
-        try:
-            self.dataset_obj.label_data()
-        except Exception as e:
-            self.exit_code = 1
-            self.exception = e
+    def run_task(self):
+        self.dataset_obj.label_data()
         return
 
 
 class DetDataSplitControl(DataSetControl):
-    def __init__(self, label_tool_path, org_image_dir, obj_classes, train_percent: float):
+    def __init__(self, label_tool_path, org_image_dir, obj_classes, train_percent: float, num_workers: int = None,
+                 incremental: bool = False, materialize_mode: str = "copy", split_strategy=None, shard_size_mb: int = 0,
+                 resize_config=None, check_images: bool = False, tile_config=None, label_converter=None):
         super().__init__(label_tool_path, org_image_dir, obj_classes)
         self.dataset_obj = UltrDetDataSet(self.org_image_dir, self.split_save_dir, self.label_txt_path,
-                                          self.label_tool_path)
+                                          self.label_tool_path, incremental, label_converter)
+        self.dataset_obj.progress_callback = self.report_progress
         self.train_data_percent = train_percent
-
-    def run(self):
-        try:
-            self.dataset_obj.convert_and_split(self.train_data_percent)
-        except Exception as e:
-            self.exit_code = 1
-            self.exception = e
+        self.num_workers = num_workers
+        self.materialize_mode = materialize_mode
+        self.split_strategy = split_strategy
+        self.shard_size_mb = shard_size_mb
+        self.resize_config = resize_config
+        self.check_images = check_images
+        self.tile_config = tile_config
+
+    def run_task(self):
+        self.dataset_obj.convert_and_split(self.train_data_percent, self.num_workers, self.materialize_mode,
+                                           self.split_strategy, self.shard_size_mb, self.resize_config,
+                                           self.check_images, self.tile_config)
         return
 
 
 class ModelControl(QThread):
-    def __init__(self, train_tool_path: str, pretrained_model_path: str, template_cfg_path: str):
+    RESOURCE = "gpu"  # 调度器中的资源类型，见 utils/scheduler.py
+    # 出错时发出错误信息，之后仍会发出 finished
+    error_signal = Signal(str)
+
+    def __init__(self, train_tool_path: str, pretrained_model_path: str, template_cfg_path: str,
+                 backend: str = "cli"):
         super().__init__()
         self.train_tool_path = train_tool_path
         self.pretrained_model_path = pretrained_model_path
         self.template_cfg_path = template_cfg_path
         self.work_dir = os.path.join(os.getcwd(), "WorkDir")
-        self.model = YoloModel(self.train_tool_path, self.pretrained_model_path, self.template_cfg_path, self.work_dir)
+        self.model = YoloModel(self.train_tool_path, self.pretrained_model_path, self.template_cfg_path, self.work_dir,
+                               backend)
+
+        self.exit_code = 0
+        self.exception = None
+        return
+
+    def run(self):
+        try:
+            # 排队期间已经被取消
+            if self.isInterruptionRequested():
+                raise JobCanceledError("Job Canceled Before Start")
+            self.run_task()
+            result = self.model.last_result
+            if result is not None and result.canceled:
+                raise JobCanceledError(f"Job Canceled, {result}")
+            assert result is None or result.exit_code == 0, f"Error, Process Failed, {result}"
+        except JobCanceledError as e:
+            self.exit_code = 1
+            self.exception = e
+        except Exception as e:
+            self.exit_code = 1
+            self.exception = e
+            self.error_signal.emit(str(e))
+        return
+
+    def run_task(self):
+        pass
+
+    def cancel(self):
+        # 结束正在运行的 yolo 进程
+        self.requestInterruption()
+        self.model.shutdown()
         return
 
 
 class ModelCheckControl(ModelControl):
+    RESOURCE = "light"
+
     def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path):
         super().__init__(train_tool_path, pretrained_model_path, template_cfg_path)
         return
 
-    def run(self):
+    def run_task(self):
         self.model.check_env()
         return
 
 
 class ModelTrainControl(ModelControl):
-    def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, train_cfg_path):
-        super().__init__(train_tool_path, pretrained_model_path, template_cfg_path)
+    def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, train_cfg_path, backend="cli"):
+        super().__init__(train_tool_path, pretrained_model_path, template_cfg_path, backend)
         self.train_cfg_path = train_cfg_path
         return
 
-    def run(self):
+    def run_task(self):
         self.model.train(self.train_cfg_path)
         # self.run_task_by_process(command)
         return
 
-    def shutdown(self):
-        self.model.shutdown()
-        return
-
 
 class ModelShowTrainInfoControl(ModelControl):
+    RESOURCE = "light"
+
     def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, server_port):
         super().__init__(train_tool_path, pretrained_model_path, template_cfg_path)
         self.server_port = server_port
         return
 
-    def run(self):
+    def run_task(self):
         self.model.show_training_curve(self.server_port)
         return
 
-    def shutdown(self):
-        self.model.shutdown()
-        return
-
 
 class ModelEvaluateControl(ModelControl):
     def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, used_ptmodel_path: str,
-                 dataset_cfg_path: str):
-        super().__init__(train_tool_path, pretrained_model_path, template_cfg_path)
+                 dataset_cfg_path: str, backend: str = "cli"):
+        super().__init__(train_tool_path, pretrained_model_path, template_cfg_path, backend)
         self.used_ptmodel_path = used_ptmodel_path
         self.dataset_cfg_path = dataset_cfg_path
         return
 
-    def run(self):
+    def run_task(self):
         self.model.evaluate(self.dataset_cfg_path, self.used_ptmodel_path)
         return
 
 
 class ModelInferenceControl(ModelControl):
     def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, used_ptmodel_path: str,
-                 test_image_path: str):
-        super().__init__(train_tool_path, pretrained_model_path, template_cfg_path)
+                 test_image_path: str, backend: str = "cli", batch_size: int = 16, result_format: str = "jsonl",
+                 onnx_threads: tuple = (0, 1)):
+        super().__init__(train_tool_path, pretrained_model_path, template_cfg_path, backend)
         self.used_ptmodel_path = used_ptmodel_path
         self.test_image_path = test_image_path
+        # 文件夹推理、onnx 模型推理时使用
+        self.batch_size = batch_size
+        self.result_format = result_format
+        self.onnx_threads = onnx_threads  # (算子内部, 算子之间) 并行线程数
+        self.stats = None
         return
 
-    def run(self):
-        self.model.inference(self.used_ptmodel_path, self.test_image_path)
+    def run_task(self):
+        if self.used_ptmodel_path.endswith(".onnx"):
+            # 导出的模型用 ONNX Runtime 在 CPU 上推理，检查部署的模型文件
+            self.stats = self.model.inference_onnx(self.used_ptmodel_path, self.test_image_path,
+                                                   batch_size=self.batch_size, fmt=self.result_format,
+                                                   intra_op_threads=self.onnx_threads[0],
+                                                   inter_op_threads=self.onnx_threads[1])
+        elif os.path.isdir(self.test_image_path):
+            self.stats = self.model.inference_folder(self.used_ptmodel_path, self.test_image_path,
+                                                     batch_size=self.batch_size, fmt=self.result_format)
+        else:
+            self.model.inference(self.used_ptmodel_path, self.test_image_path)
         return
 
 
-class ModelExportControl(ModelControl):
-    def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, used_ptmodel_path: str):
+class ModelServeControl(ModelControl):
+    # 推理服务一直运行到被停止，不占用 gpu 队列
+    RESOURCE = "light"
+
+    def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, used_ptmodel_path: str, port: int,
+                 max_batch: int = 8, max_wait_ms: float = 5.0):
         super().__init__(train_tool_path, pretrained_model_path, template_cfg_path)
         self.used_ptmodel_path = used_ptmodel_path
+        self.port = port
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
         return
 
-    def run(self):
+    def run_task(self):
+        self.model.serve(self.used_ptmodel_path, self.port, max_batch=self.max_batch, max_wait_ms=self.max_wait_ms)
+        return
+
+
+class ModelExportControl(ModelControl):
+    def __init__(self, train_tool_path, pretrained_model_path, template_cfg_path, used_ptmodel_path: str,
+                 backend: str = "cli"):
+        super().__init__(train_tool_path, pretrained_model_path, template_cfg_path, backend)
+        self.used_ptmodel_path = used_ptmodel_path
+        return
+
+    def run_task(self):
         self.model.export(self.used_ptmodel_path)
         return
 
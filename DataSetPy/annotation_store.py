@@ -0,0 +1,244 @@
+# This Python file uses the following encoding: utf-8
+# 标注缓存  labelme json 只解析一次，保存为列存储的 numpy 数组(内存映射读取)，之后按文件修改时间增量更新
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+from utils.utils import parallel_map, get_image_size
+
+
+def parse_labelme_json(json_pth):
+    """
+    进程池中执行，返回 (图片宽, 图片高, 图片路径, [(标签, 形状类型, [[x, y], ...]), ...])
+    json 中没有记录图片尺寸时，只读取图片文件头
+    """
+    with open(json_pth, "r") as fp:
+        json_info = json.load(fp)
+    image_path = json_info.get("imagePath") or ""
+    img_w, img_h = json_info.get("imageWidth"), json_info.get("imageHeight")
+    if not img_w or not img_h:
+        image_pth = os.path.join(os.path.dirname(json_pth), image_path)
+        img_w, img_h = get_image_size(image_pth) if os.path.isfile(image_pth) else (0, 0)
+    shapes = [(obj["label"], obj.get("shape_type") or "polygon", obj["points"])
+              for obj in json_info["shapes"] if len(obj["points"]) > 0]
+    return int(img_w), int(img_h), image_path, shapes
+
+
+class AnnotationStore:
+    """
+    缓存目录 save_root/.annotation_cache/<src_dir 路径哈希>，不写入标注目录，不同标注目录的缓存互不影响
+    缓存目录结构：
+        meta.json         文件名、图片路径、标签名、形状类型名、当前版本目录
+        gen_<n>/*.npy     当前版本的数组，每次更新写入新版本目录，避免覆盖正在被内存映射的文件
+    数组(F: json 文件数  S: 形状数  P: 点数)：
+        file_mtime(F) file_size(F) image_wh(F, 2) shape_start(F) shape_count(F)
+        shape_label(S) shape_type(S) point_start(S) point_count(S) points(P, 2)
+    points 使用 float64 保存，与 json 中的数值完全一致，转换得到的 yolo 标注文件与直接解析 json 相同
+    """
+    CACHE_DIR_NAME = ".annotation_cache"
+    ARRAY_DTYPES = {"file_mtime": np.int64, "file_size": np.int64, "image_wh": np.int32,
+                    "shape_start": np.int64, "shape_count": np.int32,
+                    "shape_label": np.int32, "shape_type": np.int32,
+                    "point_start": np.int64, "point_count": np.int32, "points": np.float64}
+
+    def __init__(self, src_dir: str, save_root: str):
+        self.src_dir = os.path.abspath(src_dir)
+        src_hash = hashlib.md5(os.path.normcase(self.src_dir).encode("utf8")).hexdigest()[:16]
+        self.cache_dir = os.path.join(save_root, self.CACHE_DIR_NAME, src_hash)
+        self.file_names = []
+        self.image_paths = []
+        self.labels = []
+        self.shape_types = []
+        self.generation = 0
+        self.arrays = self.__empty_arrays()
+        self.__index = dict()
+        self.__load()
+        return
+
+    def __empty_arrays(self):
+        ret = {k: np.zeros(0, dtype=t) for k, t in self.ARRAY_DTYPES.items()}
+        ret["image_wh"] = ret["image_wh"].reshape(0, 2)
+        ret["points"] = ret["points"].reshape(0, 2)
+        return ret
+
+    def __load(self):
+        meta_pth = os.path.join(self.cache_dir, "meta.json")
+        if not os.path.isfile(meta_pth):
+            return
+        with open(meta_pth, "r", encoding="utf8") as fp:
+            meta = json.load(fp)
+        gen_dir = os.path.join(self.cache_dir, f"gen_{meta['generation']}")
+        if not os.path.isdir(gen_dir):
+            return
+        self.file_names = meta["file_names"]
+        self.image_paths = meta["image_paths"]
+        self.labels = meta["labels"]
+        self.shape_types = meta["shape_types"]
+        self.generation = meta["generation"]
+        for k in self.ARRAY_DTYPES:
+            npy_pth = os.path.join(gen_dir, f"{k}.npy")
+            try:
+                self.arrays[k] = np.load(npy_pth, mmap_mode="r")
+            except ValueError:
+                # 空数组无法内存映射，直接读取(只有文件头)
+                self.arrays[k] = np.load(npy_pth)
+        self.__index = {f: i for i, f in enumerate(self.file_names)}
+        return
+
+    def __save(self, arrays, file_names, image_paths):
+        generation = self.generation + 1
+        gen_dir = os.path.join(self.cache_dir, f"gen_{generation}")
+        if os.path.isdir(gen_dir):
+            shutil.rmtree(gen_dir)
+        os.makedirs(gen_dir)
+        for k, arr in arrays.items():
+            np.save(os.path.join(gen_dir, f"{k}.npy"), np.ascontiguousarray(arr, dtype=self.ARRAY_DTYPES[k]))
+
+        meta = {"generation": generation, "file_names": file_names, "image_paths": image_paths,
+                "labels": self.labels, "shape_types": self.shape_types}
+        tmp_pth = os.path.join(self.cache_dir, "meta.json.tmp")
+        with open(tmp_pth, "w", encoding="utf8") as fp:
+            json.dump(meta, fp, ensure_ascii=False)
+        os.replace(tmp_pth, os.path.join(self.cache_dir, "meta.json"))
+
+        # 释放旧版本的内存映射后删除旧版本，其他进程仍在使用时删除失败，下次更新时再删
+        self.arrays = self.__empty_arrays()
+        self.__load()
+        for d in os.listdir(self.cache_dir):
+            if d.startswith("gen_") and d != f"gen_{generation}":
+                shutil.rmtree(os.path.join(self.cache_dir, d), ignore_errors=True)
+        return
+
+    def update(self, num_workers: int = None):
+        """
+        扫描 src_dir 下的 json 文件，只重新解析新增或修改时间、大小变化的文件
+        返回 重新解析的文件数
+        """
+        entries = []
+        with os.scandir(self.src_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        entries.sort()
+
+        old = self.arrays
+        reuse = dict()
+        to_parse = []
+        for name, mtime, size in entries:
+            i = self.__index.get(name)
+            if i is not None and old["file_mtime"][i] == mtime and old["file_size"][i] == size:
+                reuse[name] = i
+            else:
+                to_parse.append(name)
+        if len(to_parse) == 0 and len(reuse) == len(self.file_names):
+            return 0
+
+        parsed = parallel_map(parse_labelme_json, [os.path.join(self.src_dir, f) for f in to_parse], num_workers,
+                              use_process=True)
+        parsed = dict(zip(to_parse, parsed))
+        label_index = {n: i for i, n in enumerate(self.labels)}
+        type_index = {n: i for i, n in enumerate(self.shape_types)}
+
+        parts = {k: [] for k in self.ARRAY_DTYPES}
+        file_names, image_paths = [], []
+        shape_offset, point_offset = 0, 0
+        for name, mtime, size in entries:
+            if name in reuse:
+                i = reuse[name]
+                s0, sn = int(old["shape_start"][i]), int(old["shape_count"][i])
+                wh = old["image_wh"][i]
+                image_path = self.image_paths[i]
+                shape_label = old["shape_label"][s0:s0 + sn]
+                shape_type = old["shape_type"][s0:s0 + sn]
+                point_count = old["point_count"][s0:s0 + sn]
+                p0 = int(old["point_start"][s0]) if sn > 0 else 0
+                pn = int(point_count.sum())
+                points = old["points"][p0:p0 + pn]
+            else:
+                # 标签名和形状类型名只追加，旧的序号保持不变
+                img_w, img_h, image_path, shapes = parsed[name]
+                wh = (img_w, img_h)
+                for label, shape_type, _ in shapes:
+                    if label not in label_index:
+                        label_index[label] = len(self.labels)
+                        self.labels.append(label)
+                    if shape_type not in type_index:
+                        type_index[shape_type] = len(self.shape_types)
+                        self.shape_types.append(shape_type)
+                sn = len(shapes)
+                shape_label = np.asarray([label_index[s[0]] for s in shapes], dtype=np.int32)
+                shape_type = np.asarray([type_index[s[1]] for s in shapes], dtype=np.int32)
+                point_count = np.asarray([len(s[2]) for s in shapes], dtype=np.int32)
+                points = np.asarray([p for s in shapes for p in s[2]], dtype=np.float64).reshape(-1, 2)
+                pn = len(points)
+
+            file_names.append(name)
+            image_paths.append(image_path)
+            parts["file_mtime"].append([mtime, ])
+            parts["file_size"].append([size, ])
+            parts["image_wh"].append(np.asarray(wh, dtype=np.int32).reshape(1, 2))
+            parts["shape_start"].append([shape_offset, ])
+            parts["shape_count"].append([sn, ])
+            parts["shape_label"].append(shape_label)
+            parts["shape_type"].append(shape_type)
+            # 每个形状的点在 points 中的起点
+            parts["point_start"].append(point_offset + np.concatenate([[0], np.cumsum(point_count)[:-1]]).astype(np.int64)
+                                        if sn > 0 else np.zeros(0, dtype=np.int64))
+            parts["point_count"].append(point_count)
+            parts["points"].append(points)
+            shape_offset += sn
+            point_offset += pn
+
+        arrays = self.__empty_arrays()
+        for k, lst in parts.items():
+            if len(lst) > 0:
+                arrays[k] = np.concatenate([np.asarray(a, dtype=self.ARRAY_DTYPES[k]) for a in lst])
+        self.__save(arrays, file_names, image_paths)
+        return len(to_parse)
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def index_of(self, json_file: str):
+        return self.__index.get(json_file)
+
+    def get_image_size(self, file_idx: int):
+        w, h = self.arrays["image_wh"][file_idx]
+        return int(w), int(h)
+
+    def get_shapes(self, file_idx: int):
+        # 返回 [(标签, 形状类型, (n, 2) 点坐标), ...]，顺序与 json 中一致
+        a = self.arrays
+        s0, sn = int(a["shape_start"][file_idx]), int(a["shape_count"][file_idx])
+        ret = []
+        for s in range(s0, s0 + sn):
+            p0, pn = int(a["point_start"][s]), int(a["point_count"][s])
+            ret.append((self.labels[a["shape_label"][s]], self.shape_types[a["shape_type"][s]],
+                        np.asarray(a["points"][p0:p0 + pn])))
+        return ret
+
+    def get_boxes(self, classes: list):
+        """
+        全部属于 classes 的形状的外接矩形，全部为数组运算
+        返回 (所在文件序号 int32, 类别序号 int32, (N, 4) x1 y1 x2 y2 float32)
+        """
+        a = self.arrays
+        # 标签序号 -> 类别序号，不在 classes 中的为 -1
+        label2cls = np.asarray([classes.index(n) if n in classes else -1 for n in self.labels] + [-1, ],
+                               dtype=np.int32)
+        file_idx = np.repeat(np.arange(len(self.file_names), dtype=np.int32), np.asarray(a["shape_count"]))
+        cls = label2cls[np.asarray(a["shape_label"])] if len(file_idx) > 0 else np.zeros(0, dtype=np.int32)
+        if len(file_idx) == 0:
+            return file_idx, cls, np.zeros((0, 4), dtype=np.float32)
+
+        points = np.asarray(a["points"])
+        starts = np.asarray(a["point_start"])
+        xyxy = np.stack([np.minimum.reduceat(points[:, 0], starts),
+                         np.minimum.reduceat(points[:, 1], starts),
+                         np.maximum.reduceat(points[:, 0], starts),
+                         np.maximum.reduceat(points[:, 1], starts)], axis=1)
+        mask = cls >= 0
+        return file_idx[mask], cls[mask], xyxy[mask].astype(np.float32)
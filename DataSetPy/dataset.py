@@ -3,22 +3,37 @@
 from abc import ABC, abstractmethod
 import os
 import shutil
-import json
-import random
-import subprocess
-from PIL import Image
 
-from utils.utils import create_dir, get_timestamp, copy_files
+from utils.utils import create_dir, get_timestamp, copy_files, remove_files, parallel_map, get_image_size, \
+    materialize_file, ProgressMeter
+from DataSetPy.manifest import DataSetManifest
+from DataSetPy.split_strategy import SplitStrategy, RandomSplit, StratifiedSplit
+from DataSetPy.tiling import TileConfig, tile_one_image, find_tiles
+from DataSetPy.annotation_store import AnnotationStore
+from DataSetPy.label_format import LabelConverter, YoloDetConverter
+from DataSetPy.shard import pack_dataset
+from DataSetPy.resize_cache import ResizeConfig, ResizeCache
+from DataSetPy.preprocess import check_images as check_image_files, save_quarantine
+from utils.process_runner import ProcessRunner
+
+# 分类数据集的扫描结果缓存 {数据集路径: 扫描结果}，标注和切分两步共用
+_SCAN_CACHE = dict()
 
 
 # 向界面开放的接口
 class DataSet(ABC):
-    def __init__(self, src_dir: str, save_dir: str, label_txt_pth: str):
+    def __init__(self, src_dir: str, save_dir: str, label_txt_pth: str, incremental: bool = False):
         self.IMAGE_FORMAT = (".jpeg", ".jpg", ".bmp", ".png")
         assert os.path.isdir(src_dir), f"Error, dir:[{src_dir}] Not Found!"
         self.src_dir = src_dir
 
-        save_dir = os.path.join(save_dir, f"dataset_{get_timestamp()}")
+        # 增量模式：复用上一次由 src_dir 切分的数据集目录，只处理新增或修改过的样本
+        self.incremental = incremental
+        self.manifest = None
+        save_root = save_dir
+        save_dir = DataSetManifest.find_dataset_dir(save_root, src_dir) if incremental else None
+        if save_dir is None:
+            save_dir = os.path.join(save_root, f"dataset_{get_timestamp()}")
         self.save_dir = save_dir
 
         assert os.path.isfile(label_txt_pth), f"Error, file:[{label_txt_pth}] Not Found!"
@@ -27,37 +42,167 @@ class DataSet(ABC):
         self.CLASSES = []
         with open(label_txt_pth, "r") as fp:
             self.CLASSES = [line.strip() for line in fp.readlines() if line not in ["__ignore__", "_background_"]]
+
+        # 进度回调 progress_callback(阶段, 已完成数量, 总数, 每秒处理数量, 预计剩余秒数)，由界面设置
+        self.progress_callback = None
+        # 标注工具等外部进程，shutdown 时结束
+        self.runner = None
+        self.last_result = None  # 最近一次外部进程的 ProcessResult
         return
 
+    def shutdown(self):
+        # 可在其他线程中调用：结束正在运行的外部进程
+        if self.runner is not None:
+            self.runner.stop()
+        return
+
+    def get_progress(self, stage: str, total: int):
+        # 返回 parallel_map 的 callback，没有设置进度回调时为 None
+        if self.progress_callback is None:
+            return None
+        return ProgressMeter(stage, total, self.progress_callback)
+
+    def plan_incremental(self, samples: dict, train_percent: float, split_strategy: SplitStrategy,
+                         labels: dict = None, num_workers: int = None, settings: dict = None):
+        """
+        samples: {样本名: [相对 src_dir 的文件路径, ...]}
+        labels: {样本名: 类别列表}，切分策略需要类别信息时提供
+        settings: 影响输出结果的配置，与上次不同时全部样本重新生成
+        返回 ({需要处理的样本名: 切分}, 已删除样本的清单记录{样本名: (切分, 文件列表)})
+        """
+        self.manifest = DataSetManifest(self.save_dir, self.src_dir, self.CLASSES, settings)
+        new_keys, changed_keys, removed_keys = self.manifest.diff(samples, num_workers)
+
+        removed = dict()
+        for key in removed_keys:
+            removed[key] = (self.manifest.get_split(key), self.manifest.get_files(key))
+            self.manifest.remove(key)
+        # 有变化的样本保持原来的切分，先删除旧的输出
+        for key in changed_keys:
+            removed[key] = (self.manifest.get_split(key), self.manifest.get_files(key))
+
+        # 已有样本保持原切分，只给新样本分配切分
+        new_set = set(new_keys)
+        exist = {key: self.manifest.get_split(key) for key in samples if key not in new_set}
+        todo = {key: exist[key] for key in changed_keys}
+        labels = labels or dict()
+        todo.update(split_strategy.split([(k, labels.get(k, [])) for k in samples], train_percent, exist))
+
+        print(f"Incremental Split: New {len(new_keys)}, Changed {len(changed_keys)}, Removed {len(removed_keys)}, "
+              f"Unchanged {len(samples) - len(new_keys) - len(changed_keys)}")
+        return todo, removed
+
     @abstractmethod
     def label_data(self):
         # cls: 打开文件夹，新建各个类别的子文件夹，让用户自己分；  det：打开labelme，用户自己标注
         pass
 
     @abstractmethod
-    def convert_and_split(self, train_percent: float):
+    def convert_and_split(self, train_percent: float, num_workers: int = None, materialize_mode: str = "copy",
+                          split_strategy: SplitStrategy = None, shard_size_mb: int = 0,
+                          resize_config: ResizeConfig = None, check_images: bool = False):
+        # num_workers: 并行处理的线程数，None 自动确定，1 为串行
+        # materialize_mode: 图片生成方式 copy/hardlink/symlink/reflink，不支持时自动退回 copy
+        # split_strategy: 切分策略，见 split_strategy.py，None 时使用各数据集的默认策略
+        # shard_size_mb: 大于 0 时切分完成后额外打包为分片(单个分片的大小上限)，见 shard.py
+        # resize_config: 不为 None 时图片先缩放到训练尺寸(有缓存)，数据集中保存缩放后的图片，见 resize_cache.py
+        # check_images: 生成数据集前检查图片能否完整解码(有缓存)，损坏的图片不放入数据集
         pass
 
+    def find_bad_images(self, rel_pths: list, num_workers: int = None):
+        """
+        返回 损坏的图片相对路径集合，结果缓存放在数据集保存目录的上一级，多次切分共用
+        损坏列表写入 数据集目录/quarantine.json，原图保持不动
+        """
+        cache_pth = os.path.join(os.path.dirname(self.save_dir), ".integrity_cache.json")
+        bad = check_image_files([os.path.join(self.src_dir, p) for p in rel_pths], cache_pth, num_workers)
+        bad = {os.path.relpath(p, self.src_dir): e for p, e in bad.items()}
+        if len(bad) > 0:
+            json_pth = save_quarantine(bad, self.save_dir)
+            print(f"Integrity Check: {len(bad)} Bad Images Excluded, See {os.path.abspath(json_pth)}")
+        else:
+            # 增量模式下上次的损坏列表已经过期
+            remove_files([os.path.join(self.save_dir, "quarantine.json"), ])
+        return set(bad)
+
+    def prepare_resized_images(self, rel_pths: list, resize_config: ResizeConfig, num_workers: int = None,
+                               keep_rel_pths: list = None):
+        # 返回 {原图相对路径: 缩放后的缓存图片路径}，缓存放在数据集保存目录的上一级，多次切分共用
+        # keep_rel_pths: 数据集中的全部原图，增量模式下未变化样本的缓存图片保留
+        cache = ResizeCache(self.src_dir, resize_config, os.path.dirname(self.save_dir))
+        return cache.prepare(rel_pths, num_workers, keep_rel_pths)
+
+    def pack_shards(self, shard_size_mb: int, num_workers: int = None):
+        shard_dir = pack_dataset(self.save_dir, shard_size_mb, num_workers=num_workers)
+        print(f"DataSet Pack Complete. {os.path.abspath(shard_dir)}")
+        return shard_dir
+
 
 class UltrClasDataSet(DataSet):
-    def __init__(self, src_dir: str, save_dir: str, label_txt_pth: str):
+    def __init__(self, src_dir: str, save_dir: str, label_txt_pth: str, incremental: bool = False):
         """
         如果 src_dir 下全是文件夹，则认为已经标注完成，直接复制到目标路径下
         如果 src_dir 下全是图片，则认为没有标注，创建文件目录结构，由用户将图片归类
         """
-        super().__init__(src_dir, save_dir, label_txt_pth)
+        super().__init__(src_dir, save_dir, label_txt_pth, incremental)
+        self.scan_result = None
         return
 
-    def __is_image(self, tmp_path: str):
-        # 判断指定的文件是否是图片
-        if not os.path.isfile(tmp_path):
-            return False
-
-        for ends in self.IMAGE_FORMAT:
-            if tmp_path.lower().endswith(ends):
-                return True
+    def __get_scan_key(self, check_path):
+        # 根目录和各类别文件夹的修改时间，文件增删改名都会改变所在文件夹的修改时间
+        key = [("", os.stat(check_path).st_mtime_ns), ]
+        with os.scandir(check_path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    key.append((entry.name, entry.stat().st_mtime_ns))
+        return tuple(sorted(key))
 
-        return False
+    def iter_scan_dataset(self, check_path, progress_step: int = 1000):
+        """
+        流式扫描数据集，一次遍历收集全部问题，每扫描 progress_step 个文件 yield 一次已扫描的文件数
+        结果保存在 self.scan_result: {"key", "file_num", "problems": [...], "images": {类别: [图片名]}}
+        文件夹修改时间没变时直接复用上一次的扫描结果(标注和切分两步只需扫描一次)
+        """
+        check_path = os.path.abspath(check_path)
+        key = self.__get_scan_key(check_path)
+        cached = _SCAN_CACHE.get(check_path)
+        if cached is not None and cached["key"] == key and cached["classes"] == self.CLASSES:
+            self.scan_result = cached
+            yield cached["file_num"]
+            return
+
+        problems = []
+        images = {clas: [] for clas in self.CLASSES}
+        file_num = 0
+        dir_names = set()
+        with os.scandir(check_path) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    problems.append(f"Not a Valid Directory: {entry.path}")
+                elif entry.name not in images:
+                    problems.append(f"Dir Name:{entry.name} Not in Class Names")
+                else:
+                    dir_names.add(entry.name)
+        for clas in self.CLASSES:
+            if clas not in dir_names:
+                problems.append(f"Class Name:{clas} Has No Dir")
+
+        for clas in sorted(dir_names):
+            with os.scandir(os.path.join(check_path, clas)) as it:
+                for entry in it:
+                    file_num += 1
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in self.IMAGE_FORMAT:
+                        images[clas].append(entry.name)
+                    else:
+                        problems.append(f"Not a Valid Image: {entry.path}")
+                    if file_num % progress_step == 0:
+                        yield file_num
+        yield file_num
+
+        self.scan_result = {"key": key, "classes": list(self.CLASSES), "file_num": file_num,
+                            "problems": problems, "images": images}
+        _SCAN_CACHE[check_path] = self.scan_result
+        return
 
     def __check_dataset(self, check_path):
         """
@@ -70,37 +215,29 @@ class UltrClasDataSet(DataSet):
         if not os.path.isdir(check_path):
             return 1, f"Not a Valid Directory: {check_path}"
 
-        path_list = os.listdir(check_path)
-        for p in path_list:
-            tmp_dir = os.path.join(check_path, p)
-            if not os.path.isdir(tmp_dir):
-                return 1, f"Not a Valid Directory: {tmp_dir}"
-
-        if len(self.CLASSES) != len(path_list):
-            return 1, f"CLASSES Num:{len(self.CLASSES)} != Dir Num:{len(path_list)}"
-
-        sorted_path_list = sorted(path_list)
-        sorted_classes = sorted(self.CLASSES)
-        for clas_name, dir_name in zip(sorted_classes, sorted_path_list):
-            if clas_name != dir_name:
-                return 1, f"Dir Name:{dir_name} != Class Name:{clas_name}"
-
-        for dirpath, dirname, files in os.walk(check_path):
-            for file in files:
-                image_path = os.path.join(dirpath, file)
-                if not self.__is_image(image_path):
-                    return 1, f"Not a Valid Image: {image_path}"
-
+        # 扫描前不知道文件总数
+        progress = self.get_progress("Scan", 0)
+        for file_num in self.iter_scan_dataset(check_path):
+            if progress is not None:
+                progress(file_num)
+
+        problems = self.scan_result["problems"]
+        if len(problems) > 0:
+            message = "\n".join(problems[:20])
+            if len(problems) > 20:
+                message += f"\n... {len(problems)} Problems in Total"
+            return 1, message
         return 0, "DataSet Structure Correct"
 
     def __create_dataset_dir(self):
         # dataset_root/(train|val)/(clas1|clas2|clas3)
         ret = dict()
-        ret["train_img_dir"] = create_dir(os.path.join(self.save_dir, "train"))
-        ret["val_img_dir"] = create_dir(os.path.join(self.save_dir, "val"))
+        is_rm = not self.incremental
+        ret["train_img_dir"] = create_dir(os.path.join(self.save_dir, "train"), is_rm)
+        ret["val_img_dir"] = create_dir(os.path.join(self.save_dir, "val"), is_rm)
         for k, d in ret.items():
             for clas in self.CLASSES:
-                create_dir(os.path.join(d, clas))
+                create_dir(os.path.join(d, clas), is_rm)
         return ret
 
     def label_data(self):
@@ -108,136 +245,285 @@ class UltrClasDataSet(DataSet):
         assert status == 0, message
         return
 
-    def convert_and_split(self, train_percent: float):
+    def convert_and_split(self, train_percent: float, num_workers: int = None, materialize_mode: str = "copy",
+                          split_strategy: SplitStrategy = None, shard_size_mb: int = 0,
+                          resize_config: ResizeConfig = None, check_images: bool = False):
         # 图片区分文件夹保存
+        # 检查数据集，标注步骤扫描过且没有变化时直接复用扫描结果
+        status, message = self.__check_dataset(self.src_dir)
+        assert status == 0, message
+        # 默认按类别分层，每个类别分别保持训练集占比
+        if split_strategy is None:
+            split_strategy = StratifiedSplit()
+
         # 创建文件夹结构
         save_dir_structure = self.__create_dataset_dir()
 
-        # 按比例切分图片数据
+        # 样本名为 类别/图片名
+        samples = dict()
+        labels = dict()
         for clas in self.CLASSES:
-            image_dir = os.path.join(self.src_dir, clas)
-            train_save_dir = os.path.join(save_dir_structure["train_img_dir"], clas)
-            val_save_dir = os.path.join(save_dir_structure["val_img_dir"], clas)
-
-            image_lst = os.listdir(image_dir)
-            random.shuffle(image_lst)
-            train_image_num = int(len(image_lst) * train_percent)
-            train_image_lst = image_lst[:train_image_num]
-            val_image_lst = image_lst[train_image_num:]
-            copy_files(image_dir, train_save_dir, train_image_lst)
-            copy_files(image_dir, val_save_dir, val_image_lst)
+            for f in self.scan_result["images"][clas]:
+                samples[f"{clas}/{f}"] = [os.path.join(clas, f), ]
+                labels[f"{clas}/{f}"] = [clas, ]
+        # 损坏的图片不参与切分，增量模式下之前生成的输出会被删除
+        if check_images:
+            bad = self.find_bad_images([p[0] for p in samples.values()], num_workers)
+            samples = {k: p for k, p in samples.items() if p[0] not in bad}
+        # 按图片内容分组的策略(如去重分组)先读取图片
+        if split_strategy.NEED_IMAGES:
+            split_strategy.prepare({k: os.path.join(self.src_dir, p[0]) for k, p in samples.items()},
+                                   os.path.dirname(self.save_dir), num_workers)
+
+        # 按比例切分图片数据
+        if self.incremental:
+            settings = {"resize": resize_config.to_dict()} if resize_config is not None else None
+            todo, removed = self.plan_incremental(samples, train_percent, split_strategy, labels, num_workers,
+                                                  settings)
+            for key, (split, files) in removed.items():
+                remove_files([os.path.join(save_dir_structure[f"{split}_img_dir"], f) for f in files])
+        else:
+            todo = split_strategy.split([(k, labels[k]) for k in samples], train_percent)
+
+        image_map = dict()
+        if resize_config is not None:
+            image_map = self.prepare_resized_images(list(todo.keys()), resize_config, num_workers, list(samples.keys()))
+
+        def copy_one(item):
+            key, split = item
+            clas, file = key.split("/", 1)
+            if key in image_map:
+                materialize_file(image_map[key], os.path.join(save_dir_structure[f"{split}_img_dir"], clas, file),
+                                 materialize_mode)
+                return
+            copy_files(os.path.join(self.src_dir, clas), os.path.join(save_dir_structure[f"{split}_img_dir"], clas),
+                       [file, ], materialize_mode)
+            return
+
+        parallel_map(copy_one, todo.items(), num_workers, callback=self.get_progress("Copy", len(todo)))
+        if self.manifest is not None:
+            for key, split in todo.items():
+                self.manifest.update(key, split)
+            self.manifest.save()
+        if shard_size_mb > 0:
+            self.pack_shards(shard_size_mb, num_workers)
         return
 
 
 class UltrDetDataSet(DataSet):
-    def __init__(self, src_dir, save_dir, label_txt_pth, tool_pth: str):
-        super().__init__(src_dir, save_dir, label_txt_pth)
+    def __init__(self, src_dir, save_dir, label_txt_pth, tool_pth: str, incremental: bool = False,
+                 label_converter: LabelConverter = None):
+        # label_converter: 标注输出格式，默认检测框，分割任务使用多边形或旋转框
+        super().__init__(src_dir, save_dir, label_txt_pth, incremental)
         self.tool_pth = tool_pth
+        self.label_converter = label_converter if label_converter is not None else YoloDetConverter()
+        self.materialize_mode = "copy"
+        self.tile_config = None
+        self.resize_config = None
+        self.image_map = dict()
+        self.store = None
+        self.image_index = dict()
         return
 
-    @staticmethod
-    def __run_cmd(command_):
-        process = subprocess.Popen(command_, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        while process.poll() is None:
-            line = process.stdout.readline()
-            if type(line) == bytes:
-                line = line.decode()
-            line = line.strip()
-            if line:
-                print(line)
-        if process.returncode == 0:
+    def __run_cmd(self, command_: list):
+        # 阻塞到标注工具退出，shutdown 可以结束进程
+        self.runner = ProcessRunner(command_, on_output=lambda text: print(text, end="", flush=True))
+        self.last_result = self.runner.run()
+        if self.last_result.exit_code == 0:
             print("success")
         else:
             print("failed")
         return
 
     def __parse_json2yolo_txt(self, image_pth, json_pth, save_txt_pth):
-        img = Image.open(image_pth)
-        imgw, imgh = img.size
-        with open(json_pth, "r") as j:
-            json_info = json.load(j)
+        # 标注从缓存中读取，不再重复解析 json
+        file_idx = self.store.index_of(os.path.basename(json_pth))
+        # 优先使用json中记录的尺寸，否则只读取图片文件头
+        imgw, imgh = self.store.get_image_size(file_idx)
+        if imgw == 0 or imgh == 0:
+            imgw, imgh = get_image_size(image_pth)
 
         with open(save_txt_pth, "w") as t:
-            label_str = ""
-            for obj in json_info["shapes"]:
-                if obj["label"] not in self.CLASSES: continue
-                label_str += f"{self.CLASSES.index(obj['label'])} "
-                box = obj["points"]
-                cx = (box[0][0] + box[1][0]) / 2
-                cy = (box[0][1] + box[1][1]) / 2
-                w = abs(box[0][0] - box[1][0])
-                h = abs(box[0][1] - box[1][1])
-                label_str += f"{cx / imgw:.6f} {cy / imgh:.6f} {w / imgw:.6f} {h / imgh:.6f}"
-                label_str += "\n"
-            t.write(label_str)
+            t.write(self.label_converter.convert(self.store.get_shapes(file_idx), imgw, imgh, self.CLASSES))
 
         return
 
     def label_data(self):
-        command = f"{self.tool_pth} {self.src_dir} --labels {self.label_txt_pth} --nodata --autosave"
+        command = [self.tool_pth, self.src_dir, "--labels", self.label_txt_pth, "--nodata", "--autosave"]
         self.__run_cmd(command)
         return
 
     def __create_dataset_dir(self):
         # dataset_root/(images|labels)/(train|val)
         ret = dict()
-        ret["train_img_dir"] = create_dir(os.path.join(self.save_dir, "images", "train"))
-        ret["val_img_dir"] = create_dir(os.path.join(self.save_dir, "images", "val"))
-        ret["train_lbl_dir"] = create_dir(os.path.join(self.save_dir, "labels", "train"))
-        ret["val_lbl_dir"] = create_dir(os.path.join(self.save_dir, "labels", "val"))
+        ret["train_img_dir"] = create_dir(os.path.join(self.save_dir, "images", "train"), not self.incremental)
+        ret["val_img_dir"] = create_dir(os.path.join(self.save_dir, "images", "val"), not self.incremental)
+        ret["train_lbl_dir"] = create_dir(os.path.join(self.save_dir, "labels", "train"), not self.incremental)
+        ret["val_lbl_dir"] = create_dir(os.path.join(self.save_dir, "labels", "val"), not self.incremental)
         return ret
 
+    def __scan_src_dir(self):
+        # 一次 os.scandir 同时得到标注文件列表和 图片名(不含后缀) -> 图片文件名 的索引
+        # 同名图片有多种格式时，按 bmp, jpeg, png, jpg 的顺序优先
+        IMAGE_FORMAT = [".bmp", ".jpeg", ".png", ".jpg", ]
+        json_files = []
+        image_index = dict()
+        with os.scandir(self.src_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stem, suffix = os.path.splitext(entry.name)
+                suffix = suffix.lower()
+                if suffix == ".json":
+                    json_files.append(entry.name)
+                elif suffix in IMAGE_FORMAT:
+                    old = image_index.get(stem)
+                    if old is None or IMAGE_FORMAT.index(suffix) < IMAGE_FORMAT.index(os.path.splitext(old)[1].lower()):
+                        image_index[stem] = entry.name
+        self.image_index = image_index
+        return sorted(json_files)
+
     def __get_image_name_base_json(self, json_file):
         # 根据json文件找图片
-        IMAGE_FORMAT = ["bmp", "jpeg", "png", "jpg", ]
-        for suffix in IMAGE_FORMAT:
-            target_file = json_file.replace("json", suffix)
-            target_file_pth = os.path.join(self.src_dir, target_file)
-            if os.path.isfile(target_file_pth):
-                return target_file
-        return None
-
-    def convert_and_split(self, train_percent: float):
+        return self.image_index.get(os.path.splitext(json_file)[0])
+
+    def __convert_one(self, task):
+        # 单个样本：迁移图片 + 生成标注文件，各样本之间互不依赖，可并行执行
+        json_file, split = task
+        img_dir = self.dir_struct[f"{split}_img_dir"]
+        lbl_dir = self.dir_struct[f"{split}_lbl_dir"]
+        image_pth = self.__get_image_name_base_json(json_file)
+        # 迁移图片，预缩放时使用缓存中的图片
+        if image_pth in self.image_map:
+            materialize_file(self.image_map[image_pth], os.path.join(img_dir, image_pth), self.materialize_mode)
+        else:
+            copy_files(self.src_dir, img_dir, [image_pth, ], self.materialize_mode)
+        # 生成标注文件
+        lbl_txt_pth = os.path.join(lbl_dir, os.path.splitext(json_file)[0] + ".txt")
+        self.__parse_json2yolo_txt(os.path.join(self.src_dir, image_pth), os.path.join(self.src_dir, json_file),
+                                   lbl_txt_pth)
+        return
+
+    def __read_json_labels(self, json_file):
+        # 标注文件中属于 self.CLASSES 的类别列表，供分层切分使用
+        shapes = self.store.get_shapes(self.store.index_of(json_file))
+        return [label for label, _, _ in shapes if label in self.CLASSES]
+
+    def __get_incremental_tasks(self, json_files, train_percent, split_strategy, labels, num_workers):
+        # 样本名为 json 文件名，清单中同时记录 json 和图片的指纹，任意一个变化都需要重新生成
+        samples = dict()
+        for json_file in json_files:
+            samples[json_file] = [json_file, self.__get_image_name_base_json(json_file)]
+        settings = dict()
+        if self.tile_config is not None:
+            settings["tile"] = self.tile_config.to_dict()
+        if self.resize_config is not None:
+            settings["resize"] = self.resize_config.to_dict()
+        # 检测框为默认格式，不写入清单，兼容之前生成的清单
+        if self.label_converter.NAME != YoloDetConverter.NAME:
+            settings["label"] = self.label_converter.to_dict()
+        todo, removed = self.plan_incremental(samples, train_percent, split_strategy, labels, num_workers, settings)
+
+        removed_stems = dict()
+        for json_file, (split, files) in removed.items():
+            stem = os.path.splitext(json_file)[0]
+            img_dir = self.dir_struct[f"{split}_img_dir"]
+            lbl_dir = self.dir_struct[f"{split}_lbl_dir"]
+            remove_files([os.path.join(img_dir, f) for f in files[1:]] + [os.path.join(lbl_dir, stem + ".txt"), ])
+            removed_stems.setdefault(split, set()).add(stem)
+        # 切图模式下生成的小图
+        for split, stems in removed_stems.items():
+            remove_files(find_tiles(self.dir_struct[f"{split}_img_dir"], stems) +
+                         find_tiles(self.dir_struct[f"{split}_lbl_dir"], stems))
+        return todo
+
+    def __get_tile_task(self, task):
+        json_file, split = task
+        boxes = [(self.CLASSES.index(label), float(points[:, 0].min()), float(points[:, 1].min()),
+                  float(points[:, 0].max()), float(points[:, 1].max()))
+                 for label, _, points in self.store.get_shapes(self.store.index_of(json_file)) if label in self.CLASSES]
+        return (os.path.join(self.src_dir, self.__get_image_name_base_json(json_file)), boxes,
+                self.dir_struct[f"{split}_img_dir"], self.dir_struct[f"{split}_lbl_dir"], self.tile_config)
+
+    def convert_and_split(self, train_percent: float, num_workers: int = None, materialize_mode: str = "copy",
+                          split_strategy: SplitStrategy = None, shard_size_mb: int = 0,
+                          resize_config: ResizeConfig = None, check_images: bool = False,
+                          tile_config: TileConfig = None):
         # labelme 标注格式转为yolo标注格式
         # 对有标注的样本 切分 train val 保存
         # 并生成 数据集配置文件
+        # tile_config: 不为 None 时把原图切成小图保存，同一张原图的小图属于同一个切分
+        assert tile_config is None or self.label_converter.SUPPORT_TILE, \
+            f"Error, Label format:{self.label_converter.NAME} not support tiling"
+        # 切图需要原图分辨率，不能与预缩放同时使用
+        assert tile_config is None or resize_config is None, "Error, Tiling and resize can not be used together"
+        self.materialize_mode = materialize_mode
+        self.tile_config = tile_config
+        self.resize_config = resize_config
 
         # 创建文件夹结构
-        dir_struct = self.__create_dataset_dir()
+        self.dir_struct = self.__create_dataset_dir()
 
         # 获取标注文件
-        json_files = [f for f in os.listdir(self.src_dir) if f.endswith(".json")]
+        json_files = self.__scan_src_dir()
         assert len(json_files) > 10, "Error, Need to Label More Data..."
-        random.shuffle(json_files)
+        # 找不到对应图片的标注文件统一报出
+        unmatched = [f for f in json_files if self.__get_image_name_base_json(f) is None]
+        assert len(unmatched) == 0, f"Error, {len(unmatched)} Json Files Have No Image: {', '.join(unmatched[:10])}" + \
+                                    (" ..." if len(unmatched) > 10 else "")
+        # 损坏的图片和对应的标注不参与切分
+        if check_images:
+            bad = self.find_bad_images([self.__get_image_name_base_json(f) for f in json_files], num_workers)
+            json_files = [f for f in json_files if self.__get_image_name_base_json(f) not in bad]
+            assert len(json_files) > 10, "Error, Need to Label More Data..."
+        # 标注缓存只重新解析修改过的 json，缓存放在数据集保存目录的上一级，多次切分共用
+        self.store = AnnotationStore(self.src_dir, os.path.dirname(self.save_dir))
+        print(f"Annotation Cache Updated, {self.store.update(num_workers)} Json Files Parsed")
+
+        # 切分训练集 验证集，默认使用固定种子的随机切分
+        if split_strategy is None:
+            split_strategy = RandomSplit()
+        labels = dict()
+        if split_strategy.NEED_LABELS:
+            labels = dict(zip(json_files, parallel_map(self.__read_json_labels, json_files, num_workers)))
+        if split_strategy.NEED_IMAGES:
+            split_strategy.prepare({f: os.path.join(self.src_dir, self.__get_image_name_base_json(f)) for f in json_files},
+                                   os.path.dirname(self.save_dir), num_workers)
+        if self.incremental:
+            todo = self.__get_incremental_tasks(json_files, train_percent, split_strategy, labels, num_workers)
+            splits = {f: todo.get(f) or self.manifest.get_split(f) for f in json_files}
+        else:
+            todo = split_strategy.split([(f, labels.get(f, [])) for f in json_files], train_percent)
+            splits = todo
+        tasks = list(todo.items())
+
         total_file_num = len(json_files)
-        train_file_num = int(total_file_num * train_percent)
+        train_file_num = sum(1 for s in splits.values() if s == "train")
         print(
             f"Total Data Num: {total_file_num}, Train Data Num: {train_file_num}, Val Data Num: {total_file_num - train_file_num}")
-
-        # 随机切分训练集 验证集
-        train_json_files = json_files[:train_file_num]
-        for json_file in train_json_files:
-            image_pth = self.__get_image_name_base_json(json_file)
-            # 迁移图片
-            copy_files(self.src_dir, dir_struct["train_img_dir"], [image_pth, ])
-            # 生成标注文件
-            lbl_txt_pth = os.path.join(dir_struct["train_lbl_dir"], json_file.replace(".json", ".txt"))
-            self.__parse_json2yolo_txt(os.path.join(self.src_dir, image_pth), os.path.join(self.src_dir, json_file),
-                                       lbl_txt_pth)
-
-        val_json_files = json_files[train_file_num:]
-        for json_file in val_json_files:
-            image_pth = self.__get_image_name_base_json(json_file)
-            # 迁移图片
-            copy_files(self.src_dir, dir_struct["val_img_dir"], [image_pth, ])
-            # 生成标注文件
-            lbl_txt_pth = os.path.join(dir_struct["val_lbl_dir"], json_file.replace(".json", ".txt"))
-            self.__parse_json2yolo_txt(os.path.join(self.src_dir, image_pth), os.path.join(self.src_dir, json_file),
-                                       lbl_txt_pth)
-
-        # 生成数据集配置文件
+        if self.tile_config is not None:
+            # 切图需要解码图片，计算密集，使用进程池，小图直接写入切分后的目录
+            tile_nums = parallel_map(tile_one_image, [self.__get_tile_task(t) for t in tasks], num_workers,
+                                     use_process=True, callback=self.get_progress("Tile", len(tasks)))
+            print(f"Tiling Complete, {sum(tile_nums)} Tiles From {len(tasks)} Images")
+        else:
+            if self.resize_config is not None:
+                self.image_map = self.prepare_resized_images(
+                    [self.__get_image_name_base_json(f) for f, _ in tasks], self.resize_config, num_workers,
+                    [self.__get_image_name_base_json(f) for f in json_files])
+            # 图片复制、尺寸读取、标注写入 按样本并行执行，输出与串行(num_workers=1)完全一致
+            parallel_map(self.__convert_one, tasks, num_workers, callback=self.get_progress("Convert", len(tasks)))
+
+        if self.manifest is not None:
+            for json_file, split in tasks:
+                self.manifest.update(json_file, split)
+            self.manifest.save()
+
+        # 生成数据集配置文件，增量模式下覆盖同一个配置文件
         timestamp = get_timestamp()
         dataset_config_pth = os.path.join(self.save_dir, f"dataset_{timestamp}.yaml")
+        if self.incremental:
+            dataset_config_pth = os.path.join(self.save_dir, f"{os.path.basename(self.save_dir)}.yaml")
         with open(dataset_config_pth, "w") as fp:
             fp.write(f"path: {os.path.abspath(self.save_dir)}\n")
             fp.write(f"train: images/train\n")
@@ -247,6 +533,8 @@ class UltrDetDataSet(DataSet):
                 fp.write(f"  {i}: {cls}")
 
         print(f"DataSet Split Complete. {os.path.abspath(dataset_config_pth)}")
+        if shard_size_mb > 0:
+            self.pack_shards(shard_size_mb, num_workers)
         return
 
 
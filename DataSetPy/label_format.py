@@ -0,0 +1,216 @@
+# This Python file uses the following encoding: utf-8
+# 标注格式转换  labelme 形状 -> yolo 检测框 / yolo-seg 多边形 / yolo-obb 旋转框
+# 一个文件内全部形状的点拼接为一个数组，一次完成归一化
+import numpy as np
+from abc import ABC, abstractmethod
+
+CIRCLE_VERTEX_NUM = 32  # 圆形标注转换为多边形时的顶点数
+
+
+def simplify_polygon(points, tolerance: float):
+    """
+    Douglas-Peucker 顶点精简，points: (n, 2) 闭合多边形(首尾不重复)，tolerance: 允许的最大偏离(像素)
+    每一段的点到线段距离为数组运算，精简后不足 3 个点时返回原多边形
+    """
+    n = len(points)
+    if tolerance <= 0 or n <= 3:
+        return points
+    # 闭合多边形：首点重复到末尾，按折线精简
+    ring = np.concatenate([points, points[:1]], axis=0)
+    keep = np.zeros(len(ring), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        i0, i1 = stack.pop()
+        if i1 - i0 < 2:
+            continue
+        seg = ring[i1] - ring[i0]
+        rel = ring[i0 + 1:i1] - ring[i0]
+        seg_len = np.hypot(seg[0], seg[1])
+        if seg_len < 1e-12:
+            # 首尾重合时用到首点的距离
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / seg_len
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            keep[i0 + 1 + k] = True
+            stack.append((i0, i0 + 1 + k))
+            stack.append((i0 + 1 + k, i1))
+    ret = ring[keep][:-1]
+    return ret if len(ret) >= 3 else points
+
+
+def convex_hull(points):
+    # 单调链法求凸包，返回逆时针顶点
+    pts = np.unique(np.asarray(points, dtype=np.float64), axis=0)
+    if len(pts) <= 2:
+        return pts
+
+    def half(seq):
+        hull = []
+        for p in seq:
+            while len(hull) >= 2 and \
+                    (hull[-1][0] - hull[-2][0]) * (p[1] - hull[-2][1]) - \
+                    (hull[-1][1] - hull[-2][1]) * (p[0] - hull[-2][0]) <= 0:
+                hull.pop()
+            hull.append(p)
+        return hull
+
+    lower = half(pts)
+    upper = half(pts[::-1])
+    return np.asarray(lower[:-1] + upper[:-1])
+
+
+def min_area_rect(points):
+    """
+    最小外接旋转矩形，返回 (4, 2) 顺时针角点
+    凸包的每条边方向都作为候选角度，全部候选一次性旋转计算面积
+    """
+    hull = convex_hull(points)
+    if len(hull) < 3:
+        x1, y1 = np.min(points, axis=0)
+        x2, y2 = np.max(points, axis=0)
+        return np.asarray([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float64)
+
+    edges = np.roll(hull, -1, axis=0) - hull
+    angles = np.unique(np.mod(np.arctan2(edges[:, 1], edges[:, 0]), np.pi / 2))
+    cos, sin = np.cos(angles), np.sin(angles)
+    # (角度数, 点数) 旋转后的坐标
+    rx = hull[:, 0][None, :] * cos[:, None] + hull[:, 1][None, :] * sin[:, None]
+    ry = -hull[:, 0][None, :] * sin[:, None] + hull[:, 1][None, :] * cos[:, None]
+    x1, x2 = rx.min(axis=1), rx.max(axis=1)
+    y1, y2 = ry.min(axis=1), ry.max(axis=1)
+    k = int(np.argmin((x2 - x1) * (y2 - y1)))
+
+    corners = np.asarray([[x1[k], y1[k]], [x2[k], y1[k]], [x2[k], y2[k]], [x1[k], y2[k]]])
+    # 旋转回原坐标系
+    c, s = cos[k], sin[k]
+    return np.stack([corners[:, 0] * c - corners[:, 1] * s, corners[:, 0] * s + corners[:, 1] * c], axis=1)
+
+
+def rectangle_corners(points):
+    # labelme 矩形只记录两个对角点
+    (x1, y1), (x2, y2) = points[0], points[1]
+    return np.asarray([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float64)
+
+
+def circle_polygon(points):
+    # labelme 圆形记录 圆心 和 圆上一点
+    center = points[0]
+    radius = np.hypot(*(points[1] - points[0]))
+    theta = np.linspace(0, 2 * np.pi, CIRCLE_VERTEX_NUM, endpoint=False)
+    return np.stack([center[0] + radius * np.cos(theta), center[1] + radius * np.sin(theta)], axis=1)
+
+
+class LabelConverter(ABC):
+    """
+    labelme 形状列表转换为 yolo 标注文本
+    子类只负责把每个形状转换为像素坐标的点集，归一化和格式化统一在 convert 中一次完成
+    """
+    NAME = ""
+    TASK_MODE = ""  # 对应 ultralytics 的训练任务
+    SUPPORT_TILE = False  # 是否支持切图
+
+    def to_dict(self):
+        # 写入增量切分的清单，格式或参数变化后全部样本重新生成
+        return dict(self.__dict__, name=self.NAME)
+
+    @abstractmethod
+    def _shape_points(self, shape_type: str, points):
+        # 返回该形状输出的像素坐标点集 (n, 2)，不支持的形状返回 None
+        pass
+
+    def convert(self, shapes: list, img_w: int, img_h: int, classes: list):
+        """
+        shapes: [(标签, 形状类型, (n, 2) 点坐标), ...]
+        返回 yolo 标注文本，每个形状一行：类别序号 + 归一化坐标
+        """
+        cls_idx, groups = [], []
+        for label, shape_type, points in shapes:
+            if label not in classes:
+                continue
+            out = self._shape_points(shape_type, np.asarray(points, dtype=np.float64).reshape(-1, 2))
+            if out is None:
+                continue
+            cls_idx.append(classes.index(label))
+            groups.append(out)
+        if len(groups) == 0:
+            return ""
+
+        counts = [len(g) for g in groups]
+        values = self._normalize(np.concatenate(groups, axis=0), img_w, img_h)
+        ends = np.cumsum(counts)
+        label_str = ""
+        for i, end in enumerate(ends):
+            coords = " ".join(f"{v:.6f}" for v in values[end - counts[i]:end].ravel())
+            label_str += f"{cls_idx[i]} {coords}\n"
+        return label_str
+
+    def _normalize(self, points, img_w, img_h):
+        # 全部点一次性归一化，多边形超出图片的部分截断到图片边缘
+        return np.clip(points / np.asarray([img_w, img_h], dtype=np.float64), 0.0, 1.0)
+
+
+class YoloDetConverter(LabelConverter):
+    # 检测框  cx cy w h，取前两个点作为对角点，与原有的转换方式一致
+    NAME = "det"
+    TASK_MODE = "detect"
+    SUPPORT_TILE = True
+
+    def _shape_points(self, shape_type, points):
+        if len(points) < 2:
+            return None
+        # (cx, cy) (w, h) 两个"点"，归一化方式与普通点相同
+        return np.asarray([(points[0] + points[1]) / 2, np.abs(points[0] - points[1])])
+
+    def _normalize(self, points, img_w, img_h):
+        return points / np.asarray([img_w, img_h], dtype=np.float64)
+
+
+class YoloSegConverter(LabelConverter):
+    """
+    实例分割多边形  x1 y1 x2 y2 ...
+    矩形、圆形转换为多边形，线、点等不构成区域的形状跳过
+    simplify_tolerance > 0 时精简多边形顶点(像素)，标注文件更小，训练时读取标注更快
+    """
+    NAME = "seg"
+    TASK_MODE = "segment"
+
+    def __init__(self, simplify_tolerance: float = 0.0):
+        self.simplify_tolerance = simplify_tolerance
+        return
+
+    def _shape_points(self, shape_type, points):
+        if shape_type == "rectangle" and len(points) >= 2:
+            return rectangle_corners(points)
+        if shape_type == "circle" and len(points) >= 2:
+            return simplify_polygon(circle_polygon(points), self.simplify_tolerance)
+        if shape_type in ("polygon", "rotation") and len(points) >= 3:
+            return simplify_polygon(points, self.simplify_tolerance)
+        return None
+
+
+class YoloObbConverter(LabelConverter):
+    # 旋转框  x1 y1 x2 y2 x3 y3 x4 y4，矩形直接取四个角点，多边形(含旋转矩形)取最小外接旋转矩形
+    NAME = "obb"
+    TASK_MODE = "obb"
+
+    def _shape_points(self, shape_type, points):
+        if shape_type == "rectangle" and len(points) >= 2:
+            return rectangle_corners(points)
+        if shape_type in ("polygon", "rotation") and len(points) >= 3:
+            return min_area_rect(points)
+        return None
+
+
+LABEL_CONVERTERS = {
+    "det": YoloDetConverter,
+    "seg": YoloSegConverter,
+    "obb": YoloObbConverter,
+}
+
+
+def build_label_converter(name: str, **kwargs):
+    assert name in LABEL_CONVERTERS, f"Error, Unknown label format: {name}"
+    return LABEL_CONVERTERS[name](**kwargs)
@@ -3,6 +3,8 @@ import json
 import shutil
 import random
 
+from DataSetPy.annotation_store import AnnotationStore
+
 CLASSES = ["dent", ]
 
 
@@ -14,14 +16,20 @@ def createDir(target_dir, is_rm=0):
     return target_dir
 
 
-def lb2obb(fname):
+def lb2obb(fname, store: AnnotationStore = None):
+    # store: 标注缓存，提供时从缓存读取，不再解析 json
     label_info = ""
-    with open(fname, 'r') as fp:
-        content = json.load(fp)
-
-    img_h = content["imageHeight"]
-    img_w = content["imageWidth"]
-    objects = content["shapes"]
+    if store is not None:
+        file_idx = store.index_of(os.path.basename(fname))
+        img_w, img_h = store.get_image_size(file_idx)
+        objects = [{"label": label, "points": points.tolist()} for label, _, points in store.get_shapes(file_idx)]
+    else:
+        with open(fname, 'r') as fp:
+            content = json.load(fp)
+
+        img_h = content["imageHeight"]
+        img_w = content["imageWidth"]
+        objects = content["shapes"]
     for obj in objects:
         cls_idx = CLASSES.index(obj['label'])
         label_info += f"{cls_idx} "
@@ -49,12 +57,16 @@ if __name__ == "__main__":
     val_num = 0.2 * len(label_lst)
     # test_num = 0.1 * len(label_lst)
 
+    # 标注缓存放在数据集输出目录下，不写入标注目录
+    store = AnnotationStore(src_dir, os.path.dirname(dst_img_dir))
+    store.update()
+
     counter = 0
     for f in os.listdir(src_dir):
         if not f.endswith(".json"): continue
         counter += 1
         src_file = os.path.join(src_dir, f)
-        obb_label = lb2obb(src_file)
+        obb_label = lb2obb(src_file, store)
 
         # if counter < test_num:
         #     tmp_dst_img_dir = createDir(os.path.join(dst_img_dir, "test"))
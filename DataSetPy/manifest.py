@@ -0,0 +1,137 @@
+# This Python file uses the following encoding: utf-8
+# 数据集清单  记录每个样本的文件指纹(路径、大小、修改时间、内容哈希)和所属切分，用于增量切分
+import os
+import json
+import hashlib
+
+from utils.utils import get_timenow, parallel_map
+
+
+def get_file_hash(file_pth, chunk_size=1 << 20):
+    h = hashlib.md5()
+    with open(file_pth, "rb") as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_file_fingerprint(src_dir, rel_pth, old: dict = None):
+    # 大小和修改时间都没变时直接沿用旧指纹，不重新计算哈希
+    stat = os.stat(os.path.join(src_dir, rel_pth))
+    if old is not None and old["path"] == rel_pth and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime_ns:
+        return old
+    return {"path": rel_pth,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": get_file_hash(os.path.join(src_dir, rel_pth))}
+
+
+class DataSetManifest:
+    """
+    manifest.json 保存在切分后的数据集目录下：
+    {
+        "src_dir": 原始数据路径,
+        "classes": [类别名称],
+        "settings": 影响输出结果的其他配置(如切图参数),
+        "update_time": 最后更新时间,
+        "samples": {样本名: {"split": "train"|"val", "files": [{"path", "size", "mtime", "hash"}, ...]}}
+    }
+    """
+    FILE_NAME = "manifest.json"
+
+    def __init__(self, dataset_dir: str, src_dir: str, classes: list, settings: dict = None):
+        self.manifest_pth = os.path.join(dataset_dir, self.FILE_NAME)
+        self.src_dir = os.path.abspath(src_dir)
+        self.classes = list(classes)
+        self.settings = settings or dict()
+        self.samples = dict()
+        self.classes_changed = False
+        self.__pending = dict()
+
+        if os.path.isfile(self.manifest_pth):
+            with open(self.manifest_pth, "r", encoding="utf8") as fp:
+                info = json.load(fp)
+            assert os.path.normcase(info["src_dir"]) == os.path.normcase(self.src_dir), \
+                f"Error, Manifest src dir:[{info['src_dir']}] != [{self.src_dir}]"
+            self.samples = info["samples"]
+            # 类别列表或其他配置变化后，类别序号或输出方式会变，所有样本都需要重新生成
+            self.classes_changed = info["classes"] != self.classes or info.get("settings", dict()) != self.settings
+        return
+
+    @classmethod
+    def find_dataset_dir(cls, save_root: str, src_dir: str):
+        # 在 save_root 下找到最近一次由 src_dir 切分得到的数据集目录
+        if not os.path.isdir(save_root):
+            return None
+        src_dir = os.path.normcase(os.path.abspath(src_dir))
+        for d in sorted(os.listdir(save_root), reverse=True):
+            manifest_pth = os.path.join(save_root, d, cls.FILE_NAME)
+            if not (d.startswith("dataset_") and os.path.isfile(manifest_pth)):
+                continue
+            with open(manifest_pth, "r", encoding="utf8") as fp:
+                if os.path.normcase(json.load(fp)["src_dir"]) == src_dir:
+                    return os.path.join(save_root, d)
+        return None
+
+    def diff(self, samples: dict, num_workers: int = None):
+        """
+        samples: {样本名: [相对 src_dir 的文件路径, ...]}
+        返回 (新增样本, 有变化的样本, 已删除的样本)
+        """
+        keys = list(samples.keys())
+
+        def fingerprint(key):
+            old = self.samples.get(key)
+            old_files = list(old["files"]) if old is not None else []
+            old_files += [None] * (len(samples[key]) - len(old_files))
+            return [get_file_fingerprint(self.src_dir, p, o) for p, o in zip(samples[key], old_files)]
+
+        fingerprints = parallel_map(fingerprint, keys, num_workers)
+
+        new_keys, changed_keys = [], []
+        for key, files in zip(keys, fingerprints):
+            self.__pending[key] = files
+            old = self.samples.get(key)
+            if old is None:
+                new_keys.append(key)
+            elif self.classes_changed or \
+                    [(f["path"], f["hash"]) for f in old["files"]] != [(f["path"], f["hash"]) for f in files]:
+                changed_keys.append(key)
+            else:
+                # 内容没变，只更新大小和修改时间
+                old["files"] = files
+
+        removed_keys = [k for k in self.samples if k not in samples]
+        return new_keys, changed_keys, removed_keys
+
+    def get_split(self, key):
+        sample = self.samples.get(key)
+        return None if sample is None else sample["split"]
+
+    def get_files(self, key):
+        sample = self.samples.get(key)
+        return [] if sample is None else [f["path"] for f in sample["files"]]
+
+    def update(self, key, split):
+        # 样本处理完成后再写入清单，中途失败的样本下次会重新处理
+        self.samples[key] = {"split": split, "files": self.__pending.pop(key)}
+        return
+
+    def remove(self, key):
+        self.samples.pop(key, None)
+        return
+
+    def save(self):
+        info = {"src_dir": self.src_dir,
+                "classes": self.classes,
+                "settings": self.settings,
+                "update_time": get_timenow(),
+                "samples": self.samples}
+        tmp_pth = self.manifest_pth + ".tmp"
+        with open(tmp_pth, "w", encoding="utf8") as fp:
+            json.dump(info, fp, ensure_ascii=False)
+        os.replace(tmp_pth, self.manifest_pth)
+        return
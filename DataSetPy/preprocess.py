@@ -1,6 +1,368 @@
 # This Python file uses the following encoding: utf-8
 # 数据集前处理，包括 统计  检查
+import os
+import csv
+import json
+import shutil
+import numpy as np
+from functools import partial
 
+from utils.utils import parallel_map, get_image_size
+from DataSetPy.annotation_store import AnnotationStore
 
- if __name__ == "__main__":
-     pass
+# 统计直方图的分段
+BOX_SIZE_BINS = [0, 8, 16, 32, 64, 128, 256, 512, 1024, np.inf]  # 目标边长(像素，sqrt(w*h))
+AREA_RATIO_BINS = [0, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.25, 0.5, 1.0 + 1e-6]  # 目标面积/图片面积
+ASPECT_RATIO_BINS = [0, 0.125, 0.25, 0.5, 1, 2, 4, 8, np.inf]  # 宽/高
+CHECK_IMGSZ = (320, 640, 1024, 1280)  # 评估训练尺寸时，图片最长边缩放到这些尺寸
+SMALL_BOX_PIXELS = 8  # 缩放后边长小于该值的目标认为太小，难以检出
+
+
+def _read_yolo_txt(txt_pth):
+    with open(txt_pth, "r") as fp:
+        return fp.read().split()
+
+
+class BoxTable:
+    """
+    列存储的标注框表，每个框一行
+    image_names: 图片名列表    image_wh: (图片数, 2) 图片宽高
+    image_idx:   框所在图片序号 cls: 类别序号    xywh: (框数, 4) 归一化的 cx cy w h
+    """
+
+    def __init__(self, classes, image_names, image_wh, image_idx, cls, xywh):
+        self.classes = list(classes)
+        self.image_names = list(image_names)
+        self.image_wh = np.asarray(image_wh, dtype=np.float32).reshape(-1, 2)
+        self.image_idx = np.asarray(image_idx, dtype=np.int32)
+        self.cls = np.asarray(cls, dtype=np.int32)
+        self.xywh = np.asarray(xywh, dtype=np.float32).reshape(-1, 4)
+        return
+
+    @classmethod
+    def from_labelme(cls, src_dir: str, save_root: str, classes: list = None, num_workers: int = None):
+        # 从标注缓存(放在 save_root 下)读取，只重新解析修改过的 json；classes 为 None 时，使用标注中出现过的全部类别
+        store = AnnotationStore(src_dir, save_root)
+        store.update(num_workers)
+        if classes is None:
+            classes = sorted(store.labels)
+        file_idx, cls_idx, xyxy = store.get_boxes(classes)
+
+        image_wh = np.asarray(store.arrays["image_wh"], dtype=np.float32).reshape(-1, 2)
+        wh = image_wh[file_idx]
+        xywh = np.stack([(xyxy[:, 0] + xyxy[:, 2]) / 2 / wh[:, 0],
+                         (xyxy[:, 1] + xyxy[:, 3]) / 2 / wh[:, 1],
+                         (xyxy[:, 2] - xyxy[:, 0]) / wh[:, 0],
+                         (xyxy[:, 3] - xyxy[:, 1]) / wh[:, 1]], axis=1)
+        return cls(classes, store.file_names, image_wh, file_idx, cls_idx, xywh)
+
+    @classmethod
+    def from_yolo(cls, dataset_dir: str, classes: list, splits=("train", "val"), num_workers: int = None):
+        # dataset_root/(images|labels)/(train|val)，图片尺寸只读取文件头
+        image_pths, txt_pths = [], []
+        for split in splits:
+            img_dir = os.path.join(dataset_dir, "images", split)
+            lbl_dir = os.path.join(dataset_dir, "labels", split)
+            if not os.path.isdir(img_dir):
+                continue
+            for f in sorted(os.listdir(img_dir)):
+                image_pths.append(os.path.join(img_dir, f))
+                txt_pths.append(os.path.join(lbl_dir, os.path.splitext(f)[0] + ".txt"))
+
+        image_wh = parallel_map(get_image_size, image_pths, num_workers)
+        tokens = parallel_map(lambda p: _read_yolo_txt(p) if os.path.isfile(p) else [], txt_pths, num_workers)
+        counts = np.asarray([len(t) // 5 for t in tokens], dtype=np.int64)
+        # 全部文本一次性转换为数组
+        values = np.asarray([v for t in tokens for v in t[:len(t) // 5 * 5]], dtype=np.float32).reshape(-1, 5)
+        image_idx = np.repeat(np.arange(len(image_pths), dtype=np.int32), counts)
+        image_names = [os.path.relpath(p, dataset_dir) for p in image_pths]
+        return cls(classes, image_names, image_wh, image_idx, values[:, 0].astype(np.int32), values[:, 1:])
+
+    def __len__(self):
+        return len(self.cls)
+
+
+def _histogram(values, bins):
+    counts, _ = np.histogram(values, bins=bins)
+    return [{"range": [float(bins[i]), float(bins[i + 1])], "count": int(c)} for i, c in enumerate(counts)]
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return {}
+    p = np.percentile(values, [0, 5, 25, 50, 75, 95, 100])
+    return {k: float(v) for k, v in zip(["min", "p5", "p25", "p50", "p75", "p95", "max"], p)}
+
+
+def compute_statistics(table: BoxTable):
+    """
+    一次性计算全部统计量，全部为数组运算：
+    各类别目标数/图片数、目标尺寸、面积占比、宽高比直方图、无目标图片，以及不同训练尺寸下过小目标的比例
+    """
+    image_num = len(table.image_names)
+    class_num = len(table.classes)
+    wh = table.image_wh[table.image_idx]
+    box_w = table.xywh[:, 2] * wh[:, 0]
+    box_h = table.xywh[:, 3] * wh[:, 1]
+    box_size = np.sqrt(box_w * box_h)
+    area_ratio = table.xywh[:, 2] * table.xywh[:, 3]
+    aspect_ratio = box_w / np.maximum(box_h, 1e-6)
+
+    obj_per_image = np.bincount(table.image_idx, minlength=image_num)
+    class_box_num = np.bincount(table.cls, minlength=class_num)
+    # 包含该类别的图片数：(图片, 类别) 去重后计数
+    class_image_num = np.bincount(np.unique(table.image_idx.astype(np.int64) * class_num + table.cls) % class_num,
+                                  minlength=class_num) if len(table) > 0 else np.zeros(class_num, dtype=np.int64)
+
+    classes = []
+    for i, name in enumerate(table.classes):
+        mask = table.cls == i
+        classes.append({"name": name,
+                        "box_num": int(class_box_num[i]),
+                        "image_num": int(class_image_num[i]),
+                        "box_size": _percentiles(box_size[mask]),
+                        "area_ratio": _percentiles(area_ratio[mask])})
+
+    # 图片最长边缩放到 imgsz 后，边长小于 SMALL_BOX_PIXELS 的目标比例，比例高时建议切图或增大 imgsz
+    long_side = np.max(wh, axis=1) if len(table) > 0 else np.zeros(0, dtype=np.float32)
+    small_box = {}
+    for imgsz in CHECK_IMGSZ:
+        scale = np.minimum(imgsz / np.maximum(long_side, 1), 1.0)
+        small_box[str(imgsz)] = float(np.mean(box_size * scale < SMALL_BOX_PIXELS)) if len(table) > 0 else 0.0
+
+    return {"image_num": image_num,
+            "box_num": len(table),
+            "empty_image_num": int(np.sum(obj_per_image == 0)),
+            "empty_images": [table.image_names[i] for i in np.flatnonzero(obj_per_image == 0)],
+            "image_width": _percentiles(table.image_wh[:, 0]),
+            "image_height": _percentiles(table.image_wh[:, 1]),
+            "obj_per_image": _percentiles(obj_per_image),
+            "classes": classes,
+            "box_size_hist": _histogram(box_size, BOX_SIZE_BINS),
+            "area_ratio_hist": _histogram(area_ratio, AREA_RATIO_BINS),
+            "aspect_ratio_hist": _histogram(aspect_ratio, ASPECT_RATIO_BINS),
+            "aspect_ratio": _percentiles(aspect_ratio),
+            "small_box_ratio_at_imgsz": small_box}
+
+
+def save_statistics(stats: dict, save_dir: str):
+    # statistics.json 保存完整结果，statistics_classes.csv 保存各类别汇总，方便用表格软件查看
+    os.makedirs(save_dir, exist_ok=True)
+    json_pth = os.path.join(save_dir, "statistics.json")
+    with open(json_pth, "w", encoding="utf8") as fp:
+        json.dump(stats, fp, ensure_ascii=False, indent=2)
+
+    csv_pth = os.path.join(save_dir, "statistics_classes.csv")
+    with open(csv_pth, "w", encoding="utf8", newline="") as fp:
+        writer = csv.writer(fp)
+        writer.writerow(["class", "box_num", "image_num", "box_size_p50", "area_ratio_p5", "area_ratio_p50"])
+        for c in stats["classes"]:
+            writer.writerow([c["name"], c["box_num"], c["image_num"], c["box_size"].get("p50", ""),
+                             c["area_ratio"].get("p5", ""), c["area_ratio"].get("p50", "")])
+    return json_pth, csv_pth
+
+
+def compute_dhash(image_pth, hash_size: int = 8):
+    """
+    进程池中执行：差值哈希(dHash)，灰度缩放到 (hash_size+1, hash_size)，相邻像素比较得到 hash_size*hash_size 位
+    返回 十六进制字符串
+    """
+    from PIL import Image
+
+    with Image.open(image_pth) as img:
+        # jpg 解码时直接降采样，大图不需要完整解码
+        img.draft("L", (hash_size * 4, hash_size * 4))
+        gray = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = np.packbits((pixels[:, 1:] > pixels[:, :-1]).ravel())
+    return bits.tobytes().hex()
+
+
+def hamming_distance(a: int, b: int):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    汉明距离的 BK 树，查询距离不超过 radius 的全部哈希，只访问满足三角不等式的子树，不需要两两比较
+    节点: [哈希, 序号, {到父节点的距离: 子节点}]
+    """
+
+    def __init__(self):
+        self.root = None
+        return
+
+    def insert(self, value: int, idx: int):
+        node = [value, idx, dict()]
+        if self.root is None:
+            self.root = node
+            return
+        cur = self.root
+        while True:
+            d = hamming_distance(value, cur[0])
+            child = cur[2].get(d)
+            if child is None:
+                cur[2][d] = node
+                return
+            cur = child
+
+    def query(self, value: int, radius: int):
+        # 返回 [(序号, 距离), ...]
+        ret = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming_distance(value, node[0])
+            if d <= radius:
+                ret.append((node[1], d))
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return ret
+
+
+def cached_file_map(func, image_pths: list, cache_pth: str = None, settings: dict = None, num_workers: int = None):
+    """
+    对每个文件执行 func(进程池)，结果按 绝对路径 + 大小 + 修改时间 持久化缓存，文件没变时直接使用缓存
+    cache_pth: {"settings", "files": {绝对路径: [大小, 修改时间, 结果]}}，settings 变化后缓存失效
+    返回 与 image_pths 对应的结果列表
+    """
+    cached = dict()
+    if cache_pth is not None and os.path.isfile(cache_pth):
+        with open(cache_pth, "r", encoding="utf8") as fp:
+            info = json.load(fp)
+        if info.get("settings") == settings:
+            cached = info["files"]
+
+    abs_pths = [os.path.abspath(p) for p in image_pths]
+    stats = parallel_map(os.stat, abs_pths, num_workers)
+    results = [None] * len(abs_pths)
+    todo = []
+    for i, (p, st) in enumerate(zip(abs_pths, stats)):
+        old = cached.get(p)
+        if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            results[i] = old[2]
+        else:
+            todo.append(i)
+    # 解码图片计算密集，使用进程池
+    new_results = parallel_map(func, [abs_pths[i] for i in todo], num_workers, use_process=True)
+    for i, r in zip(todo, new_results):
+        results[i] = r
+        cached[abs_pths[i]] = [stats[i].st_size, stats[i].st_mtime_ns, r]
+
+    if cache_pth is not None and len(todo) > 0:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_pth)), exist_ok=True)
+        tmp_pth = cache_pth + ".tmp"
+        with open(tmp_pth, "w", encoding="utf8") as fp:
+            json.dump({"settings": settings, "files": cached}, fp, ensure_ascii=False)
+        os.replace(tmp_pth, cache_pth)
+    return results
+
+
+def load_image_hashes(image_pths: list, cache_pth: str = None, hash_size: int = 8, num_workers: int = None):
+    # image_pths 的感知哈希(int)，哈希位数变化后缓存失效
+    hashes = cached_file_map(partial(compute_dhash, hash_size=hash_size), image_pths, cache_pth,
+                             {"hash_size": hash_size}, num_workers)
+    return [int(h, 16) for h in hashes]
+
+
+def find_duplicate_clusters(image_pths: list, max_distance: int = 4, cache_pth: str = None, hash_size: int = 8,
+                            num_workers: int = None):
+    """
+    重复、近似重复图片聚类：感知哈希汉明距离不超过 max_distance 的图片连通成一簇
+    返回 [[图片路径, ...], ...]，只包含 2 张以上的簇，簇内和簇间按路径排序
+    """
+    hashes = load_image_hashes(image_pths, cache_pth, hash_size, num_workers)
+    parent = list(range(len(image_pths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # 先查询再插入，每一对相似图片只比较一次
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        for j, _ in tree.query(h, max_distance):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+        tree.insert(h, i)
+
+    clusters = dict()
+    for i in range(len(image_pths)):
+        clusters.setdefault(find(i), []).append(image_pths[i])
+    return sorted(sorted(c) for c in clusters.values() if len(c) > 1)
+
+
+def save_duplicates(clusters: list, save_dir: str):
+    # duplicates.json：每个簇保留第一张，其余列为建议删除
+    os.makedirs(save_dir, exist_ok=True)
+    json_pth = os.path.join(save_dir, "duplicates.json")
+    info = {"cluster_num": len(clusters),
+            "duplicate_num": sum(len(c) - 1 for c in clusters),
+            "clusters": [{"keep": c[0], "duplicates": c[1:]} for c in clusters]}
+    with open(json_pth, "w", encoding="utf8") as fp:
+        json.dump(info, fp, ensure_ascii=False, indent=2)
+    return json_pth
+
+
+def verify_image(image_pth):
+    """
+    进程池中执行：检查图片能否完整解码，返回 None 表示正常，否则返回错误信息
+    verify 只检查文件结构，截断的 jpg 需要完整解码才能发现
+    """
+    from PIL import Image
+
+    if os.path.getsize(image_pth) == 0:
+        return "Empty File"
+    try:
+        with Image.open(image_pth) as img:
+            img.verify()
+        with Image.open(image_pth) as img:
+            # jpg 按 1/8 降采样解码，仍会读取全部数据，截断时报错
+            img.draft(img.mode, (max(1, img.width // 8), max(1, img.height // 8)))
+            img.load()
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def check_images(image_pths: list, cache_pth: str = None, num_workers: int = None):
+    """
+    图片完整性检查，已经检查过且没有变化的图片直接使用缓存结果，第一次之后几乎没有开销
+    返回 {损坏的图片路径: 错误信息}
+    """
+    errors = cached_file_map(verify_image, image_pths, cache_pth, {"check": "decode"}, num_workers)
+    return {p: e for p, e in zip(image_pths, errors) if e is not None}
+
+
+def save_quarantine(bad_images: dict, save_dir: str, move_dir: str = None):
+    """
+    quarantine.json 记录损坏的图片和错误信息
+    move_dir 不为 None 时把损坏的图片移动到该目录，否则只记录，由调用方排除
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    moved = dict()
+    if move_dir is not None:
+        os.makedirs(move_dir, exist_ok=True)
+        for p in bad_images:
+            moved[p] = os.path.join(move_dir, os.path.basename(p))
+            shutil.move(p, moved[p])
+    json_pth = os.path.join(save_dir, "quarantine.json")
+    with open(json_pth, "w", encoding="utf8") as fp:
+        json.dump([{"image": p, "error": e, "moved_to": moved.get(p)} for p, e in sorted(bad_images.items())],
+                  fp, ensure_ascii=False, indent=2)
+    return json_pth
+
+
+if __name__ == "__main__":
+    table = BoxTable.from_labelme(r"E:\DataSets\dents_det\org_D1\gold_scf\cutPatches640\NG", r"./DLTmp", ["dent", ])
+    stats = compute_statistics(table)
+    print(save_statistics(stats, r"./DLTmp"))
+
+    src_dir = r"E:\DataSets\dents_det\org_D1\gold_scf\cutPatches640\NG"
+    image_pths = [os.path.join(src_dir, f) for f in sorted(os.listdir(src_dir)) if f.lower().endswith(".jpg")]
+    clusters = find_duplicate_clusters(image_pths, cache_pth=r"./DLTmp/.phash_cache.json")
+    print(save_duplicates(clusters, r"./DLTmp"))
@@ -0,0 +1,152 @@
+# This Python file uses the following encoding: utf-8
+# 图片预缩放缓存  大图只在生成数据集时解码一次，缩放到训练尺寸后缓存，训练时每个 epoch 不再解码原图
+# 缓存按 (原图内容哈希, 尺寸, 质量) 区分，相同尺寸的多次实验直接复用
+import os
+import json
+import shutil
+
+from utils.utils import parallel_map
+from DataSetPy.manifest import get_file_fingerprint
+
+
+class ResizeConfig:
+    def __init__(self,
+                 imgsz: int = 640,  # 训练尺寸，图片最长边缩放到该值，与 ultralytics 的缩放方式一致，训练时不再缩放
+                 quality: int = 95,  # jpg 保存质量
+                 cache_dir: str = None,  # 缓存目录，默认 数据集保存目录/.resize_cache，多次实验共用
+                 ):
+        assert imgsz > 0, f"Error, resize imgsz:{imgsz} must > 0"
+        self.imgsz = imgsz
+        self.quality = quality
+        self.cache_dir = cache_dir
+        return
+
+    def to_dict(self):
+        # 写入增量切分的清单，尺寸或质量变化后全部样本重新生成；缓存目录不影响输出
+        return {"imgsz": self.imgsz, "quality": self.quality}
+
+
+def resize_one(task):
+    """
+    进程池中执行：解码原图，最长边缩放到 imgsz 后写入缓存
+    task: (原图路径, 缓存路径, imgsz, quality)
+    标注坐标是归一化的，等比例缩放后仍然有效
+    """
+    from PIL import Image, ImageOps
+
+    src_pth, cache_pth, imgsz, quality = task
+    os.makedirs(os.path.dirname(cache_pth), exist_ok=True)
+    tmp_pth = cache_pth + ".tmp" + os.path.splitext(cache_pth)[1]
+    with Image.open(src_pth) as org_img:
+        # 不需要缩放也不需要旋转的小图直接复制，避免重新编码损失质量
+        if max(org_img.size) <= imgsz and org_img.getexif().get(0x0112, 1) == 1:
+            shutil.copyfile(src_pth, tmp_pth)
+            os.replace(tmp_pth, cache_pth)
+            return cache_pth
+        # jpg 解码时直接按 1/2 1/4 1/8 降采样，大图解码更快
+        org_img.draft("RGB", (imgsz, imgsz))
+        # labelme 显示图片时会按 EXIF 旋转，标注基于旋转后的图片，缓存中保存旋转后的图片
+        img = ImageOps.exif_transpose(org_img)
+        scale = imgsz / max(img.size)
+        if scale < 1:
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                             Image.Resampling.BILINEAR, reducing_gap=2.0)
+        if cache_pth.lower().endswith((".jpg", ".jpeg")):
+            img.convert("RGB").save(tmp_pth, quality=quality)
+        else:
+            img.save(tmp_pth)
+    os.replace(tmp_pth, cache_pth)
+    return cache_pth
+
+
+class ResizeCache:
+    """
+    缓存目录结构：
+        index.json                       原图绝对路径 -> 指纹(大小、修改时间、内容哈希)，原图没变时不重新计算哈希
+        <哈希前两位>/<哈希>_<尺寸>_q<质量><原后缀>
+    缓存目录由多个原图目录共用，每次 prepare 后清理：
+        本原图目录下不再属于数据集的原图(keep_rel_pths 之外)，以及其他目录下已经不存在的原图，删除索引和缓存图片
+        其他原图目录下仍然存在的原图保留，切换数据集后再切换回来时直接复用
+    """
+    INDEX_FILE_NAME = "index.json"
+
+    CACHE_DIR_NAME = ".resize_cache"
+
+    def __init__(self, src_dir: str, config: ResizeConfig, save_root: str):
+        # 缓存不放在原图目录下，分类数据集的原图目录下只允许有类别文件夹
+        self.src_dir = os.path.abspath(src_dir)
+        self.config = config
+        self.cache_dir = config.cache_dir or os.path.join(save_root, self.CACHE_DIR_NAME)
+        self.index_pth = os.path.join(self.cache_dir, self.INDEX_FILE_NAME)
+        self.index = dict()
+        if os.path.isfile(self.index_pth):
+            with open(self.index_pth, "r", encoding="utf8") as fp:
+                self.index = json.load(fp)
+        return
+
+    def get_cache_pth(self, file_hash, suffix):
+        cfg = self.config
+        return os.path.join(self.cache_dir, file_hash[:2], f"{file_hash}_{cfg.imgsz}_q{cfg.quality}{suffix.lower()}")
+
+    def prepare(self, rel_pths: list, num_workers: int = None, keep_rel_pths: list = None):
+        """
+        rel_pths: 相对 src_dir 的原图路径
+        keep_rel_pths: 数据集中的全部原图，增量模式下 rel_pths 只包含需要重新生成的样本，其余样本的缓存不能删除
+        返回 {原图相对路径: 生成数据集时使用的图片路径}，缓存中没有的图片用进程池缩放
+        """
+        def fingerprint_one(rel_pth):
+            abs_pth = os.path.join(self.src_dir, rel_pth)
+            return get_file_fingerprint(os.path.dirname(abs_pth), os.path.basename(abs_pth), self.index.get(abs_pth))
+
+        # 原图内容变化后旧哈希的缓存也要删除，见 prune
+        old_hashes = {v["hash"] for v in self.index.values()}
+        fingerprints = parallel_map(fingerprint_one, rel_pths, num_workers)
+        ret = dict()
+        tasks = []
+        for rel_pth, fingerprint in zip(rel_pths, fingerprints):
+            self.index[os.path.join(self.src_dir, rel_pth)] = fingerprint
+            cache_pth = self.get_cache_pth(fingerprint["hash"], os.path.splitext(rel_pth)[1])
+            ret[rel_pth] = cache_pth
+            if not os.path.isfile(cache_pth):
+                tasks.append((os.path.join(self.src_dir, rel_pth), cache_pth, self.config.imgsz, self.config.quality))
+        # 内容相同的图片只缩放一次
+        tasks = list({t[1]: t for t in tasks}.values())
+        parallel_map(resize_one, tasks, num_workers, use_process=True)
+        print(f"Resize Cache: {len(rel_pths)} Images, {len(tasks)} Resized")
+
+        keep_pths = set(os.path.join(self.src_dir, p) for p in rel_pths)
+        keep_pths.update(os.path.join(self.src_dir, p) for p in keep_rel_pths or ())
+        self.prune(keep_pths, old_hashes)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_pth = self.index_pth + ".tmp"
+        with open(tmp_pth, "w", encoding="utf8") as fp:
+            json.dump(self.index, fp, ensure_ascii=False)
+        os.replace(tmp_pth, self.index_pth)
+        return ret
+
+    def prune(self, keep_pths: set, old_hashes: set = None):
+        """
+        删除 src_dir 下不在 keep_pths 中的原图、其他目录下已经不存在的原图的索引，
+        以及不再被任何保留的原图引用的缓存图片(所有尺寸)
+        old_hashes: 更新索引前的全部哈希，包括内容已经变化的原图的旧哈希
+        内容相同的图片共用缓存，仍被保留的原图引用时不删除
+        返回 删除的缓存图片数
+        """
+        src_prefix = os.path.join(self.src_dir, "")
+        dropped = [k for k in self.index
+                   if (k not in keep_pths if k.startswith(src_prefix) else not os.path.isfile(k))]
+        stale_hashes = set(old_hashes or ()) | {self.index.pop(k)["hash"] for k in dropped}
+        stale_hashes -= {v["hash"] for v in self.index.values()}
+        removed = 0
+        for file_hash in stale_hashes:
+            sub_dir = os.path.join(self.cache_dir, file_hash[:2])
+            if not os.path.isdir(sub_dir):
+                continue
+            for f in os.listdir(sub_dir):
+                if f.startswith(file_hash + "_"):
+                    os.remove(os.path.join(sub_dir, f))
+                    removed += 1
+        if len(dropped) > 0 or removed > 0:
+            print(f"Resize Cache: {len(dropped)} Stale Images Pruned, {removed} Cached Files Removed")
+        return removed
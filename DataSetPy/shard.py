@@ -0,0 +1,204 @@
+# This Python file uses the following encoding: utf-8
+# 数据集分片打包  大量小文件打包成少量大文件，网络存储、杀毒软件扫描的磁盘上按文件打开的开销不再成为瓶颈
+import os
+import io
+import json
+import mmap
+import time
+import shutil
+import random
+import numpy as np
+
+from utils.utils import parallel_map
+
+SHARD_DIR_NAME = "shards"
+META_FILE_NAME = "shards.json"
+READ_BATCH_SIZE = 256  # 每批并行读取的样本数，限制打包时的内存占用
+
+
+def collect_dataset_files(dataset_dir: str, splits=("train", "val")):
+    """
+    收集切分后数据集的样本，返回 (布局, {切分: [(样本名, 图片路径, 标注路径或类别名), ...]})
+    yolo 检测/分割：dataset_root/(images|labels)/(train|val)    分类：dataset_root/(train|val)/类别
+    """
+    layout = "yolo" if os.path.isdir(os.path.join(dataset_dir, "images")) else "clas"
+    ret = dict()
+    for split in splits:
+        samples = []
+        if layout == "yolo":
+            img_dir = os.path.join(dataset_dir, "images", split)
+            lbl_dir = os.path.join(dataset_dir, "labels", split)
+            if os.path.isdir(img_dir):
+                for f in sorted(os.listdir(img_dir)):
+                    samples.append((f, os.path.join(img_dir, f), os.path.join(lbl_dir, os.path.splitext(f)[0] + ".txt")))
+        else:
+            split_dir = os.path.join(dataset_dir, split)
+            if os.path.isdir(split_dir):
+                for clas in sorted(os.listdir(split_dir)):
+                    for f in sorted(os.listdir(os.path.join(split_dir, clas))):
+                        samples.append((f"{clas}/{f}", os.path.join(split_dir, clas, f), clas))
+        ret[split] = samples
+    return layout, ret
+
+
+def pack_dataset(dataset_dir: str, shard_size_mb: int = 512, splits=("train", "val"), num_workers: int = None):
+    """
+    分片目录 dataset_root/shards：
+        shards.json            布局、各切分的分片文件名和样本名
+        <切分>_<序号>.bin      图片编码数据和标注文本依次拼接
+        <切分>_<序号>.npy      (样本数, 4) int64: 图片偏移 图片长度 标注偏移 标注长度
+    每次全部重新打包，返回 分片目录
+    """
+    layout, split_files = collect_dataset_files(dataset_dir, splits)
+    shard_dir = os.path.join(dataset_dir, SHARD_DIR_NAME)
+    tmp_dir = shard_dir + ".tmp"
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    shard_bytes = shard_size_mb << 20
+
+    def read_one(sample):
+        _, image_pth, label = sample
+        with open(image_pth, "rb") as fp:
+            image_data = fp.read()
+        if layout == "yolo":
+            # 没有目标的图片可能没有标注文件
+            label_data = b""
+            if os.path.isfile(label):
+                with open(label, "rb") as fp:
+                    label_data = fp.read()
+        else:
+            label_data = label.encode("utf8")
+        return image_data, label_data
+
+    meta = {"layout": layout, "splits": dict()}
+    for split, samples in split_files.items():
+        shards = []
+        shard_id, fp, offset, index, names = 0, None, 0, [], []
+
+        def close_shard():
+            name = f"{split}_{shard_id:05d}"
+            fp.close()
+            np.save(os.path.join(tmp_dir, name + ".npy"), np.asarray(index, dtype=np.int64).reshape(-1, 4))
+            shards.append({"name": name, "samples": list(names)})
+            return
+
+        # 图片读取并行执行，写入按样本顺序串行，保证分片内容确定
+        for start in range(0, len(samples), READ_BATCH_SIZE):
+            batch = samples[start:start + READ_BATCH_SIZE]
+            for sample, (image_data, label_data) in zip(batch, parallel_map(read_one, batch, num_workers)):
+                if fp is not None and offset > 0 and offset + len(image_data) + len(label_data) > shard_bytes:
+                    close_shard()
+                    shard_id, fp, offset, index, names = shard_id + 1, None, 0, [], []
+                if fp is None:
+                    fp = open(os.path.join(tmp_dir, f"{split}_{shard_id:05d}.bin"), "wb")
+                fp.write(image_data)
+                fp.write(label_data)
+                index.append((offset, len(image_data), offset + len(image_data), len(label_data)))
+                names.append(sample[0])
+                offset += len(image_data) + len(label_data)
+        if fp is not None:
+            close_shard()
+        meta["splits"][split] = shards
+
+    with open(os.path.join(tmp_dir, META_FILE_NAME), "w", encoding="utf8") as fp:
+        json.dump(meta, fp, ensure_ascii=False)
+    # 写完后整体替换，读取方不会看到写了一半的分片
+    if os.path.isdir(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.replace(tmp_dir, shard_dir)
+    return shard_dir
+
+
+class ShardReader:
+    """
+    按样本序号随机读取分片，分片文件内存映射，读取样本不再打开文件
+    reader[i] -> (样本名, 图片编码数据 bytes, 标注文本)
+    """
+
+    def __init__(self, shard_dir: str, split: str = "train"):
+        meta_pth = os.path.join(shard_dir, META_FILE_NAME)
+        assert os.path.isfile(meta_pth), f"Error, Shard meta file:[{meta_pth}] Not Found"
+        with open(meta_pth, "r", encoding="utf8") as fp:
+            meta = json.load(fp)
+        assert split in meta["splits"], f"Error, Split:{split} Not in Shards"
+        self.shard_dir = shard_dir
+        self.split = split
+        self.layout = meta["layout"]
+        self.names = []
+        self.__files = []
+        self.__maps = []
+        shard_ids, indexes = [], []
+        for i, shard in enumerate(meta["splits"][split]):
+            fp = open(os.path.join(shard_dir, shard["name"] + ".bin"), "rb")
+            self.__files.append(fp)
+            # 空文件无法内存映射
+            self.__maps.append(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                               if os.path.getsize(fp.name) > 0 else b"")
+            indexes.append(np.load(os.path.join(shard_dir, shard["name"] + ".npy")))
+            shard_ids.append(np.full(len(shard["samples"]), i, dtype=np.int32))
+            self.names += shard["samples"]
+        self.shard_ids = np.concatenate(shard_ids) if shard_ids else np.zeros(0, dtype=np.int32)
+        self.index = np.concatenate(indexes) if indexes else np.zeros((0, 4), dtype=np.int64)
+        return
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        buf = self.__maps[self.shard_ids[i]]
+        img_off, img_len, lbl_off, lbl_len = (int(v) for v in self.index[i])
+        return self.names[i], buf[img_off:img_off + img_len], buf[lbl_off:lbl_off + lbl_len].decode("utf8")
+
+    def load_image(self, i):
+        # 解码为 PIL 图片
+        from PIL import Image
+        return Image.open(io.BytesIO(self[i][1]))
+
+    def extract(self, dst_dir: str):
+        """
+        还原为散文件目录结构(与 pack_dataset 的输入相同)，供直接读取文件夹的训练工具使用
+        适合先把少量大文件复制到本地磁盘，再在本地顺序解包
+        """
+        for i in range(len(self)):
+            name, image_data, label = self[i]
+            if self.layout == "yolo":
+                image_pth = os.path.join(dst_dir, "images", self.split, name)
+                label_pth = os.path.join(dst_dir, "labels", self.split, os.path.splitext(name)[0] + ".txt")
+                os.makedirs(os.path.dirname(label_pth), exist_ok=True)
+                with open(label_pth, "w", encoding="utf8") as fp:
+                    fp.write(label)
+            else:
+                image_pth = os.path.join(dst_dir, self.split, name)
+            os.makedirs(os.path.dirname(image_pth), exist_ok=True)
+            with open(image_pth, "wb") as fp:
+                fp.write(image_data)
+        return dst_dir
+
+    def close(self):
+        for m in self.__maps:
+            m.close()
+        for fp in self.__files:
+            fp.close()
+        self.__maps, self.__files = [], []
+        return
+
+
+def benchmark_random_access(reader: ShardReader, sample_num: int = 1000, decode: bool = False, seed: int = 0):
+    """
+    随机读取 sample_num 个样本，返回 {"samples_per_sec", "mb_per_sec"}，decode 为 True 时同时解码图片
+    与散文件对比时，对同一批图片路径逐个 open/read 计时即可
+    """
+    if len(reader) == 0:
+        return {"samples_per_sec": 0.0, "mb_per_sec": 0.0}
+    rng = random.Random(seed)
+    ids = [rng.randrange(len(reader)) for _ in range(sample_num)]
+    total_bytes = 0
+    t0 = time.perf_counter()
+    for i in ids:
+        _, image_data, _ = reader[i]
+        total_bytes += len(image_data)
+        if decode:
+            reader.load_image(i).load()
+    cost = max(time.perf_counter() - t0, 1e-9)
+    return {"samples_per_sec": sample_num / cost, "mb_per_sec": total_bytes / cost / (1 << 20)}
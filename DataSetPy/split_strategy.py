@@ -0,0 +1,187 @@
+# This Python file uses the following encoding: utf-8
+# 数据集切分策略  输入样本列表，输出每个样本属于 train 还是 val
+import os
+import re
+import random
+import hashlib
+from abc import ABC, abstractmethod
+
+from DataSetPy.preprocess import find_duplicate_clusters
+
+
+def quota_assign(keys: list, total_num: int, exist_train_num: int, train_percent: float):
+    # keys 已经打乱顺序，已有样本保持原切分并计入训练集数量，新样本补足剩余的训练集名额
+    train_num = int(total_num * train_percent) - exist_train_num
+    train_num = min(max(train_num, 0), len(keys))
+    ret = {k: "train" for k in keys[:train_num]}
+    ret.update({k: "val" for k in keys[train_num:]})
+    return ret
+
+
+class SplitStrategy(ABC):
+    NEED_LABELS = False  # 是否需要样本的类别列表
+    NEED_IMAGES = False  # 切分前是否需要读取样本图片(调用 prepare)
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        return
+
+    def split(self, samples: list, train_percent: float, exist: dict = None):
+        """
+        samples: [(样本名, 类别列表), ...] 全部样本，类别列表只在 NEED_LABELS 为 True 时需要
+        exist: {样本名: 切分} 已经切分过的样本(增量模式)，保持不变并计入占比
+        返回 {样本名: "train"|"val"}，只包含 exist 中没有的样本
+        """
+        exist = exist or dict()
+        # 先按样本名排序，保证相同输入、相同种子得到相同的切分结果
+        samples = sorted(samples, key=lambda t: t[0])
+        return self._assign(samples, train_percent, exist)
+
+    def prepare(self, images: dict, cache_dir: str, num_workers: int = None):
+        # images: {样本名: 图片路径}，cache_dir: 可写的缓存目录，NEED_IMAGES 为 True 时在 split 之前调用
+        return
+
+    @abstractmethod
+    def _assign(self, samples: list, train_percent: float, exist: dict):
+        pass
+
+
+class RandomSplit(SplitStrategy):
+    # 固定种子的随机切分
+    def _assign(self, samples, train_percent, exist):
+        keys = [k for k, _ in samples if k not in exist]
+        random.Random(self.seed).shuffle(keys)
+        exist_train_num = sum(1 for k, _ in samples if exist.get(k) == "train")
+        return quota_assign(keys, len(samples), exist_train_num, train_percent)
+
+
+class StratifiedSplit(SplitStrategy):
+    """
+    按类别分层切分：每个样本归入它所含类别中最稀有的那一层，没有目标的样本单独一层
+    每一层分别保持训练集占比，稀有类别不会全部落到同一个集合里
+    """
+    NEED_LABELS = True
+
+    def _assign(self, samples, train_percent, exist):
+        class_count = dict()
+        for _, labels in samples:
+            for label in labels:
+                class_count[label] = class_count.get(label, 0) + 1
+
+        strata = dict()
+        for key, labels in samples:
+            stratum = min(set(labels), key=lambda c: (class_count[c], c)) if len(labels) > 0 else None
+            strata.setdefault(stratum, []).append(key)
+
+        rng = random.Random(self.seed)
+        ret = dict()
+        for stratum in sorted(strata, key=str):
+            stratum_keys = strata[stratum]
+            keys = [k for k in stratum_keys if k not in exist]
+            rng.shuffle(keys)
+            exist_train_num = sum(1 for k in stratum_keys if exist.get(k) == "train")
+            ret.update(quota_assign(keys, len(stratum_keys), exist_train_num, train_percent))
+        return ret
+
+
+class GroupSplit(SplitStrategy):
+    """
+    按文件名分组切分：同一组的样本(如同一张原图切出的小图)只会出现在同一个集合中
+    pattern 中有捕获组时取第一个捕获组作为组名，否则取整个匹配，不匹配时样本单独成组
+    默认去掉最后一个 "_xxx" 后缀，如 4_5398.jpg 的组名为 4
+    """
+
+    def __init__(self, seed: int = 0, pattern: str = r"^(.+)_[^_]*$"):
+        super().__init__(seed)
+        self.pattern = re.compile(pattern)
+        return
+
+    def get_group(self, key):
+        name = key.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+        m = self.pattern.search(name)
+        if m is None:
+            return name
+        return m.group(1) if m.re.groups > 0 else m.group(0)
+
+    def _assign(self, samples, train_percent, exist):
+        groups = dict()
+        group_split = dict()
+        for key, _ in samples:
+            group = self.get_group(key)
+            groups.setdefault(group, []).append(key)
+            # 增量模式下已有组员的组，新样本跟随已有的切分
+            if key in exist and group not in group_split:
+                group_split[group] = exist[key]
+
+        train_num = sum(len(groups[g]) for g, s in group_split.items() if s == "train")
+        target_train_num = int(len(samples) * train_percent)
+        new_groups = sorted(g for g in groups if g not in group_split)
+        random.Random(self.seed).shuffle(new_groups)
+        for group in new_groups:
+            if train_num < target_train_num:
+                group_split[group] = "train"
+                train_num += len(groups[group])
+            else:
+                group_split[group] = "val"
+
+        return {k: group_split[g] for g, keys in groups.items() for k in keys if k not in exist}
+
+
+class DuplicateGroupSplit(GroupSplit):
+    """
+    重复、近似重复图片分为一组切分，避免同一张图片的副本同时出现在训练集和验证集
+    感知哈希汉明距离不超过 max_distance 的图片为一组，其余样本单独成组
+    """
+    NEED_IMAGES = True
+    CACHE_FILE_NAME = ".phash_cache.json"
+
+    def __init__(self, seed: int = 0, max_distance: int = 4):
+        super().__init__(seed)
+        self.max_distance = max_distance
+        self.groups = dict()
+        return
+
+    def prepare(self, images, cache_dir, num_workers=None):
+        keys = sorted(images)
+        path2key = {images[k]: k for k in keys}
+        clusters = find_duplicate_clusters([images[k] for k in keys], self.max_distance,
+                                           os.path.join(cache_dir, self.CACHE_FILE_NAME), num_workers=num_workers)
+        # 组名取簇内第一个样本名
+        self.groups = dict()
+        for cluster in clusters:
+            for p in cluster:
+                self.groups[path2key[p]] = path2key[cluster[0]]
+        print(f"Duplicate Check: {len(clusters)} Clusters, {sum(len(c) - 1 for c in clusters)} Duplicate Images")
+        return
+
+    def get_group(self, key):
+        return self.groups.get(key, key)
+
+
+class HashBucketSplit(SplitStrategy):
+    # 按样本名的哈希值分桶，结果只由样本名、种子和占比决定，与样本数量、顺序无关，增量更新时天然稳定
+    BUCKET_NUM = 10000
+
+    def _assign(self, samples, train_percent, exist):
+        ret = dict()
+        for key, _ in samples:
+            if key in exist:
+                continue
+            digest = hashlib.md5(f"{self.seed}:{key}".encode("utf8")).hexdigest()
+            bucket = int(digest[:8], 16) % self.BUCKET_NUM
+            ret[key] = "train" if bucket < train_percent * self.BUCKET_NUM else "val"
+        return ret
+
+
+SPLIT_STRATEGIES = {
+    "random": RandomSplit,
+    "stratified": StratifiedSplit,
+    "group": GroupSplit,
+    "dedup": DuplicateGroupSplit,
+    "hash": HashBucketSplit,
+}
+
+
+def build_split_strategy(name: str, seed: int = 0, **kwargs):
+    assert name in SPLIT_STRATEGIES, f"Error, Unknown split strategy: {name}"
+    return SPLIT_STRATEGIES[name](seed, **kwargs)
@@ -0,0 +1,120 @@
+# This Python file uses the following encoding: utf-8
+# 切图  目标相对原图太小时，把原图切成固定大小的小图，标注框裁剪后映射到小图坐标
+import os
+import re
+import random
+
+
+class TileConfig:
+    def __init__(self,
+                 tile_size: int = 640,  # 小图边长(像素)
+                 overlap: float = 0.2,  # 相邻小图的重叠比例，避免目标被切断
+                 min_visibility: float = 0.3,  # 目标被裁剪后保留面积占原面积的最小比例，低于该值的目标丢弃
+                 empty_keep_ratio: float = 0.1,  # 不含目标的小图保留比例，0 全部丢弃，1 全部保留
+                 jpeg_quality: int = 95,
+                 seed: int = 0,
+                 ):
+        assert tile_size > 0, f"Error, tile size:{tile_size} must > 0"
+        assert 0 <= overlap < 1, f"Error, tile overlap:{overlap} must in [0, 1)"
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.min_visibility = min_visibility
+        self.empty_keep_ratio = empty_keep_ratio
+        self.jpeg_quality = jpeg_quality
+        self.seed = seed
+        return
+
+    def to_dict(self):
+        # 写入增量切分的清单，配置变化后全部样本重新生成
+        return dict(self.__dict__)
+
+
+def get_tile_starts(length, tile_size, overlap):
+    # 一个方向上各小图的起点，最后一块贴齐图片边缘
+    if length <= tile_size:
+        return [0, ]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def get_tile_name(image_file, x, y):
+    stem, suffix = os.path.splitext(image_file)
+    return f"{stem}__{x}_{y}{suffix}"
+
+
+TILE_NAME_PATTERN = re.compile(r"(.*)__\d+_\d+\.[^.]+")
+
+
+def find_tiles(dir_pth, stems):
+    """
+    dir_pth 下由 stems 中的原图切出的小图及其标注，按 get_tile_name 的命名规则解析出原图名后精确匹配
+    样本 "a" 不会匹配到样本 "a__b" 的小图 "a__b__0_0.jpg"，目录只列出一次
+    """
+    if not os.path.isdir(dir_pth):
+        return []
+    stems = set(stems)
+    ret = []
+    for f in os.listdir(dir_pth):
+        match = TILE_NAME_PATTERN.fullmatch(f)
+        if match is not None and match.group(1) in stems:
+            ret.append(os.path.join(dir_pth, f))
+    return ret
+
+
+def clip_boxes(boxes, x0, y0, tile_w, tile_h, min_visibility):
+    """
+    boxes: [(类别序号, x1, y1, x2, y2), ...] 原图像素坐标
+    返回小图内的 yolo 标注行
+    """
+    lines = []
+    for cls_idx, x1, y1, x2, y2 in boxes:
+        cx1, cy1 = max(x1, x0), max(y1, y0)
+        cx2, cy2 = min(x2, x0 + tile_w), min(y2, y0 + tile_h)
+        if cx2 - cx1 < 1 or cy2 - cy1 < 1:
+            continue
+        area = max((x2 - x1) * (y2 - y1), 1e-6)
+        if (cx2 - cx1) * (cy2 - cy1) / area < min_visibility:
+            continue
+        cx = ((cx1 + cx2) / 2 - x0) / tile_w
+        cy = ((cy1 + cy2) / 2 - y0) / tile_h
+        w = (cx2 - cx1) / tile_w
+        h = (cy2 - cy1) / tile_h
+        lines.append(f"{cls_idx} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n")
+    return lines
+
+
+def tile_one_image(task):
+    """
+    进程池中执行：读取一张图，切图后直接写入数据集目录
+    task: (图片路径, [(类别序号, x1, y1, x2, y2), ...], 图片保存目录, 标注保存目录, TileConfig)
+    返回 写入的小图数量
+    """
+    from PIL import Image, ImageOps
+
+    image_pth, boxes, img_dir, lbl_dir, cfg = task
+    image_file = os.path.basename(image_pth)
+    rng = random.Random(f"{cfg.seed}:{image_file}")
+    tile_num = 0
+    with Image.open(image_pth) as org_img:
+        # labelme 显示图片时会按 EXIF 旋转，标注坐标基于旋转后的图片
+        img = ImageOps.exif_transpose(org_img)
+        img_w, img_h = img.size
+        for y0 in get_tile_starts(img_h, cfg.tile_size, cfg.overlap):
+            for x0 in get_tile_starts(img_w, cfg.tile_size, cfg.overlap):
+                tile_w, tile_h = min(cfg.tile_size, img_w), min(cfg.tile_size, img_h)
+                lines = clip_boxes(boxes, x0, y0, tile_w, tile_h, cfg.min_visibility)
+                # 空白小图按比例抽样保留，作为负样本
+                if len(lines) == 0 and rng.random() >= cfg.empty_keep_ratio:
+                    continue
+                tile_name = get_tile_name(image_file, x0, y0)
+                tile = img.crop((x0, y0, x0 + tile_w, y0 + tile_h))
+                if tile_name.lower().endswith((".jpg", ".jpeg")):
+                    tile.convert("RGB").save(os.path.join(img_dir, tile_name), quality=cfg.jpeg_quality)
+                else:
+                    tile.save(os.path.join(img_dir, tile_name))
+                with open(os.path.join(lbl_dir, os.path.splitext(tile_name)[0] + ".txt"), "w") as t:
+                    t.write("".join(lines))
+                tile_num += 1
+    return tile_num
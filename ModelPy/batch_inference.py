@@ -0,0 +1,211 @@
+# This Python file uses the following encoding: utf-8
+# 文件夹批量推理  解码线程池预取图片，按批推理，结果逐批写入 jsonl / csv，统计吞吐量和延迟分位数
+# 只依赖标准库、numpy、PIL，常驻的 ultralytics 进程(ultr_worker.py)也直接导入本文件
+# cli 方式由 ultralytics 环境中的 python 直接运行，只有此时导入 ultralytics：
+#   python batch_inference.py --model best.pt --source 文件夹 --out result.jsonl --batch 16
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+IMAGE_FORMAT = (".jpeg", ".jpg", ".bmp", ".png", ".tif", ".tiff", ".webp")
+RESULT_FORMATS = ("jsonl", "csv")
+
+
+def list_images(src: str):
+    # src 为单张图片或文件夹(包含子文件夹)，返回排序后的图片路径
+    if os.path.isfile(src):
+        return [src, ]
+    ret = []
+    for root, _, files in os.walk(src):
+        ret += [os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_FORMAT)]
+    return sorted(ret)
+
+
+def decode_image(image_pth: str):
+    # 解码为 BGR 的 (h, w, 3) uint8 数组，与 cv2.imread 相同的通道顺序，按 EXIF 旋转
+    from PIL import Image, ImageOps
+    with Image.open(image_pth) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        return np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+
+
+def prefetch_batches(image_pths: list, batch_size: int, num_workers: int = 4, decode_fn=decode_image,
+                     prefetch_num: int = 2):
+    """
+    解码线程池中提前解码后续 prefetch_num 批图片，推理当前批时下一批已经在解码
+    逐批返回 (图片路径列表, 图片列表, [(解码失败的图片路径, 错误信息), ...], 该批开始解码的时间)
+    """
+    it = iter(image_pths)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        def submit_batch():
+            batch = list(islice(it, batch_size))
+            if batch:
+                pending.append((time.perf_counter(), [(p, executor.submit(decode_fn, p)) for p in batch]))
+            return
+
+        for _ in range(prefetch_num + 1):
+            submit_batch()
+        while pending:
+            submit_time, batch = pending.popleft()
+            submit_batch()
+            paths, images, errors = [], [], []
+            for p, future in batch:
+                try:
+                    images.append(future.result())
+                    paths.append(p)
+                except Exception as e:
+                    errors.append((p, f"{type(e).__name__}: {e}"))
+            yield paths, images, errors, submit_time
+    return
+
+
+class ResultWriter:
+    """
+    推理结果逐批追加写入，中途中断时已写入的结果仍然可用
+    结果 dict：
+        检测  {"width", "height", "boxes": [[x1, y1, x2, y2, conf, cls], ...]}
+        分类  {"width", "height", "class", "conf"}
+        失败  {"error"}
+    jsonl 每张图片一行，csv 每个目标一行(没有目标或失败的图片也有一行，目标字段为空)
+    """
+    CSV_HEADER = ("image", "width", "height", "class", "conf", "x1", "y1", "x2", "y2", "error")
+
+    def __init__(self, out_pth: str, fmt: str = "jsonl"):
+        assert fmt in RESULT_FORMATS, f"Error, Unknown result format: {fmt}"
+        os.makedirs(os.path.dirname(os.path.abspath(out_pth)), exist_ok=True)
+        self.out_pth = out_pth
+        self.fmt = fmt
+        self.__fp = open(out_pth, "w", encoding="utf8", newline="")
+        self.__csv = None
+        if fmt == "csv":
+            self.__csv = csv.writer(self.__fp)
+            self.__csv.writerow(self.CSV_HEADER)
+        return
+
+    def write(self, image_pth: str, result: dict):
+        if self.fmt == "jsonl":
+            self.__fp.write(json.dumps(dict(result, image=image_pth), ensure_ascii=False) + "\n")
+            return
+        w, h = result.get("width", ""), result.get("height", "")
+        if "error" in result:
+            self.__csv.writerow([image_pth, w, h, "", "", "", "", "", "", result["error"]])
+        elif "class" in result:
+            self.__csv.writerow([image_pth, w, h, result["class"], f"{result['conf']:.4f}", "", "", "", "", ""])
+        elif len(result.get("boxes", [])) == 0:
+            self.__csv.writerow([image_pth, w, h, "", "", "", "", "", "", ""])
+        else:
+            for x1, y1, x2, y2, conf, cls in result["boxes"]:
+                self.__csv.writerow([image_pth, w, h, int(cls), f"{conf:.4f}",
+                                     f"{x1:.1f}", f"{y1:.1f}", f"{x2:.1f}", f"{y2:.1f}", ""])
+        return
+
+    def flush(self):
+        self.__fp.flush()
+        return
+
+    def close(self):
+        self.__fp.close()
+        return
+
+
+def latency_percentiles(values_sec: list):
+    # 返回 {"p50", "p90", "p95", "p99"}，单位毫秒
+    if len(values_sec) == 0:
+        return {"p50": 0.0, "p90": 0.0, "p95": 0.0, "p99": 0.0}
+    p = np.percentile(np.asarray(values_sec) * 1000.0, [50, 90, 95, 99])
+    return {"p50": float(p[0]), "p90": float(p[1]), "p95": float(p[2]), "p99": float(p[3])}
+
+
+def run_batch_inference(predict_fn, image_pths: list, out_pth: str, batch_size: int = 16, num_workers: int = 4,
+                        fmt: str = "jsonl", report_interval: float = 1.0):
+    """
+    predict_fn(images) -> [结果 dict, ...]，images 为 BGR 数组列表，结果格式见 ResultWriter
+    返回统计信息，同时写入 <out_pth>.stats.json：
+        images / failed / seconds / images_per_sec
+        batch_latency_ms   每批推理耗时的分位数
+        image_latency_ms   每张图片从开始解码到结果写入的耗时分位数
+        decode_wait_sec    推理等待解码的总时间，较大时说明解码是瓶颈，可以增加 num_workers
+    """
+    assert batch_size > 0, f"Error, batch size:{batch_size} must > 0"
+    writer = ResultWriter(out_pth, fmt)
+    batch_latency, image_latency = [], []
+    done, failed, decode_wait = 0, 0, 0.0
+    t0 = time.perf_counter()
+    last_report = t0
+    batches = prefetch_batches(image_pths, batch_size, num_workers)
+    try:
+        while True:
+            t_wait = time.perf_counter()
+            try:
+                paths, images, errors, submit_time = next(batches)
+            except StopIteration:
+                break
+            t1 = time.perf_counter()
+            decode_wait += t1 - t_wait
+            for p, err in errors:
+                writer.write(p, {"error": err})
+            failed += len(errors)
+            if images:
+                results = predict_fn(images)
+                t2 = time.perf_counter()
+                batch_latency.append(t2 - t1)
+                for p, img, result in zip(paths, images, results):
+                    writer.write(p, dict(result, width=img.shape[1], height=img.shape[0]))
+                image_latency += [time.perf_counter() - submit_time] * len(images)
+            writer.flush()
+            done += len(paths) + len(errors)
+
+            now = time.perf_counter()
+            if now - last_report >= report_interval:
+                last_report = now
+                print(f"\rBatch Inference: {done}/{len(image_pths)}  {done / (now - t0):.1f} img/s", end="",
+                      flush=True)
+    finally:
+        batches.close()
+        writer.close()
+
+    seconds = time.perf_counter() - t0
+    stats = {"images": done, "failed": failed, "seconds": seconds,
+             "images_per_sec": done / seconds if seconds > 0 else 0.0,
+             "batch_size": batch_size, "batch_latency_ms": latency_percentiles(batch_latency),
+             "image_latency_ms": latency_percentiles(image_latency), "decode_wait_sec": decode_wait,
+             "output": out_pth}
+    with open(out_pth + ".stats.json", "w", encoding="utf8") as fp:
+        json.dump(stats, fp, ensure_ascii=False, indent=2)
+    print(f"\rBatch Inference: {done} Images ({failed} Failed), {stats['images_per_sec']:.1f} img/s, "
+          f"Batch Latency p50/p95/p99: {stats['batch_latency_ms']['p50']:.1f}/{stats['batch_latency_ms']['p95']:.1f}/"
+          f"{stats['batch_latency_ms']['p99']:.1f} ms, Result: [{out_pth}]", flush=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True, help="模型文件")
+    parser.add_argument("--source", required=True, help="图片或文件夹")
+    parser.add_argument("--out", required=True, help="结果文件")
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4, help="解码线程数")
+    parser.add_argument("--fmt", default="jsonl", choices=RESULT_FORMATS)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--half", action="store_true")
+    args = parser.parse_args()
+
+    # 与 ultr_worker.py 在同一目录下，按脚本方式运行时可以直接导入
+    from ultralytics import YOLO
+    from ultr_worker import make_predict_fn
+    predict_fn = make_predict_fn(YOLO(args.model), args.device, args.half)
+    run_batch_inference(predict_fn, list_images(args.source), args.out, args.batch, args.workers, args.fmt)
+    return
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# This Python file uses the following encoding: utf-8
+# 训练指标  解析 ultralytics 训练输出，实时发布结构化的指标，界面不再需要单独启动 tensorboard
+#   results.csv: 每个 epoch 一行，按文件偏移增量读取新增的行
+#   标准输出:     进度条中的 epoch、batch、loss，训练过程中实时更新
+import os
+import re
+import glob
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from utils.log_buffer import LogBuffer
+
+RESULTS_CSV_NAME = "results.csv"
+
+# 进度行   1/100      1.97G      1.183      1.655      1.214         39        640: 100%|████| 8/8 [00:01<00:00,  4.86it/s]
+PROGRESS_LINE_RE = re.compile(r"^\s*(\d+)/(\d+)\s+([^:]*)(?::(.*))?$")
+BATCH_RE = re.compile(r"(\d+)/(\d+)\s*\[")
+
+
+def to_number(value: str):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class ResultsCsvTailer:
+    """
+    增量读取 results.csv，每次只读取上次读取位置之后的内容，没写完的行留到下次
+    文件被重新创建(变小)时从头读取
+    """
+
+    def __init__(self, csv_pth: str):
+        self.csv_pth = csv_pth
+        self.offset = 0
+        self.header = None
+        self.__partial = b""
+        return
+
+    def poll(self):
+        # 返回新增的行 [{列名: 数值}, ...]
+        if not os.path.isfile(self.csv_pth):
+            return []
+        size = os.path.getsize(self.csv_pth)
+        if size < self.offset:
+            self.offset, self.header, self.__partial = 0, None, b""
+        if size == self.offset:
+            return []
+        with open(self.csv_pth, "rb") as fp:
+            fp.seek(self.offset)
+            data = self.__partial + fp.read(size - self.offset)
+        self.offset = size
+        lines = data.split(b"\n")
+        self.__partial = lines.pop()
+
+        ret = []
+        for line in lines:
+            items = [v.strip() for v in line.decode("utf8", errors="ignore").split(",")]
+            if len(items) <= 1 and not items[0]:
+                continue
+            # ultralytics 旧版本的列名带有对齐用的空格
+            if self.header is None:
+                self.header = items
+                continue
+            ret.append({k: to_number(v) for k, v in zip(self.header, items)})
+        return ret
+
+
+class TrainLogParser:
+    """
+    解析训练标准输出中的进度行，列名取自进度行之前的表头行
+        检测:  Epoch  GPU_mem  box_loss  cls_loss  dfl_loss  Instances  Size
+        分类:  Epoch  GPU_mem  loss  Instances  Size
+    返回 {"epoch", "epochs", 表头中的其余列..., "batch", "batches"}，不是进度行时返回 None
+    验证阶段的进度行(Class Images Instances ...)没有 epoch 列，不解析
+    """
+
+    def __init__(self):
+        self.columns = None
+        return
+
+    def parse(self, line: str):
+        tokens = line.split()
+        if len(tokens) > 1 and tokens[0] == "Epoch":
+            self.columns = tokens[1:]
+            return None
+        if self.columns is None:
+            return None
+        m = PROGRESS_LINE_RE.match(line)
+        if m is None:
+            return None
+        ret = {"epoch": int(m.group(1)), "epochs": int(m.group(2))}
+        for k, v in zip(self.columns, m.group(3).split()):
+            ret[k] = to_number(v)
+        batch = BATCH_RE.search(m.group(4) or "")
+        if batch is not None:
+            ret["batch"], ret["batches"] = int(batch.group(1)), int(batch.group(2))
+        return ret
+
+
+class TrainMetricsMonitor(QObject):
+    """
+    训练指标监视，在界面线程中按固定间隔：
+        解析这段时间内的标准输出，只发布最新的一条进度  step_signal(dict)
+        读取 results.csv 新增的行，每个 epoch 发布一次  epoch_signal(dict)
+    feed 可在子进程读取线程中调用，输出先写入缓冲区，进度条的多次刷新在缓冲区中合并
+    """
+    step_signal = Signal(dict)
+    epoch_signal = Signal(dict)
+
+    def __init__(self, proj_dir: str, interval_ms: int = 500, parent=None):
+        super().__init__(parent)
+        self.proj_dir = proj_dir
+        self.tailer = None
+        self.parser = TrainLogParser()
+        self.__buffer = LogBuffer(max_lines=1000)
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(interval_ms)
+        self.__timer.timeout.connect(self.poll)
+        self.__timer.start()
+        return
+
+    def feed(self, text: str):
+        self.__buffer.feed(text)
+        return
+
+    def __find_results_csv(self):
+        # ultralytics 在 project 下按 train train2 ... 新建目录，取最新的一个
+        csv_lst = glob.glob(os.path.join(self.proj_dir, "*", RESULTS_CSV_NAME))
+        if len(csv_lst) == 0:
+            return None
+        return max(csv_lst, key=os.path.getmtime)
+
+    def poll(self):
+        _, records = self.__buffer.drain()
+        step = None
+        for text, _, _ in records:
+            ret = self.parser.parse(text)
+            if ret is not None:
+                step = ret
+        if step is not None:
+            self.step_signal.emit(step)
+
+        if self.tailer is None:
+            csv_pth = self.__find_results_csv()
+            if csv_pth is None:
+                return
+            self.tailer = ResultsCsvTailer(csv_pth)
+        for row in self.tailer.poll():
+            self.epoch_signal.emit(row)
+        return
+
+    def stop(self):
+        # 训练结束后读取剩余的内容
+        self.__timer.stop()
+        self.poll()
+        return
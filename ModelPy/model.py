@@ -1,20 +1,30 @@
 # This Python file uses the following encoding: utf-8
 # 模型训练  模型推理
 import os
+import time
 import shutil
+import json
 import yaml
 from abc import ABC, abstractmethod
 import subprocess
-from subprocess import STARTUPINFO, STARTF_USESHOWWINDOW
 
 from PySide6.QtCore import Signal, QObject
 
 from utils.utils import get_timestamp
+from utils.log_buffer import LogBuffer
+from utils.process_runner import ProcessRunner, ProcessResult
+from ModelPy.worker_client import find_env_python, get_warm_worker
+
+SERVE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+ONNX_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_engine.py")
+BATCH_INFERENCE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_inference.py")
+
+# 运行方式  cli: 每次操作启动一个 yolo 进程  worker: 在常驻的 ultralytics 进程中执行，模型保持加载
+MODEL_BACKENDS = ("cli", "worker")
 
 
 class MySignals(QObject):
     my_btn_clicked_signal = Signal(str, str)
-    send_message_signal = Signal(str)
 
 
 # 向界面开放的接口
@@ -55,9 +65,11 @@ class YoloModel(Model):
                  pretrained_model_dir,  # 预训练模型文件夹
                  template_cfg_pth,  # 配置模板文件路径
                  work_dir,  # 训练工程路径
+                 backend: str = "cli",  # 见 MODEL_BACKENDS
                  ):
         # 新建项目时，对应一个YoloModel
         assert os.path.isfile(tool_pth), "Error, Train tools not exists!!"
+        assert backend in MODEL_BACKENDS, f"Error, Unknown model backend: {backend}"
         self.tool_pth = tool_pth
         self.pretrained_model_dir = pretrained_model_dir
         self.template_cfg_pth = template_cfg_pth
@@ -66,8 +78,16 @@ class YoloModel(Model):
         self.config_dict = {}
         self.curr_proj_dir = None
         self.use_config_pth = None
-        self.process = None
-        self.my_process_signal = MySignals()
+        self.runner = None
+        self.last_result = None  # 最近一次命令的 ProcessResult：退出码、耗时
+        # 子进程输出写入缓冲区，由界面按固定帧率批量刷新，界面可替换为共用的缓冲区
+        self.log_buffer = LogBuffer()
+        # 额外接收子进程输出片段的回调，在读取线程中调用，例如训练指标解析
+        self.output_listeners = []
+
+        self.backend = backend
+        self.worker = get_warm_worker(find_env_python(tool_pth)) if backend == "worker" else None
+        self.__stop_requested = False
         return
 
     def make_train_cfg(self,
@@ -105,31 +125,66 @@ class YoloModel(Model):
             yaml.safe_dump(self.config_dict, fp)
         return tmp_config_pth
 
-    def __run_cmd(self, command_):
-        startup_info = STARTUPINFO()
-        startup_info.dwFlags |= STARTF_USESHOWWINDOW
-        startup_info.wShowWindow = 0
-        self.process = subprocess.Popen(command_, shell=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, startupinfo=startup_info)
-        while self.process.poll() is None:
-            line = self.process.stdout.readline()
-            if type(line) == bytes:
-                try:
-                    line = line.decode(encoding="utf-8", errors="ignore")
-                except Exception as e:
-                    print(e)
-            line = line.strip()
-            if line:
-                # print(line)
-                self.my_process_signal.send_message_signal.emit(line)
-        if self.process.returncode == 0:
+    def __on_output(self, text):
+        self.log_buffer.feed(text)
+        for listener in self.output_listeners:
+            listener(text)
+        return
+
+    def __run_cmd(self, command_: list):
+        # 阻塞到进程结束且输出读取完毕，进度条只用 \r 刷新，输出按块读取，不等待换行
+        self.runner = ProcessRunner(command_, on_output=self.__on_output)
+        self.last_result = self.runner.run()
+        self.log_buffer.feed("\n")
+        self.log_buffer.write_line(f"[{subprocess.list2cmdline(command_)}] {self.last_result}")
+        if self.last_result.exit_code == 0:
             print("success")
         else:
             print("failed")
-        return
+        return self.last_result
+
+    def __run_worker(self, command_: list, method: str, **kwargs):
+        """
+        在常驻进程中执行 method，command_ 为等价的命令行，只用于日志
+        返回 常驻进程中的返回值，失败或被取消时返回 None，last_result 与命令行方式相同
+        """
+        self.__stop_requested = False
+        t0 = time.perf_counter()
+        ret, exit_code = None, 0
+        try:
+            ret = self.worker.call(method, on_output=self.__on_output, **kwargs)
+        except Exception as e:
+            exit_code = 1
+            if not self.__stop_requested:
+                self.log_buffer.write_line(str(e))
+        self.last_result = ProcessResult(command_, exit_code, time.perf_counter() - t0, self.__stop_requested)
+        self.log_buffer.feed("\n")
+        self.log_buffer.write_line(f"[worker: {subprocess.list2cmdline(command_)}] {self.last_result}")
+        return ret
+
+    @staticmethod
+    def __device_args(device, half):
+        ret = [] if device is None else [f"device={device}"]
+        return ret + (["half=True"] if half else [])
+
+    def model_cache_stats(self):
+        # worker 方式下常驻进程中的模型缓存：已缓存的模型、内存占用、命中/未命中/淘汰次数
+        assert self.worker is not None, "Error, Model cache is only available with the worker backend"
+        return self.worker.call("cache_stats")
+
+    def __execute(self, command_: list, method: str, **kwargs):
+        # 按运行方式执行，cli 方式返回 ProcessResult，worker 方式返回常驻进程中的返回值
+        if self.backend == "worker":
+            return self.__run_worker(command_, method, **kwargs)
+        return self.__run_cmd(command_)
 
     def shutdown(self):
-        if self.process is not None:
-            self.process.kill()
+        # 先 terminate，进程没有及时退出时 kill；常驻进程被结束后，下一次调用时重新启动
+        self.__stop_requested = True
+        if self.runner is not None:
+            self.runner.stop()
+        if self.worker is not None:
+            self.worker.kill()
         return
 
     def __copy_base_model(self):
@@ -139,7 +194,7 @@ class YoloModel(Model):
         return
 
     def check_env(self):
-        command = f"{self.tool_pth} check"
+        command = [self.tool_pth, "check"]
         self.__run_cmd(command)
         return
 
@@ -147,13 +202,15 @@ class YoloModel(Model):
         # 每次训练对应一个config
         self.__copy_base_model()
         # 复制一个 基础模型文件在工作目录下
-        command = f"{self.tool_pth} cfg={train_cfg_pth}"
-        self.__run_cmd(command)
-        return command
+        command = [self.tool_pth, f"cfg={train_cfg_pth}"]
+        self.__execute(command, "train", cfg=train_cfg_pth)
+        return subprocess.list2cmdline(command)
 
     def evaluate(self,
                  dataset_config_pth: str,  # 数据集配置文件
                  model_pth: str,
+                 device: str = None,  # None 时由 ultralytics 自动选择
+                 half: bool = False,  # 半精度推理，仅 GPU 有效
                  ):
 
         assert (os.path.isfile(dataset_config_pth) or os.path.isdir(
@@ -161,27 +218,102 @@ class YoloModel(Model):
         if self.curr_proj_dir is None:
             self.curr_proj_dir = os.path.split(model_pth)[0]
 
-        command = f"{self.tool_pth} val project={self.curr_proj_dir} model={model_pth} data={dataset_config_pth}"
-        self.__run_cmd(command)
-        return command
+        command = [self.tool_pth, "val", f"project={self.curr_proj_dir}", f"model={model_pth}",
+                   f"data={dataset_config_pth}"] + self.__device_args(device, half)
+        # worker 方式下模型按 (路径, 修改时间, 设备, 半精度) 缓存，对比多个权重时不重复加载
+        self.__execute(command, "val", model=model_pth, data=dataset_config_pth, project=self.curr_proj_dir,
+                       device=device, half=half)
+        return subprocess.list2cmdline(command)
 
     def inference(self,
                   model_pth: str,
                   test_image_pth: str,
+                  device: str = None,
+                  half: bool = False,
                   ):
-        assert os.path.isfile(test_image_pth), "Error, Test Image Not Found!"
+        assert os.path.isfile(test_image_pth) or os.path.isdir(test_image_pth), "Error, Test Image Not Found!"
         if self.curr_proj_dir is None:
             self.curr_proj_dir = os.path.split(model_pth)[0]
 
-        command = f"{self.tool_pth} predict project={self.curr_proj_dir} model={model_pth} source={test_image_pth}"
-        self.__run_cmd(command)  # 自己发起进程
-        return command  # 交给调用方发起进程
+        command = [self.tool_pth, "predict", f"project={self.curr_proj_dir}", f"model={model_pth}",
+                   f"source={test_image_pth}"] + self.__device_args(device, half)
+        self.__execute(command, "predict", model=model_pth, source=test_image_pth, project=self.curr_proj_dir,
+                       device=device, half=half)  # 自己发起进程
+        return subprocess.list2cmdline(command)  # 交给调用方发起进程
+
+    def inference_folder(self,
+                         model_pth: str,
+                         image_dir: str,
+                         out_pth: str = None,  # 结果文件，默认 模型所在目录/predict_<时间戳>.<格式>
+                         batch_size: int = 16,
+                         num_workers: int = 4,  # 解码线程数
+                         fmt: str = "jsonl",  # jsonl / csv
+                         device: str = None,
+                         half: bool = False,
+                         ):
+        """
+        文件夹批量推理：预取解码、按批推理、结果逐批写入 out_pth，返回吞吐量和延迟统计(同时写入 <out_pth>.stats.json)
+        cli 方式每次启动 batch_inference.py 进程，worker 方式在常驻进程中执行，输出相同
+        """
+        assert os.path.isdir(image_dir), f"Error, Image Dir:{image_dir} Not Found!"
+        if self.curr_proj_dir is None:
+            self.curr_proj_dir = os.path.split(model_pth)[0]
+        if out_pth is None:
+            out_pth = os.path.join(self.curr_proj_dir, f"predict_{get_timestamp()}.{fmt}")
+
+        command = [find_env_python(self.tool_pth), "-u", BATCH_INFERENCE_SCRIPT, "--model", model_pth,
+                   "--source", image_dir, "--out", out_pth, "--batch", str(batch_size), "--workers", str(num_workers),
+                   "--fmt", fmt]
+        if device is not None:
+            command += ["--device", str(device)]
+        if half:
+            command += ["--half", ]
+        ret = self.__execute(command, "predict_folder", model=model_pth, source=image_dir, out_pth=out_pth,
+                             batch_size=batch_size, num_workers=num_workers, fmt=fmt, device=device, half=half)
+        return ret if self.backend == "worker" else self.__read_stats(out_pth)
+
+    def inference_onnx(self,
+                       model_pth: str,  # export 导出的 .onnx
+                       image_pth: str,  # 图片或文件夹
+                       out_pth: str = None,  # 结果文件，默认 模型所在目录/predict_onnx_<时间戳>.<格式>
+                       batch_size: int = 1,
+                       num_workers: int = 4,  # 解码线程数
+                       fmt: str = "jsonl",  # jsonl / csv
+                       intra_op_threads: int = 0,  # 算子内部并行线程数，0 为 onnxruntime 默认
+                       inter_op_threads: int = 1,  # 算子之间并行线程数
+                       ):
+        """
+        用 ONNX Runtime 在 CPU 上推理导出的模型(见 onnx_engine.py)，检查部署的模型文件本身，不加载 torch
+        worker 方式在常驻进程中复用 InferenceSession；返回吞吐量和延迟统计(同时写入 <out_pth>.stats.json)
+        """
+        assert model_pth.endswith(".onnx"), f"Error, Not ONNX Model: {model_pth}"
+        assert os.path.isfile(image_pth) or os.path.isdir(image_pth), f"Error, Test Image:{image_pth} Not Found!"
+        if self.curr_proj_dir is None:
+            self.curr_proj_dir = os.path.split(model_pth)[0]
+        if out_pth is None:
+            out_pth = os.path.join(self.curr_proj_dir, f"predict_onnx_{get_timestamp()}.{fmt}")
+
+        command = [find_env_python(self.tool_pth), "-u", ONNX_SCRIPT, "--model", model_pth, "--source", image_pth,
+                   "--out", out_pth, "--batch", str(batch_size), "--workers", str(num_workers), "--fmt", fmt,
+                   "--intra-threads", str(intra_op_threads), "--inter-threads", str(inter_op_threads)]
+        ret = self.__execute(command, "predict_onnx", model=model_pth, source=image_pth, out_pth=out_pth,
+                             batch_size=batch_size, num_workers=num_workers, fmt=fmt,
+                             intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+        return ret if self.backend == "worker" else self.__read_stats(out_pth)
+
+    @staticmethod
+    def __read_stats(out_pth: str):
+        # cli 方式下批量推理进程写入的统计信息，进程失败或被取消时为 None
+        if not os.path.isfile(out_pth + ".stats.json"):
+            return None
+        with open(out_pth + ".stats.json", "r", encoding="utf8") as fp:
+            return json.load(fp)
 
     def export(self,
                model_pth,
                ):
-        command = f"{self.tool_pth} export model={model_pth} format=onnx opset=13"
-        self.__run_cmd(command)
+        command = [self.tool_pth, "export", f"model={model_pth}", "format=onnx", "opset=13"]
+        self.__execute(command, "export", model=model_pth, format="onnx", opset=13)
         output_onnx_pth = model_pth.replace(".pt", ".onnx")
         if os.path.isfile(output_onnx_pth):
             print(f"Export Success, Model Save to [{output_onnx_pth}]")
@@ -190,12 +322,34 @@ class YoloModel(Model):
             print(f"Export Failed")
             return None
 
+    def serve(self,
+              model_pth: str,  # .pt 或导出的 .onnx
+              port: int = 8000,
+              host: str = "127.0.0.1",
+              max_batch: int = 8,  # 每批最多合并的请求数
+              max_wait_ms: float = 5.0,  # 第一个请求最多等待合并的时间
+              device: str = None,
+              half: bool = False,
+              ):
+        # 在 ultralytics 环境中启动本机 HTTP 推理服务(见 serve.py)，阻塞到服务被停止
+        assert os.path.isfile(model_pth), f"Error, Model File:{model_pth} Not Found!"
+        command = [find_env_python(self.tool_pth), "-u", SERVE_SCRIPT, "--model", model_pth, "--host", host,
+                   "--port", str(port), "--max-batch", str(max_batch), "--max-wait-ms", str(max_wait_ms)]
+        if device is not None:
+            command += ["--device", device]
+        if half:
+            command += ["--half", ]
+        self.__run_cmd(command)
+        return subprocess.list2cmdline(command)
+
     def show_training_curve(self, port: int):
-        tensorboard_pth = self.tool_pth.replace("yolo.exe", "tensorboard.exe")
+        # 与 yolo 在同一目录下：yolo.exe -> tensorboard.exe  yolo -> tensorboard
+        tool_dir, tool_name = os.path.split(self.tool_pth)
+        tensorboard_pth = os.path.join(tool_dir, tool_name.replace("yolo", "tensorboard", 1))
         assert os.path.isfile(tensorboard_pth), "Error, Tensorboard is Not Found!!"
-        command = f"{tensorboard_pth} --logdir={self.work_dir} --port={port}"
+        command = [tensorboard_pth, f"--logdir={self.work_dir}", f"--port={port}"]
         self.__run_cmd(command)
-        return command
+        return subprocess.list2cmdline(command)
 
 
 class PaddleModel:
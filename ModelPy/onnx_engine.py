@@ -0,0 +1,222 @@
+# This Python file uses the following encoding: utf-8
+# ONNX Runtime CPU 推理  推理 YoloModel.export 导出的 onnx 模型，不需要 torch、ultralytics
+# 前处理(letterbox / 分类的缩放裁剪)、后处理(解码、NMS)都用 numpy 实现，结果格式见 batch_inference.ResultWriter
+# 只依赖 numpy、PIL、onnxruntime，可以在主程序中导入，也可以由任意 python 直接运行：
+#   python onnx_engine.py --model best.onnx --source 图片或文件夹 --out result.jsonl --intra-threads 4
+import os
+import ast
+import sys
+import argparse
+import threading
+
+import numpy as np
+
+# 作为 ModelPy 包导入，或作为脚本运行(与 batch_inference.py 在同一目录下)
+try:
+    from ModelPy.batch_inference import list_images, run_batch_inference, RESULT_FORMATS
+except ImportError:
+    from batch_inference import list_images, run_batch_inference, RESULT_FORMATS
+
+MAX_WH = 7680  # 按类别做 NMS 时各类别框的偏移量，大于图片尺寸即可
+MAX_NMS = 30000  # 进入 NMS 的最多候选框数
+
+
+def letterbox(image, new_shape=(640, 640), color=114):
+    """
+    等比例缩放到 new_shape (h, w) 内，其余部分用 color 填充，与 ultralytics 的 LetterBox 一致
+    返回 (填充后的图片, 缩放比例, (左侧填充, 上方填充))
+    """
+    from PIL import Image
+    h, w = image.shape[:2]
+    ratio = min(new_shape[0] / h, new_shape[1] / w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    if (new_w, new_h) != (w, h):
+        image = np.asarray(Image.fromarray(image).resize((new_w, new_h), Image.Resampling.BILINEAR))
+    dw, dh = (new_shape[1] - new_w) / 2, (new_shape[0] - new_h) / 2
+    left, top = round(dw - 0.1), round(dh - 0.1)
+    out = np.full((new_shape[0], new_shape[1], 3), color, dtype=np.uint8)
+    out[top:top + new_h, left:left + new_w] = image
+    return out, ratio, (left, top)
+
+
+def center_crop(image, size: int):
+    # 分类模型的前处理：短边缩放到 size 后中心裁剪，与 ultralytics 的 classify_transforms 一致
+    from PIL import Image
+    h, w = image.shape[:2]
+    scale = size / min(h, w)
+    new_w, new_h = max(size, round(w * scale)), max(size, round(h * scale))
+    image = np.asarray(Image.fromarray(image).resize((new_w, new_h), Image.Resampling.BILINEAR))
+    top, left = (new_h - size) // 2, (new_w - size) // 2
+    return image[top:top + size, left:left + size]
+
+
+def xywh2xyxy(xywh):
+    xyxy = np.empty_like(xywh)
+    half_wh = xywh[:, 2:4] / 2
+    xyxy[:, 0:2] = xywh[:, 0:2] - half_wh
+    xyxy[:, 2:4] = xywh[:, 0:2] + half_wh
+    return xyxy
+
+
+def nms(boxes, scores, iou_thres: float, max_det: int = 300):
+    # 贪心 NMS，每次保留得分最高的框，与剩余框的 IoU 一次向量化计算，返回保留的下标
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0 and len(keep) < max_det:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        inter_w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        inter_h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = inter_w * inter_h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_thres]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decode_detections(pred, num_classes: int, conf_thres: float = 0.25, iou_thres: float = 0.7, max_det: int = 300):
+    """
+    pred 为单张图片的输出 (4 + 类别数 + 其他, 候选框数)，前 4 行为中心点 xywh，之后为各类别得分
+    分割、关键点模型的其他通道(掩膜系数、关键点)忽略，只返回框
+    返回 (k, 6) 的 [x1, y1, x2, y2, conf, cls]，坐标为模型输入尺寸下的坐标
+    """
+    pred = pred.T
+    scores = pred[:, 4:4 + num_classes]
+    cls = scores.argmax(axis=1)
+    conf = scores[np.arange(len(scores)), cls]
+    mask = conf > conf_thres
+    boxes, conf, cls = xywh2xyxy(pred[mask, :4]), conf[mask], cls[mask]
+    if len(conf) > MAX_NMS:
+        top = conf.argsort()[::-1][:MAX_NMS]
+        boxes, conf, cls = boxes[top], conf[top], cls[top]
+    keep = nms(boxes + cls[:, None] * MAX_WH, conf, iou_thres, max_det)
+    return np.concatenate([boxes[keep], conf[keep, None], cls[keep, None]], axis=1)
+
+
+class OnnxEngine:
+    """
+    一个 InferenceSession，可在多个线程中同时调用 predict
+    intra_op_threads  单个算子内部的并行线程数，0 为 onnxruntime 默认(物理核数)
+    inter_op_threads  算子之间的并行线程数，模型基本是串行的卷积，默认 1
+    输入尺寸、任务类型、类别名从导出时写入的模型元数据读取；输入 batch 固定为 1 时逐张推理
+    """
+
+    def __init__(self, model_pth: str, intra_op_threads: int = 0, inter_op_threads: int = 1,
+                 conf_thres: float = 0.25, iou_thres: float = 0.7, max_det: int = 300):
+        import onnxruntime as ort
+        assert os.path.isfile(model_pth), f"Error, Model File:{model_pth} Not Found!"
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1 else \
+            ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_pth, options, providers=["CPUExecutionProvider"])
+        self.model_pth = model_pth
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_det = max_det
+
+        meta = self.session.get_modelmeta().custom_metadata_map
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.task = meta.get("task", "detect")
+        assert self.task != "obb", f"Error, ONNX Engine Not Support Task: {self.task}"
+        self.names = ast.literal_eval(meta["names"]) if "names" in meta else {}
+        # 动态输入尺寸时使用导出时的 imgsz
+        batch, _, h, w = model_input.shape
+        if not isinstance(h, int) or not isinstance(w, int):
+            h, w = ast.literal_eval(meta["imgsz"]) if "imgsz" in meta else (640, 640)
+        self.input_shape = (h, w)
+        self.fixed_batch = batch if isinstance(batch, int) else 0
+        return
+
+    def preprocess(self, images):
+        # BGR uint8 图片列表 -> (n, 3, h, w) float32 RGB 张量，以及每张图片的 (缩放比例, 填充)
+        tensors, metas = [], []
+        for image in images:
+            if self.task == "classify":
+                tensors.append(center_crop(image, self.input_shape[0]))
+                metas.append(None)
+            else:
+                padded, ratio, pad = letterbox(image, self.input_shape)
+                tensors.append(padded)
+                metas.append((ratio, pad))
+        batch = np.stack(tensors)[..., ::-1].transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(batch, dtype=np.float32) / 255.0, metas
+
+    def __run(self, tensor):
+        if self.fixed_batch in (0, len(tensor)):
+            return self.session.run(None, {self.input_name: tensor})[0]
+        # 固定 batch 的模型(默认导出方式)按固定大小分批，最后不足一批时重复最后一张图片补齐，输出只取实际的部分
+        outputs = []
+        for i in range(0, len(tensor), self.fixed_batch):
+            chunk = tensor[i:i + self.fixed_batch]
+            num = len(chunk)
+            if num < self.fixed_batch:
+                chunk = np.concatenate([chunk, np.repeat(chunk[-1:], self.fixed_batch - num, axis=0)])
+            outputs.append(self.session.run(None, {self.input_name: chunk})[0][:num])
+        return np.concatenate(outputs)
+
+    def postprocess(self, outputs, images, metas):
+        ret = []
+        for pred, image, meta in zip(outputs, images, metas):
+            if self.task == "classify":
+                cls = int(pred.argmax())
+                ret.append({"class": cls, "conf": round(float(pred[cls]), 4)})
+                continue
+            num_classes = len(self.names) if self.names else pred.shape[0] - 4
+            det = decode_detections(pred, num_classes, self.conf_thres, self.iou_thres, self.max_det)
+            # 坐标还原到原图
+            ratio, (left, top) = meta
+            det[:, [0, 2]] = ((det[:, [0, 2]] - left) / ratio).clip(0, image.shape[1])
+            det[:, [1, 3]] = ((det[:, [1, 3]] - top) / ratio).clip(0, image.shape[0])
+            ret.append({"boxes": det.astype(np.float64).round(4).tolist()})
+        return ret
+
+    def predict(self, images):
+        # images 为 BGR 数组列表，返回 [结果 dict, ...]
+        if len(images) == 0:
+            return []
+        tensor, metas = self.preprocess(images)
+        return self.postprocess(self.__run(tensor), images, metas)
+
+
+_ENGINES = dict()
+_ENGINES_LOCK = threading.Lock()
+
+
+def get_engine(model_pth: str, intra_op_threads: int = 0, inter_op_threads: int = 1):
+    # 复用已创建的 InferenceSession，模型文件更新(修改时间变化)后重新创建
+    model_pth = os.path.abspath(model_pth)
+    key = (model_pth, os.stat(model_pth).st_mtime_ns, intra_op_threads, inter_op_threads)
+    with _ENGINES_LOCK:
+        if key not in _ENGINES:
+            for k in [k for k in _ENGINES if k[0] == model_pth]:
+                _ENGINES.pop(k)
+            _ENGINES[key] = OnnxEngine(model_pth, intra_op_threads, inter_op_threads)
+        return _ENGINES[key]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True, help="onnx 模型文件")
+    parser.add_argument("--source", required=True, help="图片或文件夹")
+    parser.add_argument("--out", required=True, help="结果文件")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=4, help="解码线程数")
+    parser.add_argument("--fmt", default="jsonl", choices=RESULT_FORMATS)
+    parser.add_argument("--intra-threads", type=int, default=0, help="算子内部并行线程数，0 为默认")
+    parser.add_argument("--inter-threads", type=int, default=1, help="算子之间并行线程数")
+    args = parser.parse_args()
+
+    engine = get_engine(args.model, args.intra_threads, args.inter_threads)
+    print(f"ONNX Engine: [{args.model}] task={engine.task} input={engine.input_shape} "
+          f"intra_threads={args.intra_threads} inter_threads={args.inter_threads}", flush=True)
+    run_batch_inference(engine.predict, list_images(args.source), args.out, args.batch, args.workers, args.fmt)
+    return
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# This Python file uses the following encoding: utf-8
+# 本机 HTTP 推理服务  模型只加载一次，并发请求合并为小批量推理
+#   POST /predict   请求体为图片文件内容，返回 {"result": 结果, "latency_ms": 耗时}，结果格式见 batch_inference.ResultWriter
+#   GET  /metrics   队列长度、批大小分布、延迟分位数
+#   GET  /health
+# 由 ultralytics 环境中的 python 直接运行：python serve.py --model best.pt --port 8000
+# 导出的 .onnx 模型使用 onnx_engine.py 在 CPU 上推理，不加载 torch
+import io
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 作为 ModelPy 包导入，或作为脚本运行(与 batch_inference.py 在同一目录下)
+try:
+    from ModelPy.batch_inference import decode_image, latency_percentiles
+except ImportError:
+    from batch_inference import decode_image, latency_percentiles
+
+LATENCY_WINDOW = 10000  # 延迟分位数按最近的请求数统计
+
+
+class PendingRequest:
+    def __init__(self, image):
+        self.image = image
+        self.submit_time = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        return
+
+
+class MicroBatcher:
+    """
+    请求进入队列，推理线程取出第一个请求后继续等待，直到凑满 max_batch_size 或距第一个请求到达超过 max_wait_ms
+    队列已满时直接拒绝新请求，避免请求堆积导致延迟无限增长
+    predict_fn(images) -> [结果 dict, ...]，只在推理线程中调用
+    """
+
+    def __init__(self, predict_fn, max_batch_size: int = 8, max_wait_ms: float = 5.0, max_queue: int = 256):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.__queue = queue.Queue(maxsize=max_queue)
+        self.__stopped = threading.Event()
+        self.__lock = threading.Lock()
+        self.__latency = deque(maxlen=LATENCY_WINDOW)
+        self.__batch_latency = deque(maxlen=LATENCY_WINDOW)
+        self.batch_hist = Counter()
+        self.requests, self.errors, self.rejected, self.max_queue_depth = 0, 0, 0, 0
+        self.start_time = time.time()
+        self.__thread = threading.Thread(target=self.__loop, daemon=True)
+        self.__thread.start()
+        return
+
+    def submit(self, image, timeout: float = 30.0):
+        # 在请求线程中调用，阻塞到该请求所在的批推理完成
+        request = PendingRequest(image)
+        try:
+            self.__queue.put_nowait(request)
+        except queue.Full:
+            with self.__lock:
+                self.rejected += 1
+            raise
+        with self.__lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.__queue.qsize())
+        assert request.done.wait(timeout), "Error, Inference Timeout"
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return request.result, time.perf_counter() - request.submit_time
+
+    def __next_batch(self):
+        try:
+            first = self.__queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first, ]
+        deadline = first.submit_time + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.__queue.get(timeout=remaining) if remaining > 0 else self.__queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __loop(self):
+        while not self.__stopped.is_set():
+            batch = self.__next_batch()
+            if len(batch) == 0:
+                continue
+            t0 = time.perf_counter()
+            try:
+                results = self.predict_fn([r.image for r in batch])
+                for r, result in zip(batch, results):
+                    r.result = result
+                error_num = 0
+            except Exception as e:
+                for r in batch:
+                    r.error = f"{type(e).__name__}: {e}"
+                error_num = len(batch)
+            t1 = time.perf_counter()
+            for r in batch:
+                r.done.set()
+            with self.__lock:
+                self.batch_hist[len(batch)] += 1
+                self.__batch_latency.append(t1 - t0)
+                self.__latency.extend(t1 - r.submit_time for r in batch)
+                self.requests += len(batch)
+                self.errors += error_num
+        return
+
+    def metrics(self):
+        with self.__lock:
+            return {"queue_depth": self.__queue.qsize(), "max_queue_depth": self.max_queue_depth,
+                    "requests": self.requests, "errors": self.errors, "rejected": self.rejected,
+                    "batches": sum(self.batch_hist.values()),
+                    "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_hist.items())},
+                    "latency_ms": latency_percentiles(list(self.__latency)),
+                    "batch_latency_ms": latency_percentiles(list(self.__batch_latency)),
+                    "max_batch_size": self.max_batch_size, "max_wait_ms": self.max_wait * 1000.0,
+                    "uptime_sec": time.time() - self.start_time}
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+        return
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    # 每个连接一个线程，图片解码在请求线程中并行执行，只有推理进入批处理
+    protocol_version = "HTTP/1.1"
+
+    def __send_json(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.__send_json(200, self.server.batcher.metrics())
+        elif self.path == "/health":
+            self.__send_json(200, {"status": "ok", "model": self.server.model_pth})
+        else:
+            self.__send_json(404, {"error": f"Unknown path: {self.path}"})
+        return
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.__send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            image = decode_image(io.BytesIO(data))
+        except Exception as e:
+            self.__send_json(400, {"error": f"Bad Image, {type(e).__name__}: {e}"})
+            return
+        try:
+            result, latency = self.server.batcher.submit(image)
+        except queue.Full:
+            self.__send_json(503, {"error": "Server Busy, Queue Full"})
+            return
+        except Exception as e:
+            self.__send_json(500, {"error": str(e)})
+            return
+        result = dict(result, width=image.shape[1], height=image.shape[0])
+        self.__send_json(200, {"result": result, "latency_ms": latency * 1000.0})
+        return
+
+    def log_message(self, format, *args):
+        # 不逐个请求打印日志，统计信息见 /metrics
+        return
+
+
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, batcher: MicroBatcher, model_pth: str = ""):
+        super().__init__(address, InferenceRequestHandler)
+        self.batcher = batcher
+        self.model_pth = model_pth
+        return
+
+
+def load_predictor(model_pth: str, device=None, half: bool = False, intra_op_threads: int = 0,
+                   inter_op_threads: int = 1):
+    # 返回 predict_fn(images) -> [结果 dict, ...]；.onnx 由 ONNX Runtime 在 CPU 上推理，其他模型由 ultralytics 加载
+    if model_pth.endswith(".onnx"):
+        try:
+            from ModelPy.onnx_engine import get_engine
+        except ImportError:
+            from onnx_engine import get_engine
+        return get_engine(model_pth, intra_op_threads, inter_op_threads).predict
+
+    from ultralytics import YOLO
+    try:
+        from ModelPy.ultr_worker import make_predict_fn
+    except ImportError:
+        from ultr_worker import make_predict_fn
+    return make_predict_fn(YOLO(model_pth), device, half)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True, help="模型文件 .pt / .onnx")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=8, help="每批最多合并的请求数")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="第一个请求最多等待合并的时间")
+    parser.add_argument("--max-queue", type=int, default=256, help="排队的请求数上限，超过时返回 503")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--half", action="store_true")
+    parser.add_argument("--intra-threads", type=int, default=0, help=".onnx 模型算子内部并行线程数，0 为默认")
+    parser.add_argument("--inter-threads", type=int, default=1, help=".onnx 模型算子之间并行线程数")
+    args = parser.parse_args()
+
+    predict_fn = load_predictor(args.model, args.device, args.half, args.intra_threads, args.inter_threads)
+    batcher = MicroBatcher(predict_fn, args.max_batch, args.max_wait_ms, args.max_queue)
+    server = InferenceServer((args.host, args.port), batcher, args.model)
+    print(f"Serving [{args.model}] on http://{args.host}:{server.server_address[1]}  "
+          f"POST /predict  GET /metrics", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+    return
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# This Python file uses the following encoding: utf-8
+# ultralytics 常驻进程  由 ultralytics 环境中的 python 直接运行，只依赖标准库和 ultralytics
+# 启动后保持 torch、ultralytics 已导入，加载过的模型保留在内存中，重复推理、评估不再重新启动进程和加载模型
+# 通信：标准输入读取认证密钥后监听本机随机端口，端口号打印到标准输出，之后通过 multiprocessing.connection 收发请求
+#   请求 {"method": 方法名, "kwargs": 参数}    应答 {"ok": True, "result": 返回值} / {"ok": False, "error": 错误信息}
+# 训练日志等输出照常打印到标准输出，由主程序读取显示
+import os
+import gc
+import sys
+import argparse
+import threading
+import traceback
+from collections import OrderedDict
+from multiprocessing.connection import Listener
+
+READY_TAG = "ULTR_WORKER_READY"
+
+
+def estimate_model_bytes(model, half: bool):
+    # 参数和缓冲区占用的内存(显存)，半精度推理时按 2 字节计算，用于缓存的内存预算
+    module = getattr(model, "model", None)
+    if module is None or not hasattr(module, "parameters"):
+        return 0
+    num = sum(p.numel() for p in module.parameters()) + sum(b.numel() for b in module.buffers())
+    return num * (2 if half else 4)
+
+
+class ModelCache:
+    """
+    LRU 模型缓存，键为 (模型绝对路径, 修改时间, 设备, 半精度)
+    同一个模型在不同设备、精度下分别缓存：ultralytics 第一次推理时把模型移动到设备并转换精度，之后不再改变
+    加入新模型后总内存超过预算或数量超过上限时，从最久未使用的开始淘汰，最新加入的模型总是保留
+    模型文件更新(修改时间变化)后，旧版本的缓存直接删除
+    """
+
+    def __init__(self, load_fn, budget_mb: int = 2048, max_models: int = 8):
+        self.load_fn = load_fn
+        self.budget_bytes = budget_mb << 20
+        self.max_models = max_models
+        self.entries = OrderedDict()  # 键 -> (模型, 估计占用字节数)
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        return
+
+    def total_bytes(self):
+        return sum(v[1] for v in self.entries.values())
+
+    def get(self, model_pth: str, device=None, half: bool = False):
+        model_pth = os.path.abspath(model_pth)
+        key = (model_pth, os.stat(model_pth).st_mtime_ns, str(device), bool(half))
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+        self.misses += 1
+        for k in [k for k in self.entries if k[0] == model_pth and k[1] != key[1]]:
+            self.__evict(k)
+        model = self.load_fn(model_pth)
+        nbytes = estimate_model_bytes(model, half)
+        while len(self.entries) > 0 and (self.total_bytes() + nbytes > self.budget_bytes
+                                         or len(self.entries) >= self.max_models):
+            self.__evict(next(iter(self.entries)))
+        self.entries[key] = (model, nbytes)
+        print(f"Model Cache: Load [{model_pth}] device={device} half={half}, {nbytes / (1 << 20):.1f} MB, "
+              f"{len(self.entries)} Models, {self.total_bytes() / (1 << 20):.1f} MB Used", flush=True)
+        return model
+
+    def __evict(self, key):
+        self.entries.pop(key)
+        self.evictions += 1
+        print(f"Model Cache: Evict [{key[0]}] device={key[2]} half={key[3]}", flush=True)
+        # 释放显存
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        return
+
+    def clear(self):
+        for key in list(self.entries):
+            self.__evict(key)
+        return
+
+    def stats(self):
+        return {"models": [{"path": k[0], "device": k[2], "half": k[3], "mb": v[1] / (1 << 20)}
+                           for k, v in self.entries.items()],
+                "used_mb": self.total_bytes() / (1 << 20), "budget_mb": self.budget_bytes / (1 << 20),
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+def results_to_dicts(results):
+    # ultralytics Results -> 批量推理的结果 dict，格式见 batch_inference.ResultWriter
+    import numpy as np
+    ret = []
+    for r in results:
+        if getattr(r, "probs", None) is not None:
+            ret.append({"class": int(r.probs.top1), "conf": float(r.probs.top1conf)})
+            continue
+        boxes = r.obb if getattr(r, "obb", None) is not None else r.boxes
+        conf = boxes.conf.cpu().numpy().reshape(-1, 1)
+        cls = boxes.cls.cpu().numpy().reshape(-1, 1)
+        data = np.concatenate([boxes.xyxy.cpu().numpy(), conf, cls], axis=1).astype(np.float64)
+        item = {"boxes": data.round(4).tolist()}
+        if boxes is r.obb:
+            # 旋转框的 4 个角点，boxes 中为其外接矩形
+            item["obb"] = boxes.xyxyxyxy.cpu().numpy().reshape(-1, 8).astype(np.float64).round(2).tolist()
+        ret.append(item)
+    return ret
+
+
+def make_predict_fn(yolo, device=None, half: bool = False):
+    # 批量推理使用的 predict_fn(images) -> [结果 dict, ...]，images 为 BGR 数组列表
+    def predict_fn(images):
+        return results_to_dicts(yolo.predict(images, device=device, half=half, verbose=False))
+
+    return predict_fn
+
+
+class UltrHandler:
+    def __init__(self, cache_mb: int = 2048, cache_models: int = 8):
+        from ultralytics import YOLO
+        self.YOLO = YOLO
+        self.cache = ModelCache(YOLO, cache_mb, cache_models)
+        return
+
+    def do_ping(self):
+        return os.getpid()
+
+    def do_check(self):
+        from ultralytics import checks
+        checks()
+        return None
+
+    def do_train(self, cfg):
+        # 训练会修改模型，每次新建模型对象，不使用缓存
+        import yaml
+        with open(cfg, "r") as fp:
+            model_pth = yaml.safe_load(fp)["model"]
+        model = self.YOLO(model_pth)
+        model.train(cfg=cfg)
+        return str(model.trainer.save_dir)
+
+    def do_val(self, model, data, project, device=None, half=False):
+        metrics = self.cache.get(model, device, half).val(data=data, project=project, device=device, half=half)
+        return {k: float(v) for k, v in metrics.results_dict.items()}
+
+    def do_predict(self, model, source, project, device=None, half=False):
+        # 逐张返回结果，不在内存中保留全部结果
+        results = self.cache.get(model, device, half).predict(source=source, project=project, save=True, stream=True,
+                                                              device=device, half=half)
+        return sum(1 for _ in results)
+
+    def do_predict_folder(self, model, source, out_pth, batch_size=16, num_workers=4, fmt="jsonl", device=None,
+                          half=False):
+        # 与本文件在同一目录下，按脚本方式运行时可以直接导入
+        from batch_inference import list_images, run_batch_inference
+        predict_fn = make_predict_fn(self.cache.get(model, device, half), device, half)
+        return run_batch_inference(predict_fn, list_images(source), out_pth, batch_size, num_workers, fmt)
+
+    def do_predict_onnx(self, model, source, out_pth, batch_size=1, num_workers=4, fmt="jsonl", intra_op_threads=0,
+                        inter_op_threads=1):
+        # InferenceSession 由 onnx_engine 缓存，重复检查同一个导出模型时不再重新创建
+        from batch_inference import list_images, run_batch_inference
+        from onnx_engine import get_engine
+        engine = get_engine(model, intra_op_threads, inter_op_threads)
+        return run_batch_inference(engine.predict, list_images(source), out_pth, batch_size, num_workers, fmt)
+
+    def do_cache_stats(self):
+        return self.cache.stats()
+
+    def do_cache_clear(self):
+        self.cache.clear()
+        return None
+
+    def do_export(self, model, format, opset):
+        return str(self.YOLO(model).export(format=format, opset=opset))
+
+
+def watch_parent():
+    # 主程序退出(标准输入关闭)时随之退出，不留下占用显存的进程
+    while sys.stdin.readline():
+        pass
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-mb", type=int, default=2048, help="模型缓存的内存预算(MB)")
+    parser.add_argument("--cache-models", type=int, default=8, help="最多缓存的模型数")
+    args = parser.parse_args()
+
+    authkey = bytes.fromhex(sys.stdin.readline().strip())
+    handler = UltrHandler(args.cache_mb, args.cache_models)
+    listener = Listener(("127.0.0.1", 0), authkey=authkey)
+    print(f"{READY_TAG} {listener.address[1]}", flush=True)
+    threading.Thread(target=watch_parent, daemon=True).start()
+
+    conn = listener.accept()
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request["method"] == "exit":
+            conn.send({"ok": True, "result": None})
+            break
+        try:
+            result = getattr(handler, "do_" + request["method"])(**request["kwargs"])
+            conn.send({"ok": True, "result": result})
+        except Exception as e:
+            traceback.print_exc()
+            conn.send({"ok": False, "error": f"{type(e).__name__}: {e}"})
+        sys.stdout.flush()
+    conn.close()
+    listener.close()
+    return
+
+
+if __name__ == "__main__":
+    main()
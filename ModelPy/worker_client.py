@@ -0,0 +1,160 @@
+# This Python file uses the following encoding: utf-8
+# ultralytics 常驻进程的客户端  每个 python 环境只启动一个常驻进程，所有 YoloModel 共用
+import os
+import atexit
+import codecs
+import threading
+import subprocess
+from multiprocessing.connection import Client
+
+from ModelPy.ultr_worker import READY_TAG
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ultr_worker.py")
+
+
+def find_env_python(tool_pth: str):
+    # yolo 可执行文件所在环境的 python：venv 在同一目录下，conda 在上一级目录
+    exe_name = "python.exe" if os.name == "nt" else "python"
+    tool_dir = os.path.dirname(os.path.abspath(tool_pth))
+    for d in (tool_dir, os.path.dirname(tool_dir)):
+        python_pth = os.path.join(d, exe_name)
+        if os.path.isfile(python_pth):
+            return python_pth
+    assert False, f"Error, Python of [{tool_pth}] Not Found"
+
+
+class WarmWorkerClient:
+    """
+    常驻进程在第一次调用时启动，进程退出(被取消或崩溃)后下一次调用时重新启动
+    同一时间只处理一个请求，call 期间进程的输出交给 on_output(text)
+    """
+
+    def __init__(self, python_pth: str, start_timeout: float = 300.0, cache_mb: int = 2048, cache_models: int = 8):
+        self.python_pth = python_pth
+        self.start_timeout = start_timeout
+        # 常驻进程中模型缓存的内存预算和数量上限，见 ultr_worker.ModelCache
+        self.cache_mb = cache_mb
+        self.cache_models = cache_models
+        self.on_output = None
+        self.__process = None
+        self.__conn = None
+        self.__port = None
+        self.__call_lock = threading.Lock()
+        return
+
+    def is_alive(self):
+        return self.__process is not None and self.__process.poll() is None and self.__conn is not None
+
+    def __read_output(self, process, ready):
+        # 输出读取线程：启动阶段查找就绪标记，之后的输出转交给 on_output
+        # 每次启动使用新的 ready，被结束的旧进程的读取线程不会影响新进程的启动
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        head = ""
+        while True:
+            data = process.stdout.read1(65536)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if not ready.is_set():
+                head += text
+                # 只检查完整的行，端口号可能被分在两次读取中
+                for line in head.split("\n")[:-1]:
+                    if line.startswith(READY_TAG):
+                        self.__port = int(line.split()[1])
+                        ready.set()
+            on_output = self.on_output
+            if on_output is not None:
+                on_output(text)
+        # 进程退出，等待启动的一方不再等待
+        ready.set()
+        return
+
+    def __start(self):
+        kwargs = dict()
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        ready = threading.Event()
+        self.__port = None
+        command = [self.python_pth, "-u", WORKER_SCRIPT, "--cache-mb", str(self.cache_mb),
+                   "--cache-models", str(self.cache_models)]
+        self.__process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT, **kwargs)
+        authkey = os.urandom(16)
+        self.__process.stdin.write((authkey.hex() + "\n").encode())
+        self.__process.stdin.flush()
+        threading.Thread(target=self.__read_output, args=(self.__process, ready), daemon=True).start()
+        ready.wait(self.start_timeout)
+        assert self.__port is not None, f"Error, Warm Worker Start Failed, Exit Code: {self.__process.poll()}"
+        self.__conn = Client(("127.0.0.1", self.__port), authkey=authkey)
+        return
+
+    def call(self, method: str, on_output=None, **kwargs):
+        with self.__call_lock:
+            if not self.is_alive():
+                self.__close_conn()
+                self.__start()
+            self.on_output = on_output
+            try:
+                self.__conn.send({"method": method, "kwargs": kwargs})
+                ret = self.__conn.recv()
+            except (EOFError, OSError):
+                # 请求过程中进程被结束
+                self.__close_conn()
+                raise RuntimeError(f"Warm Worker Exited During [{method}], Exit Code: {self.__process.poll()}")
+            finally:
+                self.on_output = None
+        assert ret["ok"], f"Error, Warm Worker [{method}] Failed: {ret['error']}"
+        return ret["result"]
+
+    def __close_conn(self):
+        if self.__conn is not None:
+            self.__conn.close()
+            self.__conn = None
+        return
+
+    def kill(self, timeout: float = 5.0):
+        # 可在其他线程中调用，用于取消正在执行的请求，已加载的模型随进程释放
+        process = self.__process
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        return
+
+    def close(self):
+        # 正常退出，请求执行中时直接结束进程
+        if self.is_alive() and self.__call_lock.acquire(timeout=1.0):
+            try:
+                self.__conn.send({"method": "exit", "kwargs": dict()})
+                self.__conn.recv()
+                self.__process.wait(5.0)
+            except (EOFError, OSError, subprocess.TimeoutExpired):
+                pass
+            finally:
+                self.__call_lock.release()
+        self.kill()
+        self.__close_conn()
+        return
+
+
+_WARM_WORKERS = dict()
+_WARM_WORKERS_LOCK = threading.Lock()
+
+
+def get_warm_worker(python_pth: str):
+    with _WARM_WORKERS_LOCK:
+        if python_pth not in _WARM_WORKERS:
+            _WARM_WORKERS[python_pth] = WarmWorkerClient(python_pth)
+        return _WARM_WORKERS[python_pth]
+
+
+@atexit.register
+def close_warm_workers():
+    with _WARM_WORKERS_LOCK:
+        for worker in _WARM_WORKERS.values():
+            worker.close()
+        _WARM_WORKERS.clear()
+    return
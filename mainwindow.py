@@ -3,7 +3,8 @@ import subprocess
 import sys
 import os
 
-from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel, QMessageBox
+from PySide6.QtWidgets import QApplication, QMainWindow, QPushButton, QLabel, QMessageBox, QCheckBox, \
+    QComboBox, QSpinBox, QDoubleSpinBox, QLineEdit, QHBoxLayout, QVBoxLayout, QToolButton, QMenu
 from PySide6.QtCore import QTimer
 from PySide6.QtGui import QIcon, QColor, QPalette
 
@@ -12,12 +13,20 @@ from PySide6.QtGui import QIcon, QColor, QPalette
 #     pyside6-uic form.ui -o ui_form.py, or
 #     pyside2-uic form.ui -o ui_form.py
 from ui_form import Ui_MainWindow
-from ModelPy.model import YoloModel
+from ModelPy.model import YoloModel, MODEL_BACKENDS
 from Controls import MySignals, ModelTrainControl, ModelEvaluateControl, \
-    ModelInferenceControl, ModelCheckControl, ModelShowTrainInfoControl, ModelExportControl, \
+    ModelInferenceControl, ModelCheckControl, ModelShowTrainInfoControl, ModelExportControl, ModelServeControl, \
     ClasDataLabelControl, ClasDataSplitControl, DetDataLabelControl, DetDataSplitControl
 
-from utils.utils import get_timenow
+from DataSetPy.split_strategy import SPLIT_STRATEGIES, build_split_strategy
+from DataSetPy.tiling import TileConfig
+from DataSetPy.label_format import build_label_converter
+from DataSetPy.resize_cache import ResizeConfig
+from utils.utils import get_timenow, MATERIALIZE_MODES
+from utils.scheduler import JobScheduler, JOB_FAILED
+from utils.log_buffer import LogBuffer, LogFlusher
+from ModelPy.metrics import TrainMetricsMonitor
+from ModelPy.batch_inference import RESULT_FORMATS
 
 TASK_TYPE = 0 # 0 img_clas  1 obj_det  2 obj_seg
 
@@ -29,6 +38,7 @@ class MainWindow(QMainWindow):
 
         self.DataLabelControl = None
         self.DataSplitControl = None
+        self.ui.rb_seg_prj.setEnabled(True)
         self.check_task_type()
 
         # 判断任务类型
@@ -36,11 +46,25 @@ class MainWindow(QMainWindow):
         self.ui.rb_det_prj.clicked.connect(self.check_task_type)
         self.ui.rb_seg_prj.clicked.connect(self.check_task_type)
 
+        # 模型运行方式：cli 每次启动 yolo 进程；worker 使用常驻的 ultralytics 进程，重复推理、评估不再重新加载
+        self.cb_model_backend = QComboBox()
+        self.cb_model_backend.addItems(MODEL_BACKENDS)
+        self.ui.horizontalLayout_7.addWidget(QLabel("运行方式："))
+        self.ui.horizontalLayout_7.addWidget(self.cb_model_backend)
+
         # 标识运行状态
         self.status_label = QLabel("~空闲~")
         self.status_label.setStyleSheet("background-color: darkseagreen; color: white;")
         self.status_label.setMargin(5)
         self.ui.statusbar.addWidget(self.status_label)
+        # 任务列表：取消任意排队中或运行中的任务
+        self.job_menu = QMenu(self)
+        self.job_menu.aboutToShow.connect(self.on_job_menu_show)
+        self.btn_jobs = QToolButton()
+        self.btn_jobs.setText("任务")
+        self.btn_jobs.setMenu(self.job_menu)
+        self.btn_jobs.setPopupMode(QToolButton.ToolButtonPopupMode.InstantPopup)
+        self.ui.statusbar.addWidget(self.btn_jobs)
 
         # 标识软件版本
         version_label = QLabel("Version 0.8")
@@ -50,6 +74,14 @@ class MainWindow(QMainWindow):
         clock_label = QLabel("xx:xx:xx")
         clock_label.setMargin(5)
         self.ui.statusbar.addWidget(clock_label)
+        # 数据处理进度：已处理数量、吞吐量、预计剩余时间
+        self.progress_label = QLabel("")
+        self.progress_label.setMargin(5)
+        self.ui.statusbar.addWidget(self.progress_label)
+        # 训练进度：epoch、batch、loss，由训练输出解析得到
+        self.train_metrics_label = QLabel("")
+        self.train_metrics_label.setMargin(5)
+        self.ui.statusbar.addWidget(self.train_metrics_label)
         self.workdir = os.path.join(os.getcwd(), "WorkDir")
         if not os.path.isdir(self.workdir):
             os.makedirs(self.workdir)
@@ -57,6 +89,92 @@ class MainWindow(QMainWindow):
         # 目标检测 --- 数据处理页面
         self.ui.btn_label.clicked.connect(self.on_btn_label_clicked)
         self.ui.btn_split.clicked.connect(self.on_btn_split_clicked)
+        # 增量切分：复用上次切分的数据集目录，只处理新增或修改过的样本
+        self.cb_incremental = QCheckBox("增量切分")
+        self.cb_incremental.setChecked(False)
+        self.ui.horizontalLayout_6.addWidget(self.cb_incremental)
+        # 数据集图片生成方式：复制 / 硬链接 / 软链接 / reflink，不支持时自动退回复制
+        self.cb_materialize_mode = QComboBox()
+        self.cb_materialize_mode.addItems(MATERIALIZE_MODES)
+        self.ui.horizontalLayout_6.addWidget(self.cb_materialize_mode)
+        # 分片打包：切分完成后把图片和标注打包成少量大文件，0 不打包
+        self.sb_shard_size = QSpinBox()
+        self.sb_shard_size.setRange(0, 8192)
+        self.sb_shard_size.setSingleStep(128)
+        self.sb_shard_size.setValue(0)
+        self.sb_shard_size.setPrefix("分片(MB): ")
+        self.ui.horizontalLayout_6.addWidget(self.sb_shard_size)
+        # 图片完整性检查：损坏的图片不放入数据集，检查结果缓存，之后几乎没有开销
+        self.cb_check_images = QCheckBox("检查图片")
+        self.cb_check_images.setChecked(True)
+        self.ui.horizontalLayout_6.addWidget(self.cb_check_images)
+        # 切分策略：默认(分类按类别分层，检测固定种子随机) / 随机 / 分层 / 按文件名分组 / 哈希分桶
+        self.cb_split_strategy = QComboBox()
+        self.cb_split_strategy.addItems(["default", ] + list(SPLIT_STRATEGIES.keys()))
+        self.sb_split_seed = QSpinBox()
+        self.sb_split_seed.setMaximum(99999)
+        self.sb_split_seed.setPrefix("seed: ")
+        self.le_group_pattern = QLineEdit()
+        self.le_group_pattern.setPlaceholderText("分组正则，默认去掉文件名最后一个 _xxx 后缀")
+        split_strategy_layout = QHBoxLayout()
+        split_strategy_layout.addWidget(self.cb_split_strategy)
+        split_strategy_layout.addWidget(self.sb_split_seed)
+        split_strategy_layout.addWidget(self.le_group_pattern)
+        self.ui.gridLayout.addWidget(QLabel("切分策略："), 6, 0, 1, 1)
+        self.ui.gridLayout.addLayout(split_strategy_layout, 6, 2, 1, 1)
+        # 切图(仅目标检测)：目标相对原图太小时，切成小图训练
+        self.cb_tile = QCheckBox("切图")
+        self.sb_tile_size = QSpinBox()
+        self.sb_tile_size.setRange(64, 4096)
+        self.sb_tile_size.setValue(640)
+        self.sb_tile_size.setPrefix("size: ")
+        self.dsb_tile_overlap = QDoubleSpinBox()
+        self.dsb_tile_overlap.setRange(0.0, 0.9)
+        self.dsb_tile_overlap.setSingleStep(0.05)
+        self.dsb_tile_overlap.setValue(0.2)
+        self.dsb_tile_overlap.setPrefix("overlap: ")
+        self.dsb_tile_empty_keep = QDoubleSpinBox()
+        self.dsb_tile_empty_keep.setRange(0.0, 1.0)
+        self.dsb_tile_empty_keep.setSingleStep(0.05)
+        self.dsb_tile_empty_keep.setValue(0.1)
+        self.dsb_tile_empty_keep.setPrefix("空白保留: ")
+        tile_layout = QHBoxLayout()
+        tile_layout.addWidget(self.cb_tile)
+        tile_layout.addWidget(self.sb_tile_size)
+        tile_layout.addWidget(self.dsb_tile_overlap)
+        tile_layout.addWidget(self.dsb_tile_empty_keep)
+        self.ui.gridLayout.addWidget(QLabel("切图："), 7, 0, 1, 1)
+        self.ui.gridLayout.addLayout(tile_layout, 7, 2, 1, 1)
+        # 分割标注格式(仅分割任务)：seg 多边形 / obb 旋转框，多边形可精简顶点(像素)
+        self.cb_label_format = QComboBox()
+        self.cb_label_format.addItems(["seg", "obb"])
+        self.dsb_simplify_tolerance = QDoubleSpinBox()
+        self.dsb_simplify_tolerance.setRange(0.0, 20.0)
+        self.dsb_simplify_tolerance.setSingleStep(0.5)
+        self.dsb_simplify_tolerance.setValue(0.0)
+        self.dsb_simplify_tolerance.setPrefix("顶点精简: ")
+        label_format_layout = QHBoxLayout()
+        label_format_layout.addWidget(self.cb_label_format)
+        label_format_layout.addWidget(self.dsb_simplify_tolerance)
+        self.ui.gridLayout.addWidget(QLabel("分割格式："), 8, 0, 1, 1)
+        self.ui.gridLayout.addLayout(label_format_layout, 8, 2, 1, 1)
+        # 预缩放：大图先缩放到训练尺寸再保存到数据集，缩放结果缓存，相同尺寸的实验复用
+        self.cb_resize = QCheckBox("预缩放")
+        self.sb_resize_imgsz = QSpinBox()
+        self.sb_resize_imgsz.setRange(32, 8192)
+        self.sb_resize_imgsz.setSingleStep(32)
+        self.sb_resize_imgsz.setValue(640)
+        self.sb_resize_imgsz.setPrefix("imgsz: ")
+        self.sb_resize_quality = QSpinBox()
+        self.sb_resize_quality.setRange(50, 100)
+        self.sb_resize_quality.setValue(95)
+        self.sb_resize_quality.setPrefix("quality: ")
+        resize_layout = QHBoxLayout()
+        resize_layout.addWidget(self.cb_resize)
+        resize_layout.addWidget(self.sb_resize_imgsz)
+        resize_layout.addWidget(self.sb_resize_quality)
+        self.ui.gridLayout.addWidget(QLabel("预缩放："), 9, 0, 1, 1)
+        self.ui.gridLayout.addLayout(resize_layout, 9, 2, 1, 1)
 
         # 目标检测 --- 模型训练页面
         self.train_config_pth = None
@@ -65,10 +183,67 @@ class MainWindow(QMainWindow):
         self.ui.btn_open_cfg.clicked.connect(self.on_btn_open_cfg_clicked)
         self.ui.btn_train.clicked.connect(self.on_btn_train_clicked)
         self.ui.btn_show_train_info.clicked.connect(self.on_btn_show_train_info_clicked)
+        # 停止按钮只连接一次，取消当前正在运行的同名任务
+        self.ui.btn_stop_train.clicked.connect(lambda: self.scheduler.cancel_by_name("Train"))
+        self.ui.btn_stop_show_train.clicked.connect(lambda: self.scheduler.cancel_by_name("ShowTrainInfo"))
         self.ui.le_train_tool_pth.textChanged.connect(
             lambda: self.ui.le_test_tool_pth.setText(self.ui.le_train_tool_pth.text()))
 
         # 目标检测 --- 模型推理与导出页面
+        # 文件夹推理：每批图片数、结果文件格式
+        self.sb_infer_batch = QSpinBox()
+        self.sb_infer_batch.setRange(1, 256)
+        self.sb_infer_batch.setValue(16)
+        self.sb_infer_batch.setPrefix("batch: ")
+        self.cb_infer_format = QComboBox()
+        self.cb_infer_format.addItems(RESULT_FORMATS)
+        infer_layout = QHBoxLayout()
+        infer_layout.addWidget(self.sb_infer_batch)
+        infer_layout.addWidget(self.cb_infer_format)
+        self.ui.gridLayout_6.addWidget(QLabel("文件夹推理："), 3, 0, 1, 1)
+        self.ui.gridLayout_6.addLayout(infer_layout, 3, 2, 1, 1)
+        # 使用模型为 .onnx 时由 ONNX Runtime 在 CPU 上推理：算子内部、算子之间的并行线程数，0 为默认
+        self.sb_onnx_intra_threads = QSpinBox()
+        self.sb_onnx_intra_threads.setRange(0, os.cpu_count() or 1)
+        self.sb_onnx_intra_threads.setValue(0)
+        self.sb_onnx_intra_threads.setPrefix("intra threads: ")
+        self.sb_onnx_inter_threads = QSpinBox()
+        self.sb_onnx_inter_threads.setRange(0, os.cpu_count() or 1)
+        self.sb_onnx_inter_threads.setValue(1)
+        self.sb_onnx_inter_threads.setPrefix("inter threads: ")
+        onnx_layout = QHBoxLayout()
+        onnx_layout.addWidget(self.sb_onnx_intra_threads)
+        onnx_layout.addWidget(self.sb_onnx_inter_threads)
+        self.ui.gridLayout_6.addWidget(QLabel("ONNX 推理："), 5, 0, 1, 1)
+        self.ui.gridLayout_6.addLayout(onnx_layout, 5, 2, 1, 1)
+        # 本机推理服务：并发请求合并为小批量推理，供其他工位通过 HTTP 调用
+        self.sb_serve_port = QSpinBox()
+        self.sb_serve_port.setRange(1024, 65535)
+        self.sb_serve_port.setValue(8000)
+        self.sb_serve_port.setPrefix("port: ")
+        self.sb_serve_max_batch = QSpinBox()
+        self.sb_serve_max_batch.setRange(1, 64)
+        self.sb_serve_max_batch.setValue(8)
+        self.sb_serve_max_batch.setPrefix("max batch: ")
+        self.dsb_serve_max_wait = QDoubleSpinBox()
+        self.dsb_serve_max_wait.setRange(0.0, 100.0)
+        self.dsb_serve_max_wait.setValue(5.0)
+        self.dsb_serve_max_wait.setPrefix("max wait(ms): ")
+        serve_layout = QHBoxLayout()
+        serve_layout.addWidget(self.sb_serve_port)
+        serve_layout.addWidget(self.sb_serve_max_batch)
+        serve_layout.addWidget(self.dsb_serve_max_wait)
+        self.ui.gridLayout_6.addWidget(QLabel("推理服务："), 4, 0, 1, 1)
+        self.ui.gridLayout_6.addLayout(serve_layout, 4, 2, 1, 1)
+        self.btn_serve = QPushButton("启动服务")
+        self.btn_stop_serve = QPushButton("停止服务")
+        self.btn_stop_serve.setDisabled(True)
+        serve_btn_layout = QVBoxLayout()
+        serve_btn_layout.addWidget(self.btn_serve)
+        serve_btn_layout.addWidget(self.btn_stop_serve)
+        self.ui.horizontalLayout_4.addLayout(serve_btn_layout)
+        self.btn_serve.clicked.connect(self.on_btn_serve_clicked)
+        self.btn_stop_serve.clicked.connect(lambda: self.scheduler.cancel_by_name("Serve"))
         self.ui.btn_inference.clicked.connect(self.on_btn_inference_clicked)
         self.ui.btn_export.clicked.connect(self.on_btn_export_clicked)
         self.ui.btn_open_model_dir.clicked.connect(self.on_btn_open_model_dir_clicked)
@@ -78,11 +253,18 @@ class MainWindow(QMainWindow):
         self.my_signal = MySignals()
         self.my_signal.my_btn_clicked_signal.connect(self.write_system_log)
 
+        # 后台任务统一由调度器排队执行，运行状态按调度器中的任务数显示
+        self.scheduler = JobScheduler(parent=self)
+        self.scheduler.job_state_signal.connect(self.on_job_state)
+        self.scheduler.queue_changed_signal.connect(self.on_queue_changed)
+
+        # 子进程日志：所有模型任务共用一个缓冲区，按固定帧率批量刷新到日志框，日志框最多保留 5000 行
+        self.model_log = LogBuffer()
+        self.log_flusher = LogFlusher(self.ui.pte_log_info, self.model_log, fps=10, max_block_count=5000)
+
         # 界面刷新
         def update_time():
             clock_label.setText(get_timenow())
-            if self.ui.pte_log_info.toPlainText().count("\n") > 1000:
-                self.ui.pte_log_info.clear()
             return
 
         timer = QTimer(self)
@@ -114,23 +296,31 @@ class MainWindow(QMainWindow):
             self.write_system_log("INFO", "Use Detection Task Mode")
         elif self.ui.rb_seg_prj.isChecked():
             TASK_TYPE = 2
+            # 分割任务同样使用 labelme 标注，切分时按多边形或旋转框输出
+            self.DataLabelControl = DetDataLabelControl
+            self.DataSplitControl = DetDataSplitControl
             self.ui.tabWidget_2.setPalette(QPalette(QColor(0,0,255)))
+            self.ui.lb_dataset.setText("数据集配置文件:")
             self.ui.le_labelme_pth.setDisabled(False)
             self.write_system_log("INFO", "Use Segmentation Task Mode")
         else:
             self.write_system_log("Error", "Use Wrong Task Mode")
             raise RuntimeError("Error, Wrong TASK TYPE")
 
+    def __get_seg_label_converter(self):
+        if self.cb_label_format.currentText() == "seg":
+            return build_label_converter("seg", simplify_tolerance=self.dsb_simplify_tolerance.value())
+        return build_label_converter(self.cb_label_format.currentText())
+
     def write_system_log(self, level, content):
         self.ui.pte_log_info.appendPlainText(f"[{get_timenow()}] [{level}] {content}")
         return
 
-    def write_model_log(self, message):
-        self.ui.pte_log_info.appendPlainText(message)
-        return
-
-    def status_label_busy(self):
-        self.status_label.setText("HardWorking...")
+    def status_label_busy(self, running_num=1, pending_num=0):
+        text = "HardWorking..." if running_num <= 1 else f"HardWorking x{running_num}..."
+        if pending_num > 0:
+            text += f" ({pending_num} Queued)"
+        self.status_label.setText(text)
         self.status_label.setStyleSheet("background-color: red; color: white;")
         return
 
@@ -146,6 +336,70 @@ class MainWindow(QMainWindow):
         else:
             button_obj.setDisabled(False)
 
+    def on_queue_changed(self, running_num, pending_num):
+        # 所有任务都结束后才显示空闲
+        if running_num + pending_num > 0:
+            self.status_label_busy(running_num, pending_num)
+        else:
+            self.status_label_idle()
+        return
+
+    def on_job_menu_show(self):
+        # 每次打开时按当前任务重建菜单
+        self.job_menu.clear()
+        jobs = self.scheduler.all_jobs()
+        for job in jobs:
+            action = self.job_menu.addAction(f"取消 {job} {job.state}")
+            action.setEnabled(not job.cancel_requested)
+            action.triggered.connect(lambda checked=False, job_id=job.job_id: self.scheduler.cancel(job_id))
+        if len(jobs) == 0:
+            self.job_menu.addAction("没有任务").setEnabled(False)
+        else:
+            self.job_menu.addSeparator()
+            self.job_menu.addAction("取消全部任务").triggered.connect(lambda: self.scheduler.cancel_all())
+        return
+
+    def on_job_state(self, job_id, name, state):
+        self.write_system_log("Error" if state == JOB_FAILED else "INFO", f"Job {job_id} [{name}] {state}")
+        return
+
+    def start_dataset_worker(self, dataset_worker, name, complete_message):
+        # 数据处理线程异步执行，完成、出错、进度都通过信号通知界面，界面不等待线程结束
+        dataset_worker.progress_signal.connect(self.on_dataset_progress)
+        dataset_worker.error_signal.connect(self.on_job_error)
+        dataset_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_label))
+        dataset_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_split))
+        dataset_worker.finished.connect(
+            lambda: dataset_worker.exit_code == 0 and self.write_system_log("INFO", complete_message))
+        self.scheduler.submit(dataset_worker, name)
+        return
+
+    def start_model_worker(self, model_worker, name, *buttons):
+        # 模型任务提交到调度器，任务结束(含取消、出错)后恢复 buttons 的状态
+        model_worker.error_signal.connect(self.on_job_error)
+        model_worker.model.log_buffer = self.model_log
+        for button in buttons:
+            model_worker.finished.connect(lambda b=button: self.button_status_invert(b))
+        self.scheduler.submit(model_worker, name)
+        return
+
+    def on_dataset_progress(self, stage, done, total, rate, eta):
+        text = f"{stage}: {done}/{total}" if total > 0 else f"{stage}: {done}"
+        text += f"  {rate:.1f} files/s"
+        if eta >= 0:
+            text += f"  ETA {int(eta) // 60:02d}:{int(eta) % 60:02d}"
+        self.progress_label.setText(text)
+        if total > 0 and done == total:
+            self.write_system_log("INFO", text)
+        return
+
+    def on_job_error(self, message):
+        self.progress_label.setText("")
+        self.write_system_log("Error", message)
+        self.msg_box.setText(message)
+        self.msg_box.exec()
+        return
+
     def on_btn_label_clicked(self):
         self.my_signal.my_btn_clicked_signal.emit("INFO", "DataSet Labelling Start...")
         self.button_status_invert(self.ui.btn_label)
@@ -157,17 +411,11 @@ class MainWindow(QMainWindow):
         obj_classes = tuple(obj_classes_str.split(","))
 
         try:
-            global worker
             worker = self.DataLabelControl(tool_path, org_img_dir, obj_classes)
-            worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_label))
-            worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_split))
-            worker.finished.connect(lambda: self.write_system_log("INFO", "DataSet Label Complete."))
-            worker.start()
-
-            if worker.wait() and worker.exit_code==1:
-                raise worker.exception
-
+            self.start_dataset_worker(worker, "Label", "DataSet Label Complete.")
         except Exception as ex:
+            self.button_status_invert(self.ui.btn_label)
+            self.button_status_invert(self.ui.btn_split)
             self.msg_box.setText(str(ex))
             self.msg_box.exec()
         return
@@ -187,17 +435,32 @@ class MainWindow(QMainWindow):
         try:
             assert train_data_percent > 0.0, f"Error, Set train precent:{train_data_percent} too small"
 
-            global worker
-            worker = self.DataSplitControl(tool_path, org_img_dir, obj_classes, train_data_percent)
-            worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_label))
-            worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_split))
-            worker.finished.connect(lambda: self.write_system_log("INFO", "DataSet Split Complete."))
-            worker.start()
-
-            if worker.wait() and worker.exit_code==1:
-                raise worker.exception
-
+            split_strategy = None
+            strategy_name = self.cb_split_strategy.currentText()
+            if strategy_name != "default":
+                kwargs = dict()
+                if strategy_name == "group" and self.le_group_pattern.text().strip():
+                    kwargs["pattern"] = self.le_group_pattern.text().strip()
+                split_strategy = build_split_strategy(strategy_name, self.sb_split_seed.value(), **kwargs)
+
+            kwargs = dict()
+            if TASK_TYPE == 1 and self.cb_tile.isChecked():
+                kwargs["tile_config"] = TileConfig(self.sb_tile_size.value(), self.dsb_tile_overlap.value(),
+                                                   empty_keep_ratio=self.dsb_tile_empty_keep.value())
+            if TASK_TYPE == 2:
+                kwargs["label_converter"] = self.__get_seg_label_converter()
+            if self.cb_resize.isChecked():
+                kwargs["resize_config"] = ResizeConfig(self.sb_resize_imgsz.value(), self.sb_resize_quality.value())
+
+            worker = self.DataSplitControl(tool_path, org_img_dir, obj_classes, train_data_percent,
+                                           incremental=self.cb_incremental.isChecked(),
+                                           materialize_mode=self.cb_materialize_mode.currentText(),
+                                           split_strategy=split_strategy, shard_size_mb=self.sb_shard_size.value(),
+                                           check_images=self.cb_check_images.isChecked(), **kwargs)
+            self.start_dataset_worker(worker, "Split", "DataSet Split Complete.")
         except Exception as ex:
+            self.button_status_invert(self.ui.btn_label)
+            self.button_status_invert(self.ui.btn_split)
             self.msg_box.setText(str(ex))
             self.msg_box.exec()
         return
@@ -216,11 +479,8 @@ class MainWindow(QMainWindow):
             pt_file_lst = sorted(pt_file_lst, key=lambda t: t[1])
             self.ui.cb_pretrained_model_file.addItems([i[0] for i in pt_file_lst])
 
-            global model_worker
             model_worker = ModelCheckControl(tool_path, pretrained_model_dir, temp_cfg_path)
-            model_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_check_env))
-            model_worker.model.my_process_signal.send_message_signal.connect(self.write_model_log)
-            model_worker.start()
+            self.start_model_worker(model_worker, "CheckEnv", self.ui.btn_check_env)
         except Exception as ex:
             self.msg_box.setText(str(ex))
             self.msg_box.exec()
@@ -254,7 +514,7 @@ class MainWindow(QMainWindow):
             elif TASK_TYPE == 1:
                 task_mode = "detect"
             elif TASK_TYPE == 2:
-                task_mode = "segment"
+                task_mode = self.__get_seg_label_converter().TASK_MODE
             else:
                 task_mode = ""
             self.train_config_pth = model.make_train_cfg(task_mode, dataset_cfg_pth, used_pretrained_model_pth, epochs,
@@ -293,15 +553,16 @@ class MainWindow(QMainWindow):
             pretrained_model_dir = self.ui.le_pretrained_dir.text().strip()
             temp_cfg_path = self.ui.le_temp_cfg_pth.text().strip()
 
-            global train_worker
-            train_worker = ModelTrainControl(tool_path, pretrained_model_dir, temp_cfg_path, self.train_config_pth)
-            train_worker.started.connect(self.status_label_busy)
-            train_worker.finished.connect(self.status_label_idle)
-            train_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_train))
-            train_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_stop_train))
-            train_worker.model.my_process_signal.send_message_signal.connect(self.write_model_log)
-            self.ui.btn_stop_train.clicked.connect(train_worker.shutdown)
-            train_worker.start()
+            train_worker = ModelTrainControl(tool_path, pretrained_model_dir, temp_cfg_path, self.train_config_pth,
+                                             self.cb_model_backend.currentText())
+            # 训练配置保存在 Proj_<时间戳> 目录下，ultralytics 的 results.csv 也写在该目录下
+            monitor = TrainMetricsMonitor(os.path.dirname(self.train_config_pth), parent=self)
+            monitor.step_signal.connect(self.on_train_step)
+            monitor.epoch_signal.connect(self.on_train_epoch)
+            train_worker.model.output_listeners.append(monitor.feed)
+            train_worker.finished.connect(monitor.stop)
+            train_worker.finished.connect(monitor.deleteLater)
+            self.start_model_worker(train_worker, "Train", self.ui.btn_train, self.ui.btn_stop_train)
         except Exception as ex:
             self.msg_box.setText(str(ex))
             self.msg_box.exec()
@@ -310,6 +571,23 @@ class MainWindow(QMainWindow):
             self.button_status_invert(self.ui.btn_stop_train)
         return
 
+    def on_train_step(self, step):
+        text = f"Epoch {step['epoch']}/{step['epochs']}"
+        if "batch" in step:
+            text += f"  {step['batch']}/{step['batches']}"
+        for k, v in step.items():
+            if k.endswith("loss") and isinstance(v, float):
+                text += f"  {k}: {v:.4f}"
+        self.train_metrics_label.setText(text)
+        return
+
+    def on_train_epoch(self, row):
+        # 每个 epoch 记录一次 loss 和验证指标
+        items = [f"{k}={v:.4g}" for k, v in row.items()
+                 if isinstance(v, float) and ("loss" in k or k.startswith("metrics/"))]
+        self.write_system_log("INFO", f"Epoch {int(row.get('epoch', 0))}: " + ", ".join(items))
+        return
+
     def on_btn_show_train_info_clicked(self):
 
         self.button_status_invert(self.ui.btn_show_train_info)
@@ -318,13 +596,9 @@ class MainWindow(QMainWindow):
             tool_path = self.ui.le_train_tool_pth.text().strip()
             temp_cfg_path = self.ui.le_temp_cfg_pth.text().strip()
             pretrained_model_dir = self.ui.le_pretrained_dir.text().strip()
-            global show_worker
             show_worker = ModelShowTrainInfoControl(tool_path, pretrained_model_dir, temp_cfg_path, 8899)
-            show_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_show_train_info))
-            show_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_stop_show_train))
-            show_worker.model.my_process_signal.send_message_signal.connect(self.write_model_log)
-            self.ui.btn_stop_show_train.clicked.connect(show_worker.shutdown)
-            show_worker.start()
+            self.start_model_worker(show_worker, "ShowTrainInfo", self.ui.btn_show_train_info,
+                                    self.ui.btn_stop_show_train)
         except Exception as ex:
             self.msg_box.setText(str(ex))
             self.msg_box.exec()
@@ -346,13 +620,12 @@ class MainWindow(QMainWindow):
             assert os.path.isdir(test_image_path) or os.path.isfile(
                 test_image_path), f"Error, Test Image File:{test_image_path} Not Found!"
 
-            global inference_worker
-            inference_worker = ModelInferenceControl(test_tool_path, "", "", used_model_path, test_image_path)
-            inference_worker.started.connect(self.status_label_busy)
-            inference_worker.finished.connect(self.status_label_idle)
-            inference_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_inference))
-            inference_worker.model.my_process_signal.send_message_signal.connect(self.write_model_log)
-            inference_worker.start()
+            inference_worker = ModelInferenceControl(test_tool_path, "", "", used_model_path, test_image_path,
+                                                     self.cb_model_backend.currentText(), self.sb_infer_batch.value(),
+                                                     self.cb_infer_format.currentText(),
+                                                     (self.sb_onnx_intra_threads.value(),
+                                                      self.sb_onnx_inter_threads.value()))
+            self.start_model_worker(inference_worker, "Inference", self.ui.btn_inference)
         except Exception as ex:
             self.msg_box.setText(str(ex))
             self.msg_box.exec()
@@ -367,17 +640,34 @@ class MainWindow(QMainWindow):
             used_model_path = self.ui.le_used_model_path.text().strip()
             assert os.path.isfile(used_model_path), f"Error, Model File:{used_model_path} Not Found!"
 
-            global export_worker
-            export_worker = ModelExportControl(test_tool_path, "", "", used_model_path)
-            export_worker.finished.connect(lambda: self.button_status_invert(self.ui.btn_export))
-            export_worker.model.my_process_signal.send_message_signal.connect(self.write_model_log)
-            export_worker.start()
+            export_worker = ModelExportControl(test_tool_path, "", "", used_model_path,
+                                               self.cb_model_backend.currentText())
+            self.start_model_worker(export_worker, "Export", self.ui.btn_export)
         except Exception as ex:
             self.msg_box.setText(str(ex))
             self.msg_box.exec()
             self.button_status_invert(self.ui.btn_export)
         return
 
+    def on_btn_serve_clicked(self):
+        self.button_status_invert(self.btn_serve)
+        self.button_status_invert(self.btn_stop_serve)
+        try:
+            test_tool_path = self.ui.le_test_tool_pth.text().strip()
+            assert os.path.isfile(test_tool_path), f"Error, Test Tool:{test_tool_path} Not Found!"
+            used_model_path = self.ui.le_used_model_path.text().strip()
+            assert os.path.isfile(used_model_path), f"Error, Model File:{used_model_path} Not Found!"
+
+            serve_worker = ModelServeControl(test_tool_path, "", "", used_model_path, self.sb_serve_port.value(),
+                                             self.sb_serve_max_batch.value(), self.dsb_serve_max_wait.value())
+            self.start_model_worker(serve_worker, "Serve", self.btn_serve, self.btn_stop_serve)
+        except Exception as ex:
+            self.msg_box.setText(str(ex))
+            self.msg_box.exec()
+            self.button_status_invert(self.btn_serve)
+            self.button_status_invert(self.btn_stop_serve)
+        return
+
     def on_btn_open_model_dir_clicked(self):
         try:
             used_model_path = self.ui.le_used_model_path.text().strip()
@@ -392,7 +682,6 @@ class MainWindow(QMainWindow):
 
 # Done： 完成整体流程  数据处理+模型训练+模型推理
 # TODO: 在不同电脑上做测试。。。
-# TODO: 当同时发生多个任务时，某一个任务进行完成就会把状态改成空闲。。待改正
 # TODO: 当一个任务进行过程中，切换到另一个任务怎么办？
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,128 @@
+# This Python file uses the following encoding: utf-8
+# 日志缓冲  子进程输出先写入环形缓冲区，界面按固定帧率批量刷新，不再每行发一次信号
+# 进度条用 \r 原地刷新，同一行的多次刷新合并为一行，界面上只替换最后一行
+import threading
+from collections import deque
+
+from PySide6.QtCore import QObject, QTimer
+from PySide6.QtGui import QTextCursor
+
+
+class LogBuffer:
+    """
+    线程安全的日志环形缓冲区，子进程读取线程调用 feed，界面线程调用 drain
+    记录为 (文本, 是否替换上一行, 是否为进度行)，进度行之后可能被替换
+    缓冲区满时丢弃最旧的记录，drain 时汇报丢弃的行数
+    """
+
+    def __init__(self, max_lines: int = 5000):
+        self.max_lines = max_lines
+        self.__records = deque(maxlen=max_lines)
+        self.__lock = threading.Lock()
+        self.__partial = ""  # 还没遇到 \r 或 \n 的文本
+        self.__overwrite = False  # 当前行是否已经以进度行的形式输出过，再次输出时替换
+        self.__dropped = 0
+        return
+
+    def __push(self, text, replace, in_place):
+        # 替换上一行且上一行还没刷新到界面时，直接在缓冲区中替换，一帧内的多次进度刷新只保留最后一次
+        if replace and len(self.__records) > 0:
+            self.__records[-1] = (text, self.__records[-1][1], in_place)
+            return
+        if len(self.__records) == self.max_lines:
+            self.__dropped += 1
+        self.__records.append((text, replace, in_place))
+        return
+
+    def feed(self, data: str):
+        # data 为任意长度的输出片段，可以在行中间截断
+        with self.__lock:
+            start = 0
+            for i, ch in enumerate(data):
+                if ch != "\r" and ch != "\n":
+                    continue
+                # \r\n 按普通换行处理，\r 由 rstrip 去掉
+                if ch == "\r" and i + 1 < len(data) and data[i + 1] == "\n":
+                    continue
+                text = (self.__partial + data[start:i]).rstrip()
+                self.__partial = ""
+                start = i + 1
+                if ch == "\r":
+                    if text:
+                        self.__push(text, self.__overwrite, True)
+                        self.__overwrite = True
+                else:
+                    if text:
+                        self.__push(text, self.__overwrite, False)
+                    self.__overwrite = False
+            self.__partial += data[start:]
+        return
+
+    def write_line(self, line: str):
+        self.feed(line + "\n")
+        return
+
+    def drain(self):
+        # 返回 (丢弃的行数, [(文本, 是否替换上一行, 是否为进度行), ...])，并清空缓冲区
+        with self.__lock:
+            records = list(self.__records)
+            dropped = self.__dropped
+            self.__records.clear()
+            self.__dropped = 0
+        return dropped, records
+
+
+class LogFlusher(QObject):
+    """
+    按固定帧率把 LogBuffer 中的日志刷新到 QPlainTextEdit
+    连续的普通行一次 appendPlainText，进度行替换文本框的最后一行
+    文本框的最大行数由 setMaximumBlockCount 限制，超出时自动删除最旧的行
+    """
+
+    def __init__(self, text_edit, log_buffer: LogBuffer, fps: int = 10, max_block_count: int = 5000):
+        super().__init__(text_edit)
+        self.text_edit = text_edit
+        self.log_buffer = log_buffer
+        self.text_edit.setMaximumBlockCount(max_block_count)
+        self.__last_progress = None  # 文本框最后一行是进度行时记录其文本
+        self.__timer = QTimer(self)
+        self.__timer.setInterval(max(1, 1000 // fps))
+        self.__timer.timeout.connect(self.flush)
+        self.__timer.start()
+        return
+
+    def flush(self):
+        dropped, records = self.log_buffer.drain()
+        if dropped > 0:
+            self.__append([(f"... {dropped} lines skipped", False), ])
+        lines = []
+        for text, replace, in_place in records:
+            if replace:
+                self.__append(lines)
+                lines = []
+                self.__replace_last(text, in_place)
+            else:
+                lines.append((text, in_place))
+        self.__append(lines)
+        return
+
+    def __append(self, lines):
+        # lines: [(文本, 是否为进度行), ...]，最后一行是进度行时，之后的进度刷新替换这一行
+        if len(lines) == 0:
+            return
+        self.text_edit.appendPlainText("\n".join(t for t, _ in lines))
+        self.__last_progress = lines[-1][0] if lines[-1][1] else None
+        return
+
+    def __replace_last(self, text, in_place):
+        doc = self.text_edit.document()
+        # 最后一行已经不是进度行(期间写入了其他日志)时追加新行
+        if self.__last_progress is None or doc.lastBlock().text() != self.__last_progress:
+            self.text_edit.appendPlainText(text)
+        else:
+            cursor = QTextCursor(doc)
+            cursor.movePosition(QTextCursor.MoveOperation.End)
+            cursor.movePosition(QTextCursor.MoveOperation.StartOfBlock, QTextCursor.MoveMode.KeepAnchor)
+            cursor.insertText(text)
+        self.__last_progress = text if in_place else None
+        return
@@ -0,0 +1,120 @@
+# This Python file uses the following encoding: utf-8
+# 子进程运行  基于 asyncio，按块读取输出直到管道关闭，Windows / Linux 通用
+# 一个事件循环中可以同时运行多个子进程，见 run_all
+import os
+import time
+import codecs
+import asyncio
+import threading
+import subprocess
+
+READ_CHUNK_SIZE = 65536
+
+
+class ProcessResult:
+    def __init__(self, command: list, exit_code: int, wall_time: float, canceled: bool):
+        self.command = command
+        self.exit_code = exit_code
+        self.wall_time = wall_time  # 秒
+        self.canceled = canceled  # 是否由 stop 结束
+        return
+
+    def __str__(self):
+        return f"Exit Code: {self.exit_code}, Wall Time: {self.wall_time:.2f}s" + (", Canceled" if self.canceled else "")
+
+
+class ProcessRunner:
+    """
+    运行一个子进程，标准输出和标准错误合并后按块读取，解码后交给 on_output(text)
+    进程退出后继续读取到管道关闭，不丢失最后缓冲的输出
+    stop 可在任意线程调用：先 terminate，超过 kill_timeout 秒仍未退出再 kill
+    Windows 上 terminate 与 kill 相同，都是直接结束进程
+    """
+
+    def __init__(self, command: list, on_output=None, cwd: str = None, kill_timeout: float = 5.0):
+        self.command = [str(c) for c in command]
+        self.on_output = on_output
+        self.cwd = cwd
+        self.kill_timeout = kill_timeout
+        self.result = None
+        self.__process = None
+        self.__loop = None
+        self.__stop_requested = False
+        self.__lock = threading.Lock()
+        return
+
+    async def run_async(self):
+        kwargs = dict()
+        if os.name == "nt":
+            # 不弹出控制台窗口
+            kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        t0 = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(*self.command, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT, cwd=self.cwd, **kwargs)
+        with self.__lock:
+            self.__process = process
+            self.__loop = asyncio.get_running_loop()
+            stop_requested = self.__stop_requested
+        # 进程启动前已经请求停止
+        if stop_requested:
+            self.__terminate()
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        while True:
+            data = await process.stdout.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            if self.on_output is not None:
+                self.on_output(decoder.decode(data))
+        tail = decoder.decode(b"", final=True)
+        if tail and self.on_output is not None:
+            self.on_output(tail)
+        exit_code = await process.wait()
+
+        with self.__lock:
+            self.__process = None
+            self.__loop = None
+        self.result = ProcessResult(self.command, exit_code, time.perf_counter() - t0, self.__stop_requested)
+        return self.result
+
+    def run(self):
+        # 在调用方线程中新建事件循环运行，阻塞到进程结束，返回 ProcessResult
+        return asyncio.run(self.run_async())
+
+    def __terminate(self):
+        # 在事件循环线程中执行
+        process = self.__process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            return
+        asyncio.get_running_loop().call_later(self.kill_timeout, self.__kill)
+        return
+
+    def __kill(self):
+        process = self.__process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        return
+
+    def stop(self):
+        with self.__lock:
+            self.__stop_requested = True
+            loop = self.__loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.__terminate)
+        return
+
+
+def run_all(runners: list):
+    # 在当前线程的一个事件循环中同时运行多个子进程，返回 [ProcessResult, ...]，顺序与 runners 一致
+    async def gather():
+        return await asyncio.gather(*(r.run_async() for r in runners))
+
+    return asyncio.run(gather())
@@ -0,0 +1,147 @@
+# This Python file uses the following encoding: utf-8
+# 任务调度  所有后台任务(数据处理、训练、评估、推理、导出)统一排队，按资源类型限制并发数
+import itertools
+from datetime import datetime
+
+from PySide6.QtCore import QObject, Signal
+
+# 任务状态
+JOB_PENDING = "PENDING"
+JOB_RUNNING = "RUNNING"
+JOB_SUCCEEDED = "SUCCEEDED"
+JOB_FAILED = "FAILED"
+JOB_CANCELED = "CANCELED"
+
+# 各类资源同时运行的任务数上限
+#   gpu:   训练、评估、推理、导出，占用显卡或大量 CPU，一次只跑一个
+#   data:  数据集处理，读写磁盘为主
+#   light: 环境检查、训练曲线服务等轻量任务
+DEFAULT_RESOURCE_LIMITS = {"gpu": 1, "data": 2, "light": 4}
+
+
+class JobCanceledError(Exception):
+    # 运行中的任务被取消时，在任务线程中抛出，中断处理流程
+    pass
+
+
+class Job:
+    def __init__(self, job_id: int, name: str, control, resource: str):
+        self.job_id = job_id
+        self.name = name
+        self.control = control  # QThread，需要有 cancel() 和 exit_code
+        self.resource = resource
+        self.state = JOB_PENDING
+        self.cancel_requested = False
+        self.submit_time = datetime.now()
+        self.start_time = None
+        self.end_time = None
+        return
+
+    def __str__(self):
+        return f"Job {self.job_id} [{self.name}]"
+
+
+class JobScheduler(QObject):
+    """
+    先进先出的任务队列，同一资源类型的任务按提交顺序执行，不同资源类型互不阻塞
+    任务对象由调度器持有，直到任务结束，提交新任务不会覆盖正在运行的任务
+    """
+    # (任务序号, 任务名, 状态)
+    job_state_signal = Signal(int, str, str)
+    # (运行中的任务数, 排队中的任务数)
+    queue_changed_signal = Signal(int, int)
+
+    def __init__(self, resource_limits: dict = None, parent=None):
+        super().__init__(parent)
+        self.resource_limits = dict(DEFAULT_RESOURCE_LIMITS)
+        self.resource_limits.update(resource_limits or dict())
+        self.jobs = dict()  # 未结束的任务 {任务序号: Job}
+        self.pending = []  # 排队中的任务序号，按提交顺序
+        self.__id_counter = itertools.count(1)
+        return
+
+    def submit(self, control, name: str, resource: str = None):
+        """
+        提交任务，control 为 *Control 线程对象，resource 默认使用 control.RESOURCE
+        返回 任务序号
+        """
+        resource = resource or control.RESOURCE
+        assert resource in self.resource_limits, f"Error, Unknown job resource: {resource}"
+        job = Job(next(self.__id_counter), name, control, resource)
+        control.finished.connect(lambda: self.__on_finished(job))
+        self.jobs[job.job_id] = job
+        self.pending.append(job.job_id)
+        self.__set_state(job, JOB_PENDING)
+        self.__schedule()
+        return job.job_id
+
+    def cancel(self, job_id: int):
+        # 排队中的任务直接移出队列，运行中的任务通知线程结束，线程结束后状态变为 CANCELED
+        job = self.jobs.get(job_id)
+        if job is None or job.cancel_requested:
+            return False
+        job.cancel_requested = True
+        if job.state == JOB_PENDING:
+            self.pending.remove(job_id)
+            # 未启动的线程不会发出 finished，手动发出，界面照常恢复按钮状态，任务按取消结束
+            job.control.exit_code = 1
+            job.control.finished.emit()
+        else:
+            job.control.cancel()
+        return True
+
+    def cancel_by_name(self, name: str, running_only: bool = True):
+        # 取消指定名称的任务，running_only 为 True 时只取消正在运行的任务，排队中的继续执行
+        ids = [j.job_id for j in self.jobs.values() if j.name == name and (not running_only or j.state == JOB_RUNNING)]
+        for job_id in ids:
+            self.cancel(job_id)
+        return len(ids)
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        return
+
+    def all_jobs(self):
+        # 未结束的任务，按任务序号(提交顺序)
+        return [self.jobs[k] for k in sorted(self.jobs)]
+
+    def running_jobs(self):
+        return [j for j in self.jobs.values() if j.state == JOB_RUNNING]
+
+    def is_busy(self):
+        return len(self.jobs) > 0
+
+    def __set_state(self, job: Job, state: str):
+        job.state = state
+        self.job_state_signal.emit(job.job_id, job.name, state)
+        self.queue_changed_signal.emit(len(self.running_jobs()), len(self.pending))
+        return
+
+    def __schedule(self):
+        running_num = dict()
+        for j in self.running_jobs():
+            running_num[j.resource] = running_num.get(j.resource, 0) + 1
+        for job_id in list(self.pending):
+            job = self.jobs[job_id]
+            if running_num.get(job.resource, 0) >= self.resource_limits[job.resource]:
+                continue
+            running_num[job.resource] = running_num.get(job.resource, 0) + 1
+            self.pending.remove(job_id)
+            job.start_time = datetime.now()
+            self.__set_state(job, JOB_RUNNING)
+            job.control.start()
+        return
+
+    def __on_finished(self, job: Job):
+        job.end_time = datetime.now()
+        self.jobs.pop(job.job_id, None)
+        if job.cancel_requested:
+            state = JOB_CANCELED
+        elif getattr(job.control, "exit_code", 0) != 0:
+            state = JOB_FAILED
+        else:
+            state = JOB_SUCCEEDED
+        self.__set_state(job, state)
+        self.__schedule()
+        return
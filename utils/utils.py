@@ -1,12 +1,18 @@
 import os
+import sys
 import shutil
+import struct
+import threading
+import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 
-def create_dir(target_dir):
-    if os.path.isdir(target_dir):
+def create_dir(target_dir, is_rm=True):
+    # is_rm: 文件夹已存在时是否清空
+    if is_rm and os.path.isdir(target_dir):
         shutil.rmtree(target_dir)
-    os.makedirs(target_dir)
+    os.makedirs(target_dir, exist_ok=True)
     return os.path.abspath(target_dir)
 
 
@@ -18,9 +24,223 @@ def get_timenow():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
-def copy_files(src_dir, dst_dir, files):
+# 数据集文件的生成方式：复制 / 硬链接 / 软链接 / 写时复制(reflink)
+# 注意：硬链接和原图是同一份数据，修改数据集中的图片会同时修改原图
+MATERIALIZE_MODES = ("copy", "hardlink", "symlink", "reflink")
+_FICLONE = 0x40049409  # linux ioctl: 共享数据块的文件克隆 (btrfs/xfs/...)
+
+
+def _reflink(src_pth, dst_pth):
+    if sys.platform.startswith("linux"):
+        import fcntl
+        with open(src_pth, "rb") as s, open(dst_pth, "wb") as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+    elif sys.platform == "darwin":
+        import ctypes
+        libc = ctypes.CDLL("libc.dylib", use_errno=True)
+        if libc.clonefile(os.fsencode(src_pth), os.fsencode(dst_pth), 0) != 0:
+            raise OSError(ctypes.get_errno(), "clonefile failed", src_pth)
+    else:
+        raise OSError(f"reflink not supported on {sys.platform}")
+    return
+
+
+def is_same_device(src_pth, dst_dir):
+    # 硬链接和 reflink 都要求源文件和目标在同一个文件系统上
+    try:
+        return os.stat(src_pth).st_dev == os.stat(dst_dir).st_dev
+    except OSError:
+        return False
+
+
+def materialize_file(src_pth, dst_pth, mode="copy"):
+    """
+    按 mode 生成目标文件，不支持时(跨盘、文件系统不支持、没有权限)自动退回复制
+    返回实际使用的方式
+    """
+    assert mode in MATERIALIZE_MODES, f"Error, Unknown materialize mode: {mode}"
+    # 目标已存在时先删除：旧文件可能是指向原图的链接，直接覆盖写入会破坏原图
+    if os.path.lexists(dst_pth):
+        os.remove(dst_pth)
+
+    if mode in ("hardlink", "reflink") and not is_same_device(src_pth, os.path.dirname(os.path.abspath(dst_pth))):
+        mode = "copy"
+    try:
+        if mode == "hardlink":
+            os.link(src_pth, dst_pth)
+        elif mode == "symlink":
+            os.symlink(os.path.abspath(src_pth), dst_pth)
+        elif mode == "reflink":
+            _reflink(src_pth, dst_pth)
+    except OSError:
+        if os.path.lexists(dst_pth):
+            os.remove(dst_pth)
+        mode = "copy"
+
+    if mode == "copy":
+        shutil.copyfile(src_pth, dst_pth)
+    return mode
+
+
+def copy_files(src_dir, dst_dir, files, mode="copy"):
     for file in files:
         tmp_pth = os.path.join(src_dir, file)
         if not os.path.isfile(tmp_pth): continue
-        shutil.copyfile(tmp_pth, os.path.join(dst_dir, file))
+        materialize_file(tmp_pth, os.path.join(dst_dir, file), mode)
+    return
+
+
+def remove_files(files):
+    for file in files:
+        # lexists：原图被删除后失效的链接也要删除，isfile 对失效链接返回 False
+        if os.path.lexists(file):
+            os.remove(file)
     return
+
+
+def get_worker_num(num_workers=None):
+    # None 时按CPU核数自动确定，文件读写为主的任务线程数可以多于核数
+    if num_workers is None:
+        num_workers = min(32, (os.cpu_count() or 1) + 4)
+    return max(1, int(num_workers))
+
+
+def parallel_map(func, items, num_workers=None, use_process=False, callback=None):
+    """
+    对 items 中的每一项执行 func，结果顺序与 items 一致
+    num_workers == 1 时串行执行，可用于与并行结果做对比
+    use_process: 计算密集型任务使用进程池，此时 func 需要是模块级函数
+    callback: 每完成一项调用一次 callback(已完成数量)，在调用方线程中执行，用于汇报进度
+    """
+    items = list(items)
+    num_workers = get_worker_num(num_workers)
+
+    def collect(results):
+        ret = []
+        for r in results:
+            ret.append(r)
+            if callback is not None:
+                callback(len(ret))
+        return ret
+
+    if num_workers == 1 or len(items) <= 1:
+        return collect(func(item) for item in items)
+
+    if use_process:
+        chunksize = max(1, len(items) // (num_workers * 4))
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+        results = executor.map(func, items, chunksize=chunksize)
+    else:
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+        results = executor.map(func, items)
+    try:
+        ret = collect(results)
+    except BaseException:
+        # 出错或 callback 中取消任务时，丢弃还没开始的项，不再等全部执行完
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+    return ret
+
+
+class ProgressMeter:
+    """
+    进度统计：已完成数量、吞吐量(个/秒)、预计剩余时间(秒，未知时为 -1)
+    report(stage, done, total, rate, eta) 最多每 min_interval 秒调用一次，完成时一定调用
+    """
+
+    def __init__(self, stage: str, total: int, report, min_interval: float = 0.2):
+        self.stage = stage
+        self.total = total
+        self.report = report
+        self.min_interval = min_interval
+        self.start_time = time.perf_counter()
+        self.last_time = 0.0
+        return
+
+    def __call__(self, done: int):
+        now = time.perf_counter()
+        if (self.total <= 0 or done < self.total) and now - self.last_time < self.min_interval:
+            return
+        self.last_time = now
+        cost = max(now - self.start_time, 1e-6)
+        rate = done / cost
+        eta = (self.total - done) / rate if self.total > 0 and rate > 0 else -1.0
+        self.report(self.stage, done, self.total, rate, eta)
+        return
+
+
+_IMAGE_SIZE_CACHE = {}
+_IMAGE_SIZE_LOCK = threading.Lock()
+
+
+def _read_jpeg_size(fp):
+    # 逐个跳过 JPEG 段，直到 SOFn 段，从中读取宽高
+    fp.seek(2)
+    while True:
+        marker = fp.read(2)
+        while len(marker) == 2 and marker[0] == 0xFF and marker[1] == 0xFF:
+            marker = marker[1:] + fp.read(1)  # 填充字节
+        if len(marker) != 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            continue
+        seg_len = fp.read(2)
+        if len(seg_len) != 2:
+            return None
+        seg_len = struct.unpack(">H", seg_len)[0]
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            data = fp.read(5)
+            if len(data) != 5:
+                return None
+            h, w = struct.unpack(">HH", data[1:5])
+            return w, h
+        fp.seek(seg_len - 2, os.SEEK_CUR)
+
+
+def read_image_header_size(image_pth):
+    """
+    只读取文件头获取图片尺寸 (w, h)，支持 JPEG/PNG/BMP，不解码像素数据
+    不支持的格式返回 None
+    """
+    with open(image_pth, "rb") as fp:
+        head = fp.read(26)
+        if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if head[:2] == b"BM" and len(head) >= 26:
+            w, h = struct.unpack("<ii", head[18:26])
+            return w, abs(h)
+        if head[:2] == b"\xff\xd8":
+            return _read_jpeg_size(fp)
+    return None
+
+
+def get_image_size(image_pth, json_info: dict = None):
+    """
+    获取图片尺寸 (w, h)
+    1. 优先使用 labelme json 中记录的 imageWidth/imageHeight
+    2. 其次只读取图片文件头
+    3. 以上都不行时，使用 PIL 懒加载读取（不解码像素）
+    文件头读取的结果按路径缓存，文件大小或修改时间变化时重新读取
+    """
+    if json_info is not None and json_info.get("imageWidth") and json_info.get("imageHeight"):
+        return int(json_info["imageWidth"]), int(json_info["imageHeight"])
+
+    stat = os.stat(image_pth)
+    key = os.path.abspath(image_pth)
+    with _IMAGE_SIZE_LOCK:
+        cached = _IMAGE_SIZE_CACHE.get(key)
+    if cached is not None and cached[0] == (stat.st_size, stat.st_mtime_ns):
+        return cached[1]
+
+    size = read_image_header_size(image_pth)
+    if size is None:
+        from PIL import Image
+        with Image.open(image_pth) as img:
+            size = img.size
+    size = (int(size[0]), int(size[1]))
+
+    with _IMAGE_SIZE_LOCK:
+        _IMAGE_SIZE_CACHE[key] = ((stat.st_size, stat.st_mtime_ns), size)
+    return size